@@ -1,6 +1,8 @@
 import os
 import dotenv
 import hashlib
+import tempfile
+from cybercast.utils.audio_utils import normalize_audio
 
 dotenv.load_dotenv()
 
@@ -10,6 +12,9 @@ class BaseTTS:
         if self.cache_dir is None:
             self.cache_dir = os.getenv("TTS_CACHE_DIR")
 
+        # 入缓存时统一转码为规范格式，整集合并时可以直接 -c copy 拼接
+        self.normalize = os.getenv("TTS_NORMALIZE", "1") == "1"
+
         print(f"TTS cache dir: {self.cache_dir}")
         if not os.path.exists(self.cache_dir):
             os.makedirs(self.cache_dir)
@@ -22,6 +27,17 @@ class BaseTTS:
         return os.path.join(self.cache_dir, f"{self.gen_text_hash(cache_key)}.mp3")
 
     def save_audio(self, audio_data: bytes, path: str):
+        if self.normalize:
+            # 各后端的采样率、声道不同，原始数据先写临时文件，转码后再放入缓存
+            fd, raw_path = tempfile.mkstemp(suffix=".raw", dir=os.path.dirname(os.path.abspath(path)))
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(audio_data)
+                if normalize_audio(raw_path, path):
+                    return
+                print(f"Warning: failed to normalize TTS audio, caching it as-is: {path}")
+            finally:
+                os.remove(raw_path)
         with open(path, "wb") as f:
             f.write(audio_data)
 
@@ -0,0 +1,255 @@
+import re
+import shutil
+import tempfile
+import subprocess
+import numpy as np
+from cybercast.utils.ffmpeg_runner import run_ffmpeg
+
+BYTES_PER_SAMPLE = 4  # f32le
+CHANNEL_LAYOUTS = {"mono": 1, "stereo": 2, "2.1": 3, "quad": 4, "5.0": 5, "5.1": 6, "7.1": 8}
+
+
+def probe_audio(path: str, ffmpeg_path: str = "ffmpeg") -> dict:
+    """
+    读取 `ffmpeg -i` 打印的流信息，获取第一路音频的采样率、声道数和时长，不解码音频。
+
+    Args:
+        path (str): 音频文件路径。
+        ffmpeg_path (str, optional): ffmpeg 可执行文件路径。默认为 "ffmpeg"。
+
+    Returns:
+        dict: {'sample_rate': int | None, 'channels': int | None, 'duration': float | None}，无法解析的字段为 None。
+    """
+    result = run_ffmpeg([ffmpeg_path, '-hide_banner', '-nostdin', '-i', path], label=f"probe: {path}", check=False)
+    info = {'sample_rate': None, 'channels': None, 'duration': None}
+    for line in result.stderr.split('\n'):
+        if 'Duration:' in line and info['duration'] is None:
+            time_str = line.split('Duration:')[1].split(',')[0].strip()
+            try:
+                h, m, s = map(float, time_str.split(':'))
+                info['duration'] = h * 3600 + m * 60 + s
+            except ValueError:
+                pass  # Duration: N/A
+        elif 'Audio:' in line and info['sample_rate'] is None:
+            # 例如: Stream #0:0: Audio: mp3 (mp3float), 24000 Hz, mono, fltp, 48 kb/s
+            match = re.search(r'(\d+) Hz, ([^,]+)', line)
+            if match:
+                info['sample_rate'] = int(match.group(1))
+                layout = match.group(2).strip().split('(')[0]
+                channels = re.match(r'(\d+) channels', layout)
+                info['channels'] = int(channels.group(1)) if channels else CHANNEL_LAYOUTS.get(layout)
+    if info['sample_rate'] is None and result.returncode != 0 and 'Duration:' not in result.stderr:
+        raise RuntimeError(f"无法读取音频文件 {path}: {result.stderr.strip().splitlines()[-1:]}")
+    return info
+
+
+class FFmpegAudioStream:
+    """
+    通过 `ffmpeg -f f32le` 管道按块读取解码后的 PCM，直接写入 NumPy 缓冲区。
+
+    声道下混在读取时完成（多声道取平均，与 librosa 的 mono=True 一致），
+    降采样由 ffmpeg 的重采样器完成，整段音频无需先以原始采样率完整载入内存。
+    """
+
+    def __init__(self, path: str, sample_rate: int = None, mono: bool = True, ffmpeg_path: str = "ffmpeg"):
+        """
+        Args:
+            path (str): 音频文件路径。
+            sample_rate (int, optional): 输出采样率，None 表示保持原始采样率。
+            mono (bool, optional): 是否下混为单声道。默认为 True。
+            ffmpeg_path (str, optional): ffmpeg 可执行文件路径。默认为 "ffmpeg"。
+        """
+        self.path = path
+        self.mono = mono
+        self.ffmpeg_path = ffmpeg_path
+        self.requested_sample_rate = sample_rate
+        self.sample_rate = sample_rate
+        self.source_channels = None
+        self.duration = None
+        self.samples_read = 0
+        self.process = None
+        self._stderr_file = None
+
+    def open(self) -> None:
+        if not shutil.which(self.ffmpeg_path):
+            raise FileNotFoundError(f"ffmpeg 未找到: {self.ffmpeg_path}")
+        info = probe_audio(self.path, self.ffmpeg_path)
+        self.duration = info['duration']
+        self.source_channels = info['channels']
+        if self.sample_rate is None:
+            self.sample_rate = info['sample_rate']
+        if self.sample_rate is None:
+            raise RuntimeError(f"无法确定音频采样率: {self.path}")
+
+        cmd = [self.ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-nostdin',
+               '-i', self.path, '-map', '0:a:0', '-vn', '-f', 'f32le', '-acodec', 'pcm_f32le']
+        if self.source_channels is None:
+            # 无法识别的声道布局：单声道输出交给 ffmpeg 下混，否则统一为双声道
+            self.source_channels = 1 if self.mono else 2
+            cmd += ['-ac', str(self.source_channels)]
+        if self.requested_sample_rate is not None:
+            cmd += ['-ar', str(self.sample_rate)]
+        cmd.append('-')
+
+        self._stderr_file = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                        stderr=self._stderr_file)
+
+    @property
+    def channels(self) -> int:
+        """read 返回的每个采样点的声道数。"""
+        return 1 if self.mono else self.source_channels
+
+    @property
+    def estimated_samples(self) -> int | None:
+        """按容器时长估算的总采样点数，用于预分配缓冲区；时长未知时为 None。"""
+        if self.duration is None:
+            return None
+        return int(self.duration * self.sample_rate) + 1
+
+    def read_into(self, out: np.ndarray) -> int:
+        """
+        读取最多 len(out) 个采样点写入 out，返回实际读取的采样点数，返回 0 表示已读完。
+
+        Args:
+            out (np.ndarray): float32 缓冲区，单声道时形状为 (n,)，否则为 (n, channels)。
+        """
+        source_channels = self.source_channels
+        if source_channels == 1 or not self.mono:
+            # 不需要下混：直接把管道数据读进调用方的缓冲区
+            n = self._read_exact(memoryview(out.reshape(-1)).cast('B')) // (BYTES_PER_SAMPLE * source_channels)
+        else:
+            interleaved = np.empty((len(out), source_channels), dtype=np.float32)
+            n = self._read_exact(memoryview(interleaved.reshape(-1)).cast('B')) // (BYTES_PER_SAMPLE * source_channels)
+            np.mean(interleaved[:n], axis=1, out=out[:n])
+        self.samples_read += n
+        return n
+
+    def read(self, max_samples: int) -> np.ndarray:
+        """读取最多 max_samples 个采样点，返回新数组；读完时返回空数组。"""
+        shape = (max_samples,) if self.channels == 1 else (max_samples, self.channels)
+        out = np.empty(shape, dtype=np.float32)
+        return out[:self.read_into(out)]
+
+    def _read_exact(self, view: memoryview) -> int:
+        """尽量填满 view，只有在到达流末尾时才会返回更少的字节（末尾不完整的采样点被丢弃）。"""
+        total = 0
+        stdout = self.process.stdout
+        while total < len(view):
+            n = stdout.readinto(view[total:])
+            if not n:
+                break
+            total += n
+        if total < len(view):
+            self._check_exit()
+        return total - total % (BYTES_PER_SAMPLE * self.source_channels)
+
+    def _check_exit(self) -> None:
+        returncode = self.process.wait()
+        if returncode != 0:
+            self._stderr_file.seek(0)
+            stderr = self._stderr_file.read().decode('utf-8', errors='replace')
+            raise RuntimeError(f"ffmpeg 解码失败，返回码: {returncode}\n{stderr}")
+
+    def close(self) -> None:
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.stdout.close()
+            self.process.wait()
+            self.process = None
+        if self._stderr_file is not None:
+            self._stderr_file.close()
+            self._stderr_file = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def decode_audio(
+    path: str,
+    sample_rate: int = None,
+    mono: bool = True,
+    ffmpeg_path: str = "ffmpeg",
+    chunk_seconds: float = 2.0,
+) -> tuple[np.ndarray, int]:
+    """
+    解码整个音频文件为 float32 数组，可替代 librosa.load(path, sr=sample_rate, mono=mono)。
+
+    按容器时长预分配输出缓冲区并把 ffmpeg 输出直接读进去，峰值内存约等于结果数组本身。
+
+    Args:
+        path (str): 音频文件路径。
+        sample_rate (int, optional): 输出采样率，None 表示保持原始采样率。
+        mono (bool, optional): 是否下混为单声道。默认为 True。
+        ffmpeg_path (str, optional): ffmpeg 可执行文件路径。默认为 "ffmpeg"。
+        chunk_seconds (float, optional): 每次从管道读取的时长（秒）。默认为 2.0。
+
+    Returns:
+        tuple[np.ndarray, int]: (采样数据, 采样率)。单声道时形状为 (n,)，否则为 (n, channels)。
+    """
+    with FFmpegAudioStream(path, sample_rate=sample_rate, mono=mono, ffmpeg_path=ffmpeg_path) as stream:
+        chunk = max(1, int(stream.sample_rate * chunk_seconds))
+        capacity = (stream.estimated_samples or chunk) + chunk
+        tail_shape = () if stream.channels == 1 else (stream.channels,)
+        out = np.empty((capacity, *tail_shape), dtype=np.float32)
+        length = 0
+        while True:
+            if capacity - length < chunk:
+                # 容器时长偏短（例如 VBR 文件缺少索引），按 1.5 倍扩容
+                capacity = int(capacity * 1.5) + chunk
+                grown = np.empty((capacity, *tail_shape), dtype=np.float32)
+                grown[:length] = out[:length]
+                out = grown
+            n = stream.read_into(out[length:length + chunk])
+            if n == 0:
+                break
+            length += n
+        return out[:length], stream.sample_rate
+
+
+def iter_audio_chunks(
+    path: str,
+    chunk_seconds: float = 10.0,
+    sample_rate: int = None,
+    mono: bool = True,
+    ffmpeg_path: str = "ffmpeg",
+):
+    """
+    按固定时长分块解码音频，依次产出 (采样数据, 采样率)，内存占用只与块大小有关。
+
+    产出的数组复用同一块缓冲区，下一次迭代时会被覆盖，需要保留时请自行拷贝。
+
+    Args:
+        path (str): 音频文件路径。
+        chunk_seconds (float, optional): 每块的时长（秒）。默认为 10.0。
+        其余参数同 decode_audio。
+    """
+    with FFmpegAudioStream(path, sample_rate=sample_rate, mono=mono, ffmpeg_path=ffmpeg_path) as stream:
+        chunk = max(1, int(stream.sample_rate * chunk_seconds))
+        shape = (chunk,) if stream.channels == 1 else (chunk, stream.channels)
+        buffer = np.empty(shape, dtype=np.float32)
+        while True:
+            n = stream.read_into(buffer)
+            if n == 0:
+                break
+            yield buffer[:n], stream.sample_rate
+
+
+def count_audio_samples(path: str, sample_rate: int = None, ffmpeg_path: str = "ffmpeg") -> tuple[int, int]:
+    """
+    完整解码一遍音频但不保留数据，返回精确的 (采样点数, 采样率)。
+
+    容器中的时长对 VBR MP3 只是估计值，需要精确长度（例如按采样划分视频帧）时使用。
+    """
+    total = 0
+    rate = sample_rate
+    for samples, rate in iter_audio_chunks(path, sample_rate=sample_rate, mono=True, ffmpeg_path=ffmpeg_path):
+        total += len(samples)
+    if rate is None:
+        rate = probe_audio(path, ffmpeg_path)['sample_rate']
+    return total, rate
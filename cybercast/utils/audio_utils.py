@@ -1,8 +1,16 @@
 # coding: utf-8
 
 import os
-import subprocess
 import json
+import tempfile
+from cybercast.utils.ffmpeg_runner import run_ffmpeg, FFmpegError
+from cybercast.utils.mp3_probe import read_mp3_info, duration_cache
+
+
+# TTS 音频入缓存时统一转换成的格式。所有片段格式一致后，整集合并只需 -c copy 拼接字节
+CANONICAL_SAMPLE_RATE = 44100
+CANONICAL_CHANNELS = 2
+CANONICAL_BITRATE = '192k'
 
 
 def format_time(seconds):
@@ -14,10 +22,34 @@ def format_time(seconds):
     return f"{hours:02d}:{minutes:02d}:{secs:02d}.{ms:03d}"
 
 def get_mp3_duration(mp3_path: str) -> float:
-    """Get duration of an MP3 file in seconds using ffmpeg"""
+    """
+    Get duration of an MP3 file in seconds.
+
+    在进程内解析帧头（精确到采样），结果按路径、大小和修改时间记在目录下的 .durations.json 中；
+    无法解析时退回 ffmpeg 探测。
+    """
+    try:
+        duration = duration_cache.get(mp3_path)
+        if duration is not None:
+            return duration
+        info = read_mp3_info(mp3_path)
+    except OSError as e:
+        print(f"Error getting duration for {mp3_path}: {e}")
+        return 0.0
+    if info is not None:
+        duration_cache.put(mp3_path, info.duration)
+        return info.duration
+
+    duration = probe_duration_ffmpeg(mp3_path)
+    if duration > 0:
+        duration_cache.put(mp3_path, duration)
+    return duration
+
+def probe_duration_ffmpeg(mp3_path: str) -> float:
+    """Get duration of an audio file in seconds using ffmpeg"""
     cmd = ['ffmpeg', '-i', mp3_path, '-hide_banner']
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        result = run_ffmpeg(cmd, label=f"probe: {mp3_path}", check=False)
         # Extract duration from ffmpeg output
         for line in result.stderr.split('\n'):
             if 'Duration:' in line:
@@ -28,8 +60,112 @@ def get_mp3_duration(mp3_path: str) -> float:
         print(f"Error getting duration for {mp3_path}: {e}")
     return 0.0
 
-def concat_audios(concat_file: str, output_path: str):
-    """Merge multiple MP3 files into one"""
+def normalize_audio(input_path: str, output_path: str) -> bool:
+    """
+    把音频转码为规范格式（MP3 / 44.1 kHz / 双声道 / 192k CBR），不写 Xing 标签和 ID3 标签。
+
+    不带 LAME 标签时解码器不裁剪编码延迟，单个文件的时长恰好等于 帧数 × 1152 个采样，
+    多个规范文件直接拼接（-c copy）后每段的起点与逐个文件累加的时长完全一致。
+
+    Args:
+        input_path (str): 任意 ffmpeg 能解码的音频。
+        output_path (str): 输出路径，可以与 input_path 相同（先写临时文件再替换）。
+
+    Returns:
+        bool: 是否成功。失败时 output_path 保持不变。
+    """
+    fd, temp_path = tempfile.mkstemp(suffix=".mp3", dir=os.path.dirname(os.path.abspath(output_path)))
+    os.close(fd)
+    cmd = [
+        'ffmpeg', '-hide_banner', '-nostdin', '-y', '-i', input_path,
+        '-map', '0:a:0', '-map_metadata', '-1',
+        '-c:a', 'libmp3lame', '-ar', str(CANONICAL_SAMPLE_RATE), '-ac', str(CANONICAL_CHANNELS),
+        '-b:a', CANONICAL_BITRATE, '-write_xing', '0', '-id3v2_version', '0',
+        '-f', 'mp3', temp_path
+    ]
+    try:
+        run_ffmpeg(cmd, label="normalize_audio")
+        os.replace(temp_path, output_path)
+        return True
+    except FFmpegError as e:
+        print(f"Error normalizing {input_path}: {e}")
+        return False
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def is_canonical_mp3(mp3_path: str) -> bool:
+    """是否为 normalize_audio 输出的规范格式（按帧头判断，不启动 ffmpeg）。"""
+    try:
+        info = read_mp3_info(mp3_path)
+    except OSError:
+        return False
+    return info is not None and not info.tagged and info.sample_rate == CANONICAL_SAMPLE_RATE \
+        and info.channels == CANONICAL_CHANNELS
+
+def write_chapter_metadata(metadata_file: str, audio_files: list[str], durations: list[float]) -> list[dict]:
+    """
+    按各片段时长写入 ffmpeg 章节元数据文件，返回每个片段的时间信息。
+    """
+    segments_info = []
+    current_position = 0.0
+
+    print("\nAnalyzing segments:")
+    print("-----------------------")
+
+    with open(metadata_file, 'w', encoding='utf-8') as f:
+        f.write(";FFMETADATA1\n")  # 必需的元数据头部
+
+        for i, (audio_file, duration) in enumerate(zip(audio_files, durations)):
+            start_time = current_position
+            end_time = start_time + duration
+
+            file_name = os.path.basename(audio_file)
+
+            # 写入章节信息
+            f.write(f"[CHAPTER]\nTIMEBASE=1/1000\n")
+            f.write(f"START={int(start_time*1000)}\n")
+            f.write(f"END={int(end_time*1000)}\n")
+            f.write(f"title=Segment {i+1}: {file_name}\n\n")
+
+            # 格式化为 HH:MM:SS 格式
+            start_formatted = format_time(start_time)
+            end_formatted = format_time(end_time)
+
+            segment_info = {
+                "index": i,
+                "file": file_name,
+                "full_path": audio_file,
+                "original_duration": duration,
+                "start_time": start_time,
+                "end_time": end_time,
+                "start_formatted": start_formatted,
+                "end_formatted": end_formatted
+            }
+
+            segments_info.append(segment_info)
+            current_position = end_time
+
+            print(f"Segment {i+1}: {file_name}")
+            print(f"  Duration: {format_time(duration)}")
+            print(f"  Position: {start_formatted} - {end_formatted}")
+
+    print("-----------------------")
+    print(f"Total estimated duration: {format_time(current_position)}")
+    return segments_info
+
+def concat_audios(concat_file: str, output_path: str, force_reencode: bool = False):
+    """
+    Merge multiple MP3 files into one
+
+    所有片段都是规范格式（见 normalize_audio）时，拼接和写入章节在一次 -c copy 中完成，耗时只与字节数成正比；
+    否则（例如旧版缓存中未规范化的音频）重新编码合并，再单独写入章节。
+
+    Args:
+        concat_file (str): ffmpeg concat 列表文件，每行 "file PATH"。
+        output_path (str): 输出的 MP3 路径。
+        force_reencode (bool, optional): 即使片段格式一致也重新编码。默认为 False。
+    """
     # 先验证合并列表文件存在且非空
     if not os.path.exists(concat_file):
         print(f"Error: Concat file {concat_file} does not exist")
@@ -67,132 +203,83 @@ def concat_audios(concat_file: str, output_path: str):
         for line in valid_lines:
             f.write(f"{line}\n")
 
-    # 创建临时的元数据文件，用于添加章节标记
+    # 时长在进程内解析帧头得到，合并前即可写出带真实时间点的章节元数据
     metadata_file = concat_file + ".metadata"
-    with open(metadata_file, 'w', encoding='utf-8') as f:
-        f.write(";FFMETADATA1\n")  # 必需的元数据头部
-        
-        # 为每个音频文件创建一个章节标记
-        # 我们无法预先知道合并后的时间点，所以先用占位符
-        # 稍后我们将使用ffprobe来获取实际的章节时间
-        for i, audio_file in enumerate(audio_files):
-            file_name = os.path.basename(audio_file)
-            f.write(f"[CHAPTER]\nTIMEBASE=1/1000\n")
-            f.write(f"START=0\n")  # 这是占位符
-            f.write(f"END=0\n")    # 这是占位符
-            f.write(f"title=Segment {i+1}: {file_name}\n\n")
-    
-    # 先执行音频合并
-    temp_output = output_path + ".temp.mp3"
-    cmd = [
-        'ffmpeg', '-y', '-f', 'concat', '-safe', '0',
-        '-i', concat_file,
-        '-ar', '44100',       # 采样率
-        '-ac', '2',           # 双声道
-        '-b:a', '192k',       # 比特率
-        temp_output
-    ]
+    durations = [get_mp3_duration(audio_file) for audio_file in audio_files]
+    segments_info = write_chapter_metadata(metadata_file, audio_files, durations)
+    estimated_duration = segments_info[-1]["end_time"]
 
-    print(f"FFMPEG concatenation command:")
-    print(' '.join(cmd))
-    
+    stream_copy = not force_reencode and all(is_canonical_mp3(audio_file) for audio_file in audio_files)
+    temp_output = output_path + ".temp.mp3"
     try:
-        result = subprocess.run(cmd, check=True, stderr=subprocess.PIPE, text=True)
-        print(f"Successfully merged audio files")
-        
-        # 使用ffprobe分析每个原始音频文件，获取实际时长
-        segments_info = []
-        current_position = 0.0
-        
-        print("\nAnalyzing segments:")
-        print("-----------------------")
-        
-        # 重新创建元数据文件，这次带有真实时间点
-        with open(metadata_file, 'w', encoding='utf-8') as f:
-            f.write(";FFMETADATA1\n")  # 必需的元数据头部
-            
-            for i, audio_file in enumerate(audio_files):
-                duration = get_mp3_duration(audio_file)
-                start_time = current_position
-                end_time = start_time + duration
-                
-                file_name = os.path.basename(audio_file)
-                
-                # 写入章节信息
-                f.write(f"[CHAPTER]\nTIMEBASE=1/1000\n")
-                f.write(f"START={int(start_time*1000)}\n")
-                f.write(f"END={int(end_time*1000)}\n")
-                f.write(f"title=Segment {i+1}: {file_name}\n\n")
-                
-                # 格式化为 HH:MM:SS 格式
-                start_formatted = format_time(start_time)
-                end_formatted = format_time(end_time)
-                
-                segment_info = {
-                    "index": i,
-                    "file": file_name,
-                    "full_path": audio_file,
-                    "original_duration": duration,
-                    "start_time": start_time,
-                    "end_time": end_time,
-                    "start_formatted": start_formatted,
-                    "end_formatted": end_formatted
-                }
-                
-                segments_info.append(segment_info)
-                current_position = end_time
-                
-                print(f"Segment {i+1}: {file_name}")
-                print(f"  Duration: {format_time(duration)}")
-                print(f"  Position: {start_formatted} - {end_formatted}")
-        
-        print("-----------------------")
-        print(f"Total estimated duration: {format_time(current_position)}")
-        
-        # 将章节元数据添加到合并后的音频
-        cmd = [
-            'ffmpeg', '-y',
-            '-i', temp_output,
-            '-i', metadata_file,
-            '-map_metadata', '1',
-            '-codec', 'copy',
-            output_path
-        ]
-        
-        print(f"\nAdding chapter markers:")
-        print(' '.join(cmd))
-        
-        result = subprocess.run(cmd, check=True, stderr=subprocess.PIPE, text=True)
-        
-        # 删除临时文件
-        if os.path.exists(temp_output):
-            os.remove(temp_output)
-        if os.path.exists(metadata_file):
-            os.remove(metadata_file)
-            
-        # 获取最终输出文件的实际时长
-        final_duration = get_mp3_duration(output_path)
-        
-        # 如果预估时长与实际时长差异较大（超过1秒），打印警告
-        if abs(final_duration - current_position) > 1.0:
-            print(f"\nWarning: Estimated duration ({format_time(current_position)}) differs from actual duration ({format_time(final_duration)})")
-            print("Segment timestamps may not be fully accurate due to re-encoding.")
-            
-        print(f"\nSuccessfully created merged audio with chapter markers: {output_path}")
-        print(f"Final duration: {format_time(final_duration)}")
-        
-        # 保存片段信息到JSON文件
-        segments_json = os.path.splitext(output_path)[0] + "_segments.json"
-        with open(segments_json, 'w', encoding='utf-8') as f:
-            json.dump(segments_info, f, indent=2)
-        print(f"Segments timeline saved to {segments_json}")
-        
-        return True
-    except subprocess.CalledProcessError as e:
+        if stream_copy:
+            # 拼接和章节一次完成，只复制 MP3 帧，不解码
+            cmd = [
+                'ffmpeg', '-y', '-f', 'concat', '-safe', '0',
+                '-i', concat_file,
+                '-i', metadata_file,
+                '-map', '0:a', '-map_metadata', '1',
+                '-c', 'copy',
+                output_path
+            ]
+            print(f"FFMPEG concatenation command (stream copy):")
+            print(' '.join(cmd))
+            run_ffmpeg(cmd, label="concat_audios")
+        else:
+            print("Segments are not all in the canonical format, re-encoding the episode")
+            cmd = [
+                'ffmpeg', '-y', '-f', 'concat', '-safe', '0',
+                '-i', concat_file,
+                '-ar', '44100',       # 采样率
+                '-ac', '2',           # 双声道
+                '-b:a', '192k',       # 比特率
+                temp_output
+            ]
+
+            print(f"FFMPEG concatenation command:")
+            print(' '.join(cmd))
+            run_ffmpeg(cmd, label="concat_audios")
+            print(f"Successfully merged audio files")
+
+            # 将章节元数据添加到合并后的音频
+            cmd = [
+                'ffmpeg', '-y',
+                '-i', temp_output,
+                '-i', metadata_file,
+                '-map_metadata', '1',
+                '-codec', 'copy',
+                output_path
+            ]
+
+            print(f"\nAdding chapter markers:")
+            print(' '.join(cmd))
+            run_ffmpeg(cmd, label="add_chapters")
+    except FFmpegError as e:
         print(f"Error processing audio files: {e}")
         print(f"FFMPEG stderr: {e.stderr}")
+        return False
+    finally:
+        # 删除临时文件
         if os.path.exists(temp_output):
             os.remove(temp_output)
         if os.path.exists(metadata_file):
             os.remove(metadata_file)
-        return False
\ No newline at end of file
+
+    # 获取最终输出文件的实际时长
+    final_duration = get_mp3_duration(output_path)
+
+    # 如果预估时长与实际时长差异较大（超过1秒），打印警告
+    if abs(final_duration - estimated_duration) > 1.0:
+        print(f"\nWarning: Estimated duration ({format_time(estimated_duration)}) differs from actual duration ({format_time(final_duration)})")
+        print("Segment timestamps may not be fully accurate due to re-encoding.")
+
+    print(f"\nSuccessfully created merged audio with chapter markers: {output_path}")
+    print(f"Final duration: {format_time(final_duration)}")
+
+    # 保存片段信息到JSON文件
+    segments_json = os.path.splitext(output_path)[0] + "_segments.json"
+    with open(segments_json, 'w', encoding='utf-8') as f:
+        json.dump(segments_info, f, indent=2)
+    print(f"Segments timeline saved to {segments_json}")
+
+    return True
@@ -0,0 +1,258 @@
+import os
+import re
+import json
+import shutil
+import tempfile
+from fractions import Fraction
+from cybercast.utils.ffmpeg_runner import run_ffmpeg, get_job_queue
+
+
+def packet_duration(framecrc: str) -> float | None:
+    """
+    由 framecrc 输出的逐包时间戳计算时长：所有流最后一个包的 pts + duration 减去最早的 pts。
+    完全位于 0 之前的包（AAC 编码延迟，解码后丢弃）不计入起点。
+
+    时间戳按各流的时间基精确换算，不受 `ffmpeg -i` 打印的 Duration（截断到 10 毫秒）影响。
+    没有数据包时返回 None。
+    """
+    time_bases = {}
+    start = end = None
+    for line in framecrc.split('\n'):
+        if line.startswith('#tb '):
+            # 例如: #tb 0: 1/15360
+            index, time_base = line[4:].split(':')
+            time_bases[int(index)] = Fraction(time_base.strip())
+        elif line and not line.startswith('#'):
+            # 流序号, dts, pts, duration, size, hash
+            fields = line.split(',')
+            index, pts, duration = int(fields[0]), int(fields[2]), int(fields[3])
+            packet_start, packet_end = pts * time_bases[index], (pts + duration) * time_bases[index]
+            end = packet_end if end is None else max(end, packet_end)
+            if packet_end > 0:
+                start = packet_start if start is None else min(start, packet_start)
+    if end is None:
+        return None
+    return float(end - (start or 0))
+
+def probe_media(video_file: str, ffmpeg_path: str = "ffmpeg") -> dict:
+    """
+    读取容器和流信息以及精确时长：一次 `ffmpeg -i <文件> -c copy -f framecrc -`，
+    stderr 中是流信息，stdout 中是逐包时间戳（只复制数据包，不解码）。
+
+    Returns:
+        dict: {'streams': tuple | None, 'duration': float | None}。
+            streams 为决定能否直接拼接的编码参数（与码率、平均帧率、时长无关）：
+            视频流取编码器、profile、像素格式、分辨率和时间基，音频流取编码器、采样率、声道布局和采样格式，
+            无法解析时为 None。
+            duration 由数据包时间戳精确计算（见 packet_duration），无法读取数据包时退回容器时长。
+    """
+    result = run_ffmpeg([ffmpeg_path, '-hide_banner', '-nostdin', '-i', video_file,
+                         '-map', '0', '-c', 'copy', '-f', 'framecrc', '-'],
+                        label=f"probe: {video_file}", check=False)
+    streams = []
+    duration = packet_duration(result.stdout) if result.returncode == 0 else None
+    parsed = True
+    for line in result.stderr.split('\n'):
+        if line.startswith(('Stream mapping:', 'Output #')):
+            break  # 之后是 framecrc 输出端的流信息
+        if 'Duration:' in line:
+            if duration is None:
+                try:
+                    h, m, s = map(float, line.split('Duration:')[1].split(',')[0].strip().split(':'))
+                    duration = h * 3600 + m * 60 + s
+                except ValueError:
+                    pass  # Duration: N/A
+            continue
+        # 例如: Stream #0:0[0x1](und): Video: h264 (High) (avc1 / 0x31637661), yuv420p(progressive), 1280x960, ...
+        match = re.search(r'Stream #\d+:\d+.*?: (Video|Audio): (.*)', line)
+        if not match:
+            continue
+        kind, desc = match.groups()
+        codec = re.match(r'(\w+)(?: \(([^)/]*)\))?', desc)
+        if kind == 'Video':
+            fields = re.search(r', (\w+)(?:\([^)]*\))?, (\d+x\d+)', desc)
+            tbn = re.search(r'([\d.]+k?) tbn', desc)
+            if not codec or not fields:
+                parsed = False
+                continue
+            streams.append((kind, codec.group(1), codec.group(2), *fields.groups(), tbn.group(1) if tbn else None))
+        else:
+            fields = re.search(r'(\d+) Hz, ([^,]+), (\w+)', desc)
+            if not codec or not fields:
+                parsed = False
+                continue
+            streams.append((kind, codec.group(1), codec.group(2), *fields.groups()))
+    return {'streams': tuple(streams) if parsed and streams else None, 'duration': duration}
+
+def concat_copy(video_mp4s: list[str], output_video_path: str, list_file: str, ffmpeg_path: str = "ffmpeg") -> None:
+    """用 concat 分离器一次拼接编码参数相同的片段，音视频都直接复制（-c copy），不解码也不重新编码。"""
+    with open(list_file, "w", encoding="utf-8") as f:
+        for video in video_mp4s:
+            escaped = os.path.abspath(video).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    run_ffmpeg([
+        ffmpeg_path, "-hide_banner", "-f", "concat", "-safe", "0", "-i", list_file,
+        "-map", "0", "-c", "copy", "-movflags", "+faststart", "-y", output_video_path
+    ], label="concat_copy")
+
+def stat_fingerprint(path: str) -> str:
+    """没有内容指纹时按文件大小和修改时间生成的指纹（不读取文件内容）。"""
+    stat = os.stat(path)
+    return f"stat:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class IncrementalEpisodeMerger:
+    """
+    增量合并整集视频：所有片段依次无损转封装为 MPEG-TS 并按字节追加到一个中间文件 <输出>.merge.ts，
+    清单 <输出>.merge.json 记录每个片段的指纹、在中间文件中的字节区间和时间区间。
+
+    MPEG-TS 可以直接按字节截断和拼接。重新合并时找出与清单一致的最长前缀，把中间文件截断到前缀末尾，
+    只转封装并追加其后的新片段（时间戳按前缀时长偏移），不再读取前缀片段的媒体文件。
+    最后把中间文件一次 -c copy 转封装为 MP4（只复制字节，不解码）。
+    """
+
+    MANIFEST_VERSION = 2  # 版本 1 的时长取自 `ffmpeg -i` 的 Duration（截断到 10 毫秒），不再复用
+    SYNC_TOLERANCE = 0.05  # 合并结果时长与各片段时长之和允许的差异（秒）
+
+    def __init__(self, output_video_path: str, ffmpeg_path: str = "ffmpeg"):
+        """
+        Args:
+            output_video_path (str): 最终输出的 MP4 路径，中间文件和清单保存在同一目录。
+            ffmpeg_path (str, optional): ffmpeg 可执行文件路径。默认为 "ffmpeg"。
+        """
+        self.output_video_path = output_video_path
+        self.ffmpeg_path = ffmpeg_path
+        base = os.path.splitext(output_video_path)[0]
+        self.ts_path = base + ".merge.ts"
+        self.manifest_path = base + ".merge.json"
+
+    def load_manifest(self) -> dict | None:
+        """读取清单；清单或中间文件缺失、版本不符、中间文件短于清单记录时返回 None。"""
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            ts_size = os.path.getsize(self.ts_path)
+        except (OSError, ValueError):
+            return None
+        fragments = manifest.get('fragments', [])
+        if manifest.get('version') != self.MANIFEST_VERSION:
+            return None
+        if fragments and fragments[-1]['offset'] + fragments[-1]['size'] > ts_size:
+            return None
+        return manifest
+
+    def save_manifest(self, stream_params, fragments: list[dict]) -> None:
+        """先写临时文件再原子替换，中途失败时清单与中间文件的前缀仍然一致。"""
+        temp_path = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.MANIFEST_VERSION, 'stream_params': stream_params, 'fragments': fragments},
+                      f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.manifest_path)
+
+    def reusable_prefix(self, manifest: dict | None, fingerprints: list[str]) -> int:
+        """返回清单中与本次片段指纹一致的最长前缀长度。"""
+        if manifest is None:
+            return 0
+        prefix = 0
+        for entry, fingerprint in zip(manifest['fragments'], fingerprints):
+            if entry['fingerprint'] != fingerprint:
+                break
+            prefix += 1
+        return prefix
+
+    def merge(self, video_mp4s: list[str], fingerprints: list[str] = None) -> bool:
+        """
+        合并片段。片段编码参数不一致时返回 False（不修改任何文件），合并结果未通过同步检查（见 check_sync）时
+        也返回 False，由调用方改用重新编码的合并方式。
+
+        Args:
+            video_mp4s (list[str]): 按顺序排列的片段路径。
+            fingerprints (list[str], optional): 每个片段的内容指纹（例如片段渲染缓存的键）。
+                                                为 None 时按文件大小和修改时间生成。
+
+        Returns:
+            bool: 是否完成合并。
+        """
+        if fingerprints is None:
+            fingerprints = [stat_fingerprint(path) for path in video_mp4s]
+        if len(fingerprints) != len(video_mp4s):
+            raise ValueError(f"指纹数量与片段数量不一致: {len(fingerprints)} != {len(video_mp4s)}")
+
+        manifest = self.load_manifest()
+        prefix = self.reusable_prefix(manifest, fingerprints)
+        reused = manifest['fragments'][:prefix] if prefix else []
+
+        # 只需要检查新片段的编码参数，前缀片段的参数已记录在清单中
+        queue = get_job_queue()
+        new_infos = queue.map(lambda path: probe_media(path, self.ffmpeg_path), video_mp4s[prefix:])
+        stream_params = [list(map(list, manifest['stream_params']))] if prefix else []
+        stream_params += [list(map(list, info['streams'])) if info['streams'] else None for info in new_infos]
+        if not stream_params or stream_params[0] is None or any(params != stream_params[0] for params in stream_params) \
+                or any(info['duration'] is None for info in new_infos):
+            return False
+
+        offset = reused[-1]['offset'] + reused[-1]['size'] if reused else 0
+        start_time = reused[-1]['start'] + reused[-1]['duration'] if reused else 0.0
+        # 截断到可复用前缀的末尾，前缀部分的字节保持不动
+        with open(self.ts_path, 'ab') as ts_file:
+            ts_file.truncate(offset)
+        fragments = list(reused)
+        self.save_manifest(stream_params[0], fragments)
+
+        temp_dir = tempfile.mkdtemp()
+        try:
+            # 各片段的起点由时长预先确定，转封装互不依赖，并发运行；之后按顺序追加
+            fragment_starts = []
+            for info in new_infos:
+                fragment_starts.append(start_time)
+                start_time += info['duration']
+            fragment_paths = [os.path.join(temp_dir, f"fragment_{i}.ts") for i in range(len(new_infos))]
+            queue.run_all([
+                # 时间戳整体偏移到该片段在整集中的起点，追加后的中间文件时间戳连续
+                [self.ffmpeg_path, "-hide_banner", "-nostdin", "-i", path, "-map", "0", "-c", "copy",
+                 "-muxdelay", "0", "-muxpreload", "0",
+                 "-output_ts_offset", f"{fragment_start:.6f}", "-f", "mpegts", "-y", fragment_ts]
+                for path, fragment_start, fragment_ts in zip(video_mp4s[prefix:], fragment_starts, fragment_paths)
+            ], labels=[f"remux_ts: {path}" for path in video_mp4s[prefix:]])
+
+            for i, (info, fragment_start, fragment_ts) in enumerate(zip(new_infos, fragment_starts, fragment_paths)):
+                size = os.path.getsize(fragment_ts)
+                with open(self.ts_path, 'ab') as ts_file, open(fragment_ts, 'rb') as src:
+                    shutil.copyfileobj(src, ts_file, 1024 * 1024)
+                os.remove(fragment_ts)
+                fragments.append({'fingerprint': fingerprints[prefix + i], 'offset': offset, 'size': size,
+                                  'start': fragment_start, 'duration': info['duration']})
+                offset += size
+                self.save_manifest(stream_params[0], fragments)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+        run_ffmpeg([
+            self.ffmpeg_path, "-hide_banner", "-nostdin", "-i", self.ts_path, "-map", "0", "-c", "copy",
+            "-bsf:a", "aac_adtstoasc", "-movflags", "+faststart", "-y", self.output_video_path
+        ], label="remux_mp4")
+        print(f"增量合并: 复用前 {prefix}/{len(video_mp4s)} 个片段，追加 {len(video_mp4s) - prefix} 个片段")
+        return self.check_sync(fragments)
+
+    def check_sync(self, fragments: list[dict]) -> bool:
+        """
+        比较合并结果的精确时长与各片段时长之和。片段起点有偏差时误差随片段数累积，视频会与连续播放的音频错位；
+        超出 SYNC_TOLERANCE 时返回 False，由调用方改用重新编码的合并方式。
+        """
+        expected = fragments[-1]['start'] + fragments[-1]['duration'] if fragments else 0.0
+        merged = probe_media(self.output_video_path, self.ffmpeg_path)['duration']
+        if merged is None:
+            print(f"警告: 无法读取合并结果的时长，跳过同步检查: {self.output_video_path}")
+            return True
+        drift = merged - expected
+        print(f"同步检查: 合并结果 {merged:.3f}s，{len(fragments)} 个片段时长之和 {expected:.3f}s，差 {drift * 1000:+.1f}ms")
+        if abs(drift) > self.SYNC_TOLERANCE:
+            print(f"警告: 合并结果与片段时长之和相差超过 {self.SYNC_TOLERANCE * 1000:.0f}ms，音画可能不同步")
+            return False
+        return True
+
+    def clear(self) -> None:
+        """删除中间文件和清单（例如改用重新编码的合并方式后，它们已不再对应输出）。"""
+        for path in (self.ts_path, self.manifest_path):
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,176 @@
+import os
+import time
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+
+class FFmpegJobResult:
+    """一次 ffmpeg（或 ffprobe 等）调用的结果和耗时。"""
+
+    def __init__(self, cmd: list[str], label: str, returncode: int, stdout: str, stderr: str,
+                 wall_seconds: float, cpu_seconds: float | None):
+        self.cmd = cmd
+        self.label = label
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.wall_seconds = wall_seconds
+        self.cpu_seconds = cpu_seconds  # 子进程的用户态 + 内核态 CPU 时间，平台不支持时为 None
+
+
+class FFmpegError(subprocess.CalledProcessError):
+    """
+    ffmpeg 返回非 0 时抛出。继承 CalledProcessError，原有的 except subprocess.CalledProcessError 仍然适用；
+    stderr 为文本，另外携带任务标签和耗时。
+    """
+
+    def __init__(self, result: FFmpegJobResult):
+        super().__init__(result.returncode, result.cmd, output=result.stdout, stderr=result.stderr)
+        self.label = result.label
+        self.result = result
+
+    def __str__(self) -> str:
+        tail = self.stderr.strip().splitlines()[-3:] if self.stderr else []
+        return f"ffmpeg 任务失败 [{self.label}]，返回码 {self.returncode}: {' | '.join(tail)}"
+
+
+class FFmpegTimingStats:
+    """按任务标签汇总调用次数、墙钟时间和 CPU 时间（线程安全）。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}  # 标签 -> [次数, 墙钟秒数, CPU 秒数]
+
+    def record(self, result: FFmpegJobResult) -> None:
+        key = result.label.split(':')[0]
+        with self._lock:
+            stats = self._stats.setdefault(key, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += result.wall_seconds
+            stats[2] += result.cpu_seconds or 0.0
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+    def summary(self) -> str:
+        with self._lock:
+            items = sorted(self._stats.items(), key=lambda item: -item[1][1])
+        if not items:
+            return "ffmpeg 调用统计: 无"
+        lines = ["ffmpeg 调用统计:"]
+        for label, (count, wall, cpu) in items:
+            lines.append(f"  {label}: {count} 次, 墙钟 {wall:.2f}s, CPU {cpu:.2f}s")
+        return "\n".join(lines)
+
+
+timing_stats = FFmpegTimingStats()
+
+# 设置 FFMPEG_LOG_TIMING=1 时每次调用都打印一行耗时
+LOG_TIMING = os.getenv("FFMPEG_LOG_TIMING", "0") == "1"
+
+
+def run_ffmpeg(cmd: list[str], label: str = None, check: bool = True) -> FFmpegJobResult:
+    """
+    运行一次 ffmpeg / ffprobe 命令并记录墙钟时间和 CPU 时间。
+
+    stdout / stderr 写入临时文件而不是管道，输出再多也不会阻塞；stdin 为空设备，ffmpeg 不会等待终端输入；
+    支持 os.wait4 的平台上直接取得子进程的资源占用，多个线程同时运行时互不干扰。
+
+    Args:
+        cmd (list[str]): 完整命令行（包含可执行文件）。
+        label (str, optional): 任务标签，用于日志和统计，"probe: a.mp3" 按冒号前的部分汇总。默认为可执行文件名。
+        check (bool, optional): 返回码非 0 时是否抛出 FFmpegError。默认为 True。
+
+    Returns:
+        FFmpegJobResult: 调用结果，stdout / stderr 为文本。
+    """
+    label = label or os.path.basename(cmd[0])
+    start_wall = time.perf_counter()
+    cpu_seconds = None
+    with tempfile.TemporaryFile() as stdout_file, tempfile.TemporaryFile() as stderr_file, \
+            open(os.devnull, 'rb') as stdin_file:
+        process = subprocess.Popen(cmd, stdin=stdin_file, stdout=stdout_file, stderr=stderr_file)
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            cpu_seconds = usage.ru_utime + usage.ru_stime
+        else:
+            process.wait()
+        wall_seconds = time.perf_counter() - start_wall
+        stdout_file.seek(0)
+        stderr_file.seek(0)
+        stdout = stdout_file.read().decode('utf-8', errors='replace')
+        stderr = stderr_file.read().decode('utf-8', errors='replace')
+
+    result = FFmpegJobResult(cmd, label, process.returncode, stdout, stderr, wall_seconds, cpu_seconds)
+    timing_stats.record(result)
+    if LOG_TIMING:
+        cpu_text = f"{cpu_seconds:.2f}s" if cpu_seconds is not None else "未知"
+        print(f"[ffmpeg] {label}: 墙钟 {wall_seconds:.2f}s, CPU {cpu_text}, 返回码 {process.returncode}")
+    if check and process.returncode != 0:
+        raise FFmpegError(result)
+    return result
+
+
+class FFmpegJobQueue:
+    """
+    有并发上限的 ffmpeg 任务队列（线程池）。每个任务是一个独立的子进程，线程只负责等待，
+    因此互不依赖的调用（逐片段提取、时长探测等）可以同时运行，总并发数受 max_jobs 限制。
+
+    不要在队列中的任务里再向同一个队列提交任务并等待结果，线程全部占满时会死锁。
+    """
+
+    def __init__(self, max_jobs: int | None = None):
+        """
+        Args:
+            max_jobs (int | None, optional): 同时运行的最大 ffmpeg 进程数，默认读取环境变量 FFMPEG_JOBS，
+                                             未设置时为 CPU 核心数。
+        """
+        if max_jobs is None:
+            max_jobs = int(os.getenv("FFMPEG_JOBS", "0")) or os.cpu_count() or 1
+        self.max_jobs = max(1, max_jobs)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix="ffmpeg")
+
+    def submit(self, cmd: list[str], label: str = None, check: bool = True):
+        """提交一个命令，返回 concurrent.futures.Future，结果为 FFmpegJobResult。"""
+        return self._executor.submit(run_ffmpeg, cmd, label, check)
+
+    def submit_fn(self, fn, *args, **kwargs):
+        """提交一个会调用 run_ffmpeg 的函数（例如解析输出的探测函数），同样受并发上限约束。"""
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def run_all(self, cmds: list[list[str]], labels: list[str] = None, check: bool = True) -> list[FFmpegJobResult]:
+        """
+        并发运行一组命令，按提交顺序返回结果。check 为 True 时等待全部结束后抛出第一个失败的 FFmpegError。
+        """
+        labels = labels or [None] * len(cmds)
+        futures = [self.submit(cmd, label, check=False) for cmd, label in zip(cmds, labels)]
+        results = [future.result() for future in futures]
+        if check:
+            for result in results:
+                if result.returncode != 0:
+                    raise FFmpegError(result)
+        return results
+
+    def map(self, fn, items) -> list:
+        """对每个元素并发调用 fn（fn 内部调用 run_ffmpeg），按顺序返回结果，任一调用出错时抛出其异常。"""
+        futures = [self._executor.submit(fn, item) for item in items]
+        return [future.result() for future in futures]
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+
+
+_default_queue = None
+_default_queue_lock = threading.Lock()
+
+def get_job_queue() -> FFmpegJobQueue:
+    """返回进程内共享的默认任务队列，所有模块共用同一个并发上限。"""
+    global _default_queue
+    with _default_queue_lock:
+        if _default_queue is None:
+            _default_queue = FFmpegJobQueue()
+        return _default_queue
@@ -0,0 +1,58 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+
+class SharedFrameRing:
+    """
+    基于 multiprocessing.shared_memory 的帧槽环形缓冲区。
+
+    主进程创建共享内存并分配空闲槽位，工作进程按名字挂载后直接把帧渲染进槽位，
+    写入端拿到槽位序号即可把同一块内存交给编码器，帧数据无需经过进程池的结果管道拷贝。
+    """
+
+    def __init__(self, num_slots: int, frame_shape: tuple[int, ...], name: str = None, create: bool = True):
+        """
+        Args:
+            num_slots (int): 槽位数量，即同时在途（已分配未写出）的最大帧数。
+            frame_shape (tuple[int, ...]): 单帧形状，例如 (height, width, 3)。
+            name (str, optional): 挂载已有共享内存时使用的名字。
+            create (bool, optional): True 表示创建新的共享内存，False 表示按 name 挂载。默认为 True。
+        """
+        if num_slots < 1:
+            raise ValueError(f"槽位数量必须大于 0: {num_slots}")
+        self.num_slots = num_slots
+        self.frame_shape = tuple(frame_shape)
+        self.frame_bytes = int(np.prod(self.frame_shape))
+        self._owner = create
+        if create:
+            self.shm = shared_memory.SharedMemory(create=True, size=num_slots * self.frame_bytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.frames = np.ndarray((num_slots, *self.frame_shape), dtype=np.uint8, buffer=self.shm.buf)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    @classmethod
+    def attach(cls, name: str, num_slots: int, frame_shape: tuple[int, ...]) -> "SharedFrameRing":
+        """在工作进程中按名字挂载主进程创建的环形缓冲区。"""
+        return cls(num_slots, frame_shape, name=name, create=False)
+
+    def slot(self, index: int) -> np.ndarray:
+        """返回第 index 个槽位的帧视图（不拷贝）。"""
+        return self.frames[index]
+
+    def slots(self, index: int, count: int) -> np.ndarray:
+        """返回从第 index 个槽位开始、连续 count 个槽位的 (count, *frame_shape) 视图（不拷贝）。"""
+        return self.frames[index:index + count]
+
+    def close(self) -> None:
+        """释放本进程的映射；创建者同时删除共享内存。"""
+        self.frames = None
+        self.shm.close()
+        if self._owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
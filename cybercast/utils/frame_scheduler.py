@@ -0,0 +1,74 @@
+from collections import deque
+
+
+class OrderedFrameScheduler:
+    """
+    以滑动窗口按帧区间向进程池提交渲染任务，并按帧序号顺序产出结果。
+
+    已提交但尚未被写出的帧数始终不超过 max_buffered_frames：窗口满时不再提交新区间，
+    而是先等待最早的区间完成并写出。因此无论视频多长，缓冲的帧数（内存占用）都保持恒定。
+    同一时刻在途的帧序号落在长度不超过 max_buffered_frames 的连续区间内，
+    所以 frame_n % max_buffered_frames 可以直接作为共享内存槽位序号。
+    """
+
+    def __init__(self, pool, task_fn, total_frames: int, max_buffered_frames: int = 32, range_size: int = 1,
+                 make_task=None):
+        """
+        Args:
+            pool: multiprocessing.Pool 进程池。
+            task_fn: 工作进程执行的函数，参数为 make_task(start, end) 的返回值，返回该区间内按顺序排列的结果列表
+                     （每项可以是一帧，也可以是一批连续帧）。
+            total_frames (int): 总帧数。
+            max_buffered_frames (int, optional): 已提交未写出的最大帧数 K。默认为 32。
+            range_size (int, optional): 每个任务包含的连续帧数，会被限制在 [1, K] 内。默认为 1。
+            make_task (callable, optional): 根据 (start, end) 构造任务参数，可用于附带片段数据。
+                                            默认直接传递 (start, end)。
+        """
+        if max_buffered_frames < 1:
+            raise ValueError(f"max_buffered_frames 必须大于 0: {max_buffered_frames}")
+        self.pool = pool
+        self.task_fn = task_fn
+        self.total_frames = total_frames
+        self.max_buffered_frames = max_buffered_frames
+        self.range_size = max(1, min(range_size, max_buffered_frames))
+        self.make_task = make_task or (lambda start, end: (start, end))
+        self.peak_buffered_frames = 0  # 已渲染完成、等待按顺序写出的帧数峰值
+        self.peak_in_flight_frames = 0  # 已提交未写出的帧数峰值（不超过 K）
+        self.pending = deque()  # [(start, end, AsyncResult)]，按提交顺序排列
+
+    def __iter__(self):
+        pending = self.pending
+        next_submit = 0
+        next_yield = 0
+
+        while next_yield < self.total_frames:
+            # 窗口内还有空间时继续提交新的帧区间
+            while next_submit < self.total_frames:
+                end = min(next_submit + self.range_size, self.total_frames)
+                if end - next_yield > self.max_buffered_frames:
+                    break
+                pending.append((next_submit, end, self.pool.apply_async(self.task_fn, (self.make_task(next_submit, end),))))
+                next_submit = end
+
+            self.peak_in_flight_frames = max(self.peak_in_flight_frames, next_submit - next_yield)
+            buffered = sum(end - start for start, end, result in pending if result.ready())
+            self.peak_buffered_frames = max(self.peak_buffered_frames, buffered)
+
+            # 等待最早的区间完成，按顺序产出其中的结果
+            start, end, result = pending.popleft()
+            yield from result.get()
+            next_yield = end
+
+    def drain(self, timeout: float = 30.0) -> bool:
+        """
+        出错中止时等待所有已提交的任务结束（忽略其结果），保证之后不会再有任务写入共享内存槽位。
+
+        Returns:
+            bool: 所有任务都在 timeout 秒内结束时返回 True。
+        """
+        finished = True
+        while self.pending:
+            _, _, result = self.pending.popleft()
+            result.wait(timeout)
+            finished = finished and result.ready()
+        return finished
@@ -0,0 +1,225 @@
+import os
+import json
+import struct
+import threading
+
+
+# 比特率表（kbps），按 (MPEG-1?, 层) 索引，下标为帧头中的比特率索引
+_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# 采样率表，按帧头中的版本位索引：0 = MPEG-2.5，2 = MPEG-2，3 = MPEG-1
+_SAMPLE_RATES = {0: (11025, 12000, 8000), 2: (22050, 24000, 16000), 3: (44100, 48000, 32000)}
+
+
+class Mp3Info:
+    """MP3 文件的采样数和采样率，samples 已扣除 LAME 记录的编码延迟和末尾填充（与 ffmpeg 解码出的采样数一致）。"""
+
+    def __init__(self, samples: int, sample_rate: int, channels: int, tagged: bool = False):
+        self.samples = samples
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.tagged = tagged  # 首帧是否为 Xing / Info / VBRI 标签帧
+
+    @property
+    def duration(self) -> float:
+        return self.samples / self.sample_rate
+
+
+def parse_frame_header(header: bytes) -> dict | None:
+    """
+    解析 4 字节的 MPEG 音频帧头。
+
+    Returns:
+        dict | None: {'mpeg1', 'layer', 'sample_rate', 'channels', 'samples', 'size'}，不是合法帧头时返回 None。
+            samples 为每帧采样数，size 为整帧字节数（含帧头）。
+    """
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+    version = (header[1] >> 3) & 0x03
+    layer = 4 - ((header[1] >> 1) & 0x03)
+    bitrate_index = header[2] >> 4
+    sample_rate_index = (header[2] >> 2) & 0x03
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None  # 保留值，或不支持的自由格式比特率
+    mpeg1 = version == 3
+    sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+    bitrate = _BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    padding = (header[2] >> 1) & 0x01
+    if layer == 1:
+        samples = 384
+        size = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if mpeg1 or layer == 2 else 576
+        size = samples // 8 * bitrate // sample_rate + padding
+    channels = 1 if (header[3] >> 6) == 3 else 2
+    return {'mpeg1': mpeg1, 'layer': layer, 'sample_rate': sample_rate, 'channels': channels,
+            'samples': samples, 'size': size}
+
+def _skip_id3v2(data: bytes) -> int:
+    """返回 ID3v2 标签之后的偏移（可能有多个连续的标签）。"""
+    offset = 0
+    while data[offset:offset + 3] == b'ID3' and len(data) >= offset + 10:
+        # 标签大小为 4 个 7 位的同步安全整数，不含 10 字节的标签头；有脚注时再加 10 字节
+        size = (data[offset + 6] << 21) | (data[offset + 7] << 14) | (data[offset + 8] << 7) | data[offset + 9]
+        offset += 10 + size + (10 if data[offset + 5] & 0x10 else 0)
+    return offset
+
+def _find_first_frame(data: bytes, offset: int) -> tuple[int, dict] | None:
+    """从 offset 开始查找第一个帧头，要求其后紧跟的也是同一采样率的帧头，避免把数据中的 0xFF 误认为帧同步。"""
+    while True:
+        offset = data.find(b'\xff', offset)
+        if offset < 0 or offset + 4 > len(data):
+            return None
+        frame = parse_frame_header(data[offset:offset + 4])
+        if frame is not None:
+            next_offset = offset + frame['size']
+            if next_offset + 4 > len(data):
+                return offset, frame  # 文件中只有一帧
+            next_frame = parse_frame_header(data[next_offset:next_offset + 4])
+            if next_frame is not None and next_frame['sample_rate'] == frame['sample_rate']:
+                return offset, frame
+        offset += 1
+
+def _read_info_tag(data: bytes, offset: int, frame: dict) -> tuple[int | None, int] | None:
+    """
+    读取首帧中的 Xing / Info / VBRI 标签。
+
+    Returns:
+        tuple[int | None, int] | None: (音频帧数，不含标签帧本身, 应扣除的编码延迟 + 末尾填充采样数)。
+            没有标签时返回 None；有标签但没有记录帧数时帧数为 None。
+    """
+    # Xing / Info 位于边信息之后，边信息长度由版本和声道数决定
+    if frame['mpeg1']:
+        side_info = 17 if frame['channels'] == 1 else 32
+    else:
+        side_info = 9 if frame['channels'] == 1 else 17
+    xing = offset + 4 + side_info
+    if data[xing:xing + 4] in (b'Xing', b'Info'):
+        flags = struct.unpack('>I', data[xing + 4:xing + 8])[0]
+        if not flags & 0x01:
+            return None, 0
+        frames = struct.unpack('>I', data[xing + 8:xing + 12])[0]
+        # LAME 扩展紧跟在可选字段之后，记录编码延迟和末尾填充各 12 位。
+        # 扩展以 9 字节的编码器版本开头：LAME 写 "LAME3.100"，ffmpeg 的 libmp3lame 写 "Lavc61.3." / "Lavf..."，
+        # 与 ffmpeg 解码时一样，只要版本字符串不为空就读取延迟和填充
+        lame = xing + 8 + 4 + (4 if flags & 0x02 else 0) + (100 if flags & 0x04 else 0) + (4 if flags & 0x08 else 0)
+        trim = 0
+        if data[lame:lame + 9].strip(b'\x00 ') and len(data) >= lame + 24:
+            delay_padding = int.from_bytes(data[lame + 21:lame + 24], 'big')
+            trim = (delay_padding >> 12) + (delay_padding & 0x0FFF)
+        return frames, trim
+    # VBRI（Fraunhofer 编码器）固定位于帧头之后 32 字节
+    vbri = offset + 4 + 32
+    if data[vbri:vbri + 4] == b'VBRI':
+        frames = struct.unpack('>I', data[vbri + 14:vbri + 18])[0]
+        return frames, 0
+    return None
+
+def read_mp3_info(mp3_path: str) -> Mp3Info | None:
+    """
+    在进程内解析 MP3 的帧头得到精确的采样数，不启动 ffmpeg。
+
+    首帧带 Xing / Info / VBRI 标签时直接读取其中的帧数（并按 LAME 扩展扣除编码延迟和填充）；
+    否则（常见于没有标签的 CBR 文件）逐帧读取帧头累加采样数，只读帧头不解码。
+
+    Returns:
+        Mp3Info | None: 无法解析（不是 MPEG 音频）时返回 None。
+    """
+    with open(mp3_path, 'rb') as f:
+        data = f.read()
+    found = _find_first_frame(data, _skip_id3v2(data))
+    if found is None:
+        return None
+    offset, first = found
+
+    tag = _read_info_tag(data, offset, first)
+    if tag is not None:
+        frames, trim = tag
+        if frames is not None:
+            return Mp3Info(max(0, frames * first['samples'] - trim), first['sample_rate'], first['channels'], True)
+        offset += first['size']  # 标签帧不含音频，逐帧累加时跳过
+
+    samples = 0
+    end = len(data) - (128 if data[-128:-125] == b'TAG' else 0)  # 末尾的 ID3v1 标签
+    while offset + 4 <= end:
+        frame = parse_frame_header(data[offset:offset + 4])
+        if frame is None or frame['sample_rate'] != first['sample_rate']:
+            # 帧同步丢失（例如中间夹有其他数据），向后重新查找
+            found = _find_first_frame(data, offset + 1)
+            if found is None or found[0] >= end:
+                break
+            offset, frame = found
+        if offset + frame['size'] > end:
+            break  # 末尾不完整的帧，解码器同样会丢弃
+        samples += frame['samples']
+        offset += frame['size']
+    if samples == 0:
+        return None
+    return Mp3Info(samples, first['sample_rate'], first['channels'], tag is not None)
+
+
+class DurationCache:
+    """
+    按文件路径、大小和修改时间记住音频时长，持久化在音频所在目录的边车文件 .durations.json 中。
+
+    TTS 缓存目录中的文件内容不变，同一文件在各个任务和各个步骤中只解析一次；
+    文件被覆盖后大小或修改时间改变，旧记录自动失效；解析逻辑变化时提高 VERSION，此前记录的时长全部重新计算。线程安全。
+    """
+
+    SIDECAR_NAME = ".durations.json"
+    # 2: ffmpeg（Lavc/Lavf）写出的 LAME 扩展也扣除编码延迟和填充，版本 1 的记录多算了 1~2 帧
+    VERSION = 2
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = {}  # 目录 -> {文件名: 记录}
+
+    def _load_index(self, directory: str) -> dict:
+        index = self._indexes.get(directory)
+        if index is None:
+            try:
+                with open(os.path.join(directory, self.SIDECAR_NAME), 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                index = {}
+            self._indexes[directory] = index
+        return index
+
+    def _save_index(self, directory: str, index: dict) -> None:
+        path = os.path.join(directory, self.SIDECAR_NAME)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(index, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Warning: failed to save duration cache {path}: {e}")
+
+    def get(self, path: str) -> float | None:
+        """返回记住的时长，没有记录或文件已改变时返回 None。"""
+        directory, name = os.path.split(os.path.abspath(path))
+        stat = os.stat(path)
+        with self._lock:
+            entry = self._load_index(directory).get(name)
+        if entry and entry.get('version') == self.VERSION and \
+                entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['duration']
+        return None
+
+    def put(self, path: str, duration: float) -> None:
+        directory, name = os.path.split(os.path.abspath(path))
+        stat = os.stat(path)
+        with self._lock:
+            index = self._load_index(directory)
+            index[name] = {'version': self.VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                           'duration': duration}
+            self._save_index(directory, index)
+
+
+duration_cache = DurationCache()
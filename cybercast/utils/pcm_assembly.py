@@ -0,0 +1,214 @@
+import os
+import json
+import time
+import tempfile
+import subprocess
+import numpy as np
+from cybercast.utils.pcm_store import load_pcm
+from cybercast.utils.audio_utils import format_time, get_mp3_duration
+from cybercast.utils.ffmpeg_runner import FFmpegJobResult, FFmpegError, get_job_queue, timing_stats
+
+
+def _to_channels(samples: np.ndarray, channels: int) -> np.ndarray:
+    """把解码结果转换为 (n, channels) 的 float32 数组（单声道复制到各声道，其余先下混为单声道）。"""
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    if samples.shape[1] == channels:
+        return samples
+    if samples.shape[1] != 1:
+        samples = samples.mean(axis=1, keepdims=True)
+    return np.repeat(samples, channels, axis=1)
+
+def _encode_pcm(pcm: np.ndarray, sample_rate: int, output_path: str, metadata_file: str,
+                bitrate: str, ffmpeg_path: str = "ffmpeg", chunk_samples: int = 1 << 16) -> None:
+    """
+    通过 ffmpeg 管道把 PCM 一次编码为 MP3，同时写入章节元数据。耗时计入 ffmpeg 调用统计（标签 encode_episode）。
+    """
+    cmd = [
+        ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-y',
+        '-f', 'f32le', '-ar', str(sample_rate), '-ac', str(pcm.shape[1]), '-i', '-',
+        '-i', metadata_file,
+        '-map', '0:a', '-map_metadata', '1',
+        '-c:a', 'libmp3lame', '-b:a', bitrate,
+        output_path
+    ]
+    print(f"FFMPEG encode command:")
+    print(' '.join(cmd))
+    start_wall = time.perf_counter()
+    with tempfile.TemporaryFile() as stderr_file:
+        process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=stderr_file)
+        try:
+            for start in range(0, len(pcm), chunk_samples):
+                process.stdin.write(pcm[start:start + chunk_samples].tobytes())
+        except BrokenPipeError:
+            pass  # ffmpeg 提前退出，返回码和错误信息见下方
+        finally:
+            process.stdin.close()
+        process.wait()
+        stderr_file.seek(0)
+        stderr = stderr_file.read().decode('utf-8', errors='replace')
+    result = FFmpegJobResult(cmd, "encode_episode", process.returncode, "", stderr,
+                             time.perf_counter() - start_wall, None)
+    timing_stats.record(result)
+    if process.returncode != 0:
+        raise FFmpegError(result)
+
+
+def assemble_episode(
+    audio_files: list[str],
+    output_path: str,
+    speakers: list[str] = None,
+    gap_seconds: float = 0.0,
+    speaker_gap_seconds: float = None,
+    crossfade_seconds: float = 0.0,
+    sample_rate: int = 44100,
+    channels: int = 2,
+    bitrate: str = '192k',
+    ffmpeg_path: str = "ffmpeg",
+) -> list[dict] | None:
+    """
+    在内存中拼接整集音频：每个片段只解码一次（解码结果由 load_pcm 保存，之后直接映射），按采样偏移放入一块预分配的 PCM 缓冲区，
+    再通过一个 ffmpeg 管道编码并写入章节。时间线由采样偏移直接得出，与编码器无关，不存在累计误差。
+
+    片段之间可以插入静音（同一说话人用 gap_seconds，换人时用 speaker_gap_seconds），
+    间隔为 0 且 crossfade_seconds > 0 时相邻片段线性交叉淡化（重叠部分两段增益之和为 1）。
+
+    时间线同时保存到 <输出>_segments.json（格式与 concat_audios 相同，另含采样偏移）。
+
+    Args:
+        audio_files (list[str]): 按顺序排列的片段音频。
+        output_path (str): 输出的 MP3 路径。
+        speakers (list[str], optional): 每个片段的说话人，用于决定间隔；None 表示都按 gap_seconds。
+        gap_seconds (float, optional): 同一说话人相邻片段之间的静音（秒）。默认为 0。
+        speaker_gap_seconds (float, optional): 换人时的静音（秒），None 表示与 gap_seconds 相同。
+        crossfade_seconds (float, optional): 无间隔时相邻片段的交叉淡化时长（秒）。默认为 0。
+        sample_rate (int, optional): 输出采样率。默认为 44100。
+        channels (int, optional): 输出声道数。默认为 2。
+        bitrate (str, optional): MP3 比特率。默认为 '192k'。
+        ffmpeg_path (str, optional): ffmpeg 可执行文件路径。默认为 "ffmpeg"。
+
+    Returns:
+        list[dict] | None: 每个片段的时间信息，失败时返回 None。
+    """
+    if not audio_files:
+        print("Error: No audio files to assemble")
+        return None
+    if speakers is not None and len(speakers) != len(audio_files):
+        raise ValueError(f"说话人数量与片段数量不一致: {len(speakers)} != {len(audio_files)}")
+    if speaker_gap_seconds is None:
+        speaker_gap_seconds = gap_seconds
+    gap_samples = int(round(gap_seconds * sample_rate))
+    speaker_gap_samples = int(round(speaker_gap_seconds * sample_rate))
+    crossfade_samples = int(round(crossfade_seconds * sample_rate))
+
+    # 按帧头估算总长度预分配缓冲区（规范格式的缓存音频是精确值），不够时再扩容
+    estimated = sum(int(get_mp3_duration(path) * sample_rate) + 1 for path in audio_files)
+    estimated += max(gap_samples, speaker_gap_samples) * (len(audio_files) - 1)
+    capacity = max(estimated, sample_rate)
+    pcm = np.zeros((capacity, channels), dtype=np.float32)
+
+    # 解码互不依赖，在任务队列中并发进行；按顺序取结果并立即放入缓冲区。
+    # 只提前提交并发数个片段，已解码但尚未放入缓冲区的片段不会堆积在内存中
+    queue = get_job_queue()
+    window = queue.max_jobs
+    futures = {}
+
+    def submit(index):
+        if index < len(audio_files):
+            futures[index] = queue.submit_fn(load_pcm, audio_files[index], sample_rate, channels == 1, ffmpeg_path)
+
+    for index in range(window):
+        submit(index)
+
+    segments_info = []
+    end = 0
+    previous_head = 0  # 上一片段开头被交叉淡化占用的采样数，淡出区域不能与它重叠
+    try:
+        for i, path in enumerate(audio_files):
+            samples = _to_channels(futures.pop(i).result()[0], channels)
+            submit(i + window)
+            n = len(samples)
+
+            start = end
+            fade = 0
+            if i > 0:
+                gap = gap_samples
+                if speakers is not None and speakers[i] != speakers[i - 1]:
+                    gap = speaker_gap_samples
+                if gap > 0:
+                    start = end + gap
+                elif crossfade_samples > 0:
+                    previous_length = segments_info[-1]["end_sample"] - segments_info[-1]["start_sample"]
+                    fade = max(0, min(crossfade_samples, previous_length - previous_head, n))
+                    start = end - fade
+
+            if start + n > capacity:
+                capacity = max(int(capacity * 1.5), start + n)
+                grown = np.zeros((capacity, channels), dtype=np.float32)
+                grown[:end] = pcm[:end]
+                pcm = grown
+
+            if fade > 0:
+                ramp = np.linspace(0.0, 1.0, fade, endpoint=False, dtype=np.float32)[:, None]
+                pcm[start:end] *= 1.0 - ramp
+                pcm[start:end] += samples[:fade] * ramp
+                pcm[end:start + n] = samples[fade:]
+            else:
+                pcm[start:start + n] = samples
+            previous_head = fade
+            end = start + n
+
+            segments_info.append({
+                "index": i,
+                "file": os.path.basename(path),
+                "full_path": path,
+                "original_duration": n / sample_rate,
+                "start_time": start / sample_rate,
+                "end_time": end / sample_rate,
+                "start_formatted": format_time(start / sample_rate),
+                "end_formatted": format_time(end / sample_rate),
+                "start_sample": start,
+                "end_sample": end,
+                "sample_rate": sample_rate,
+            })
+    except (RuntimeError, FileNotFoundError) as e:
+        print(f"Error decoding audio files: {e}")
+        for future in futures.values():
+            future.cancel()
+        return None
+
+    print("\nAssembled segments:")
+    print("-----------------------")
+    for segment in segments_info:
+        print(f"Segment {segment['index']+1}: {segment['file']}")
+        print(f"  Position: {segment['start_formatted']} - {segment['end_formatted']}")
+    print("-----------------------")
+    print(f"Total duration: {format_time(end / sample_rate)}")
+
+    # 章节时间以采样为时间基，与缓冲区中的偏移完全一致
+    metadata_file = output_path + ".metadata"
+    with open(metadata_file, 'w', encoding='utf-8') as f:
+        f.write(";FFMETADATA1\n")
+        for segment in segments_info:
+            f.write(f"[CHAPTER]\nTIMEBASE=1/{sample_rate}\n")
+            f.write(f"START={segment['start_sample']}\n")
+            f.write(f"END={segment['end_sample']}\n")
+            f.write(f"title=Segment {segment['index']+1}: {segment['file']}\n\n")
+
+    try:
+        _encode_pcm(pcm[:end], sample_rate, output_path, metadata_file, bitrate, ffmpeg_path)
+    except FFmpegError as e:
+        print(f"Error encoding assembled audio: {e}")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return None
+    finally:
+        os.remove(metadata_file)
+
+    print(f"\nSuccessfully created assembled audio with chapter markers: {output_path}")
+
+    segments_json = os.path.splitext(output_path)[0] + "_segments.json"
+    with open(segments_json, 'w', encoding='utf-8') as f:
+        json.dump(segments_info, f, indent=2)
+    print(f"Segments timeline saved to {segments_json}")
+    return segments_info
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import numpy as np
+from cybercast.utils.audio_decoder import decode_audio, probe_audio
+from cybercast.utils.mp3_probe import read_mp3_info
+
+# 设置 PCM_STORE=0 时不保存解码结果，每次都重新解码
+PCM_STORE_ENABLED = os.getenv("PCM_STORE", "1") == "1"
+PCM_STORE_DIR_NAME = "pcm"
+
+
+def pcm_store_path(audio_path: str, sample_rate: int) -> str:
+    """解码结果的保存路径：音频所在目录下的 pcm/<文件名>.<采样率>.npy。"""
+    directory, name = os.path.split(os.path.abspath(audio_path))
+    return os.path.join(directory, PCM_STORE_DIR_NAME, f"{name}.{sample_rate}.npy")
+
+def native_sample_rate(audio_path: str, ffmpeg_path: str = "ffmpeg") -> int:
+    """音频的原始采样率，MP3 直接读帧头，其他格式用 ffmpeg 探测。"""
+    try:
+        info = read_mp3_info(audio_path)
+    except OSError:
+        info = None
+    if info is not None:
+        return info.sample_rate
+    sample_rate = probe_audio(audio_path, ffmpeg_path)['sample_rate']
+    if sample_rate is None:
+        raise RuntimeError(f"无法确定音频采样率: {audio_path}")
+    return sample_rate
+
+def load_pcm(
+    audio_path: str,
+    sample_rate: int = None,
+    mono: bool = True,
+    ffmpeg_path: str = "ffmpeg",
+    store: bool = None,
+) -> tuple[np.ndarray, int]:
+    """
+    读取音频的 float32 PCM，结果与 decode_audio 相同。
+
+    第一次读取时完整解码一遍（保留原始声道），以 .npy 保存在音频旁边（见 pcm_store_path），
+    之后直接用 np.load(mmap_mode='r') 映射该文件：音频拼接、视频渲染等各个步骤共用同一份解码结果和页缓存，
+    不再各自启动 ffmpeg 解码。音频比 .npy 新（被重新生成）时重新解码。
+
+    Args:
+        audio_path (str): 音频文件路径。
+        sample_rate (int, optional): 输出采样率，None 表示保持原始采样率。不同采样率分别保存。
+        mono (bool, optional): 是否下混为单声道。多声道时返回新数组（各声道取平均），否则返回只读的映射数组。
+        ffmpeg_path (str, optional): ffmpeg 可执行文件路径。默认为 "ffmpeg"。
+        store (bool, optional): 是否使用保存的解码结果，None 表示按环境变量 PCM_STORE（默认为 1）。
+
+    Returns:
+        tuple[np.ndarray, int]: (采样数据, 采样率)。单声道时形状为 (n,)，否则为 (n, channels)。
+    """
+    if not (PCM_STORE_ENABLED if store is None else store):
+        return decode_audio(audio_path, sample_rate=sample_rate, mono=mono, ffmpeg_path=ffmpeg_path)
+
+    if sample_rate is None:
+        sample_rate = native_sample_rate(audio_path, ffmpeg_path)
+    path = pcm_store_path(audio_path, sample_rate)
+    try:
+        fresh = os.stat(path).st_mtime_ns >= os.stat(audio_path).st_mtime_ns
+    except FileNotFoundError:
+        fresh = False
+
+    samples = None
+    if fresh:
+        try:
+            samples = np.load(path, mmap_mode='r')
+        except (OSError, ValueError) as e:
+            print(f"Warning: failed to load decoded audio {path}, decoding again: {e}")
+    if samples is None:
+        decoded, _ = decode_audio(audio_path, sample_rate=sample_rate, mono=False, ffmpeg_path=ffmpeg_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再原子替换，并发读取同一音频时不会读到写了一半的文件
+        fd, temp_path = tempfile.mkstemp(suffix=".npy.tmp", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, decoded)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        del decoded
+        samples = np.load(path, mmap_mode='r')
+
+    if mono and samples.ndim == 2:
+        samples = samples.mean(axis=1, dtype=np.float32)
+    return samples, sample_rate
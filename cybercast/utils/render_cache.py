@@ -0,0 +1,129 @@
+import os
+import json
+import shutil
+import hashlib
+
+
+def hash_file(path: str, hasher=None, block_size: int = 1024 * 1024):
+    """按块读取文件内容更新哈希对象，返回该哈希对象。"""
+    hasher = hasher or hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            hasher.update(block)
+    return hasher
+
+def fragment_fingerprint(mp3_path: str, avatar_path: str | None, params: dict) -> str:
+    """
+    计算片段渲染结果的内容指纹：音频内容、头像内容和所有影响画面/编码的参数。
+
+    与文件名、片段序号无关，因此台词修改后指纹随之改变，而不同任务中完全相同的片段得到同一个指纹。
+
+    Args:
+        mp3_path (str): 片段音频路径。
+        avatar_path (str | None): 头像路径，无头像时为 None。
+        params (dict): 颜色、分辨率、帧率、渲染器版本等参数，必须可以 JSON 序列化。
+
+    Returns:
+        str: 十六进制 sha256 指纹。
+    """
+    hasher = hashlib.sha256()
+    hasher.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    hasher.update(b'\0audio\0')
+    hash_file(mp3_path, hasher)
+    hasher.update(b'\0avatar\0')
+    if avatar_path:
+        hash_file(avatar_path, hasher)
+    return hasher.hexdigest()
+
+
+class FragmentRenderCache:
+    """
+    按内容指纹保存已渲染的片段视频，可在多个任务之间共享。
+
+    条目以 <指纹前两位>/<指纹>.mp4 的形式保存在缓存目录中，命中时更新修改时间；
+    写入后按修改时间从旧到新淘汰，直到总大小不超过上限（LRU）。
+    """
+
+    def __init__(self, cache_dir: str = None, max_mb: int = None):
+        """
+        Args:
+            cache_dir (str, optional): 缓存目录，默认读取环境变量 VIDEO_CACHE_DIR，未设置时为 ".cache/video"。
+            max_mb (int, optional): 缓存总大小上限（MB），默认读取环境变量 VIDEO_CACHE_MB，未设置时为 2048。
+        """
+        self.cache_dir = cache_dir or os.getenv("VIDEO_CACHE_DIR", ".cache/video")
+        if max_mb is None:
+            max_mb = int(os.getenv("VIDEO_CACHE_MB", "2048"))
+        self.max_bytes = max(0, max_mb) * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.mp4")
+
+    def get(self, key: str, output_path: str) -> bool:
+        """
+        命中时把缓存的视频复制到 output_path 并返回 True，否则返回 False。
+        """
+        entry = self.entry_path(key)
+        try:
+            os.utime(entry)  # 刷新最近使用时间
+            shutil.copyfile(entry, output_path)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def put(self, key: str, video_path: str) -> None:
+        """把渲染好的视频存入缓存（先写临时文件再原子替换），然后按大小上限淘汰旧条目。"""
+        entry = self.entry_path(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        temp_path = f"{entry}.{os.getpid()}.tmp"
+        shutil.copyfile(video_path, temp_path)
+        os.replace(temp_path, entry)
+        self.evict()
+
+    def evict(self) -> int:
+        """
+        按最近使用时间从旧到新删除条目，直到总大小不超过上限。
+
+        Returns:
+            int: 删除的条目数。
+        """
+        entries = []
+        total_bytes = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.mp4'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # 其他进程刚刚淘汰
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total_bytes += stat.st_size
+
+        removed = 0
+        entries.sort()
+        for _, size, path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+        if removed:
+            print(f"渲染缓存超过 {self.max_bytes / 1024 / 1024:.0f}MB，已淘汰 {removed} 个最久未使用的片段")
+        return removed
+
+    def summary(self) -> str:
+        total = self.hits + self.misses
+        rate = self.hits / total if total else 0.0
+        return f"渲染缓存: 命中 {self.hits}/{total} ({rate:.1%}), 目录 {self.cache_dir}"
@@ -0,0 +1,379 @@
+import os
+import time
+import shutil
+import struct
+import tempfile
+import subprocess
+from fractions import Fraction
+import numpy as np
+import cv2
+from cybercast.utils.ffmpeg_runner import run_ffmpeg
+
+
+# --- 最小的 Matroska (EBML) 写入辅助函数，用于通过管道传输带时间戳的原始帧 ---
+def _ebml_size(size: int) -> bytes:
+    for length in range(1, 9):
+        if size < (1 << (7 * length)) - 1:
+            return ((1 << (7 * length)) | size).to_bytes(length, 'big')
+    raise ValueError(f"EBML 元素过大: {size}")
+
+def _ebml_uint(value: int) -> bytes:
+    return value.to_bytes(max(1, (value.bit_length() + 7) // 8), 'big')
+
+def _ebml_element(element_id: bytes, payload: bytes) -> bytes:
+    return element_id + _ebml_size(len(payload)) + payload
+
+def matroska_raw_header(width: int, height: int, fps: float) -> bytes:
+    """
+    生成单路 BGR24 原始视频的 Matroska 流头部。Segment 长度未知，时间戳单位为一帧（1/fps 秒）。
+    """
+    ebml = _ebml_element(b'\x1a\x45\xdf\xa3', b''.join([
+        _ebml_element(b'\x42\x86', _ebml_uint(1)),          # EBMLVersion
+        _ebml_element(b'\x42\xf7', _ebml_uint(1)),          # EBMLReadVersion
+        _ebml_element(b'\x42\xf2', _ebml_uint(4)),          # EBMLMaxIDLength
+        _ebml_element(b'\x42\xf3', _ebml_uint(8)),          # EBMLMaxSizeLength
+        _ebml_element(b'\x42\x82', b'matroska'),            # DocType
+        _ebml_element(b'\x42\x87', _ebml_uint(4)),          # DocTypeVersion
+        _ebml_element(b'\x42\x85', _ebml_uint(2)),          # DocTypeReadVersion
+    ]))
+    segment = b'\x18\x53\x80\x67' + b'\x01\xff\xff\xff\xff\xff\xff\xff'  # 长度未知的 Segment
+    info = _ebml_element(b'\x15\x49\xa9\x66',
+                         _ebml_element(b'\x2a\xd7\xb1', _ebml_uint(int(round(1e9 / fps)))))  # TimestampScale
+    video = _ebml_element(b'\xe0', b''.join([
+        _ebml_element(b'\xb0', _ebml_uint(width)),           # PixelWidth
+        _ebml_element(b'\xba', _ebml_uint(height)),          # PixelHeight
+        _ebml_element(b'\x2e\xb5\x24', b'BGR\x18'),         # ColourSpace (FourCC)
+    ]))
+    track = _ebml_element(b'\xae', b''.join([
+        _ebml_element(b'\xd7', _ebml_uint(1)),               # TrackNumber
+        _ebml_element(b'\x73\xc5', _ebml_uint(1)),           # TrackUID
+        _ebml_element(b'\x83', _ebml_uint(1)),               # TrackType: video
+        _ebml_element(b'\x86', b'V_UNCOMPRESSED'),           # CodecID
+        _ebml_element(b'\x9c', _ebml_uint(0)),               # FlagLacing
+        video,
+    ]))
+    return ebml + segment + info + _ebml_element(b'\x16\x54\xae\x6b', track)
+
+def matroska_frame_prefix(timestamp: int, frame_bytes: int) -> bytes:
+    """
+    每帧一个 Cluster：Cluster 时间戳为帧序号，SimpleBlock 相对时间戳为 0。
+    返回帧数据之前的所有字节，帧数据本身由调用方直接写入，避免拼接拷贝。
+    """
+    cluster_timestamp = _ebml_element(b'\xe7', _ebml_uint(timestamp))
+    block_header = b'\x81' + struct.pack('>h', 0) + b'\x80'  # 轨道 1，相对时间戳 0，关键帧
+    block_size = len(block_header) + frame_bytes
+    simple_block_header = b'\xa3' + _ebml_size(block_size)
+    cluster_size = len(cluster_timestamp) + len(simple_block_header) + block_size
+    return b'\x1f\x43\xb6\x75' + _ebml_size(cluster_size) + cluster_timestamp + simple_block_header + block_header
+
+def audio_codec_args(codec: str, bitrate: str) -> list[str]:
+    """音频编码参数。codec 为 "copy" 时直接复制输入音频（MP3 可以直接封装进 MP4），不重新编码。"""
+    if codec == "copy":
+        return ['-c:a', 'copy']
+    return ['-c:a', codec, '-b:a', bitrate]
+
+
+class FFmpegPipeEncoder:
+    """
+    将原始 BGR 帧通过 stdin 写入一个长驻的 ffmpeg 进程，音频作为第二路输入，
+    一次完成视频编码（默认 H.264）与音视频封装，不产生临时文件。
+
+    vfr 模式下帧以带时间戳的 Matroska 流写入，连续相同的帧只写一次（hold 延长上一帧的显示时间），
+    输出为可变帧率视频，静音段不再重复绘制、传输和编码。
+    """
+
+    supports_vfr = True
+
+    def __init__(
+        self,
+        output_path: str,
+        width: int,
+        height: int,
+        fps: float,
+        audio_path: str = None,
+        ffmpeg_path: str = "ffmpeg",
+        codec: str = "libx264",
+        preset: str = "veryfast",
+        crf: int = 23,
+        threads: int | None = None,
+        pix_fmt: str = "yuv420p",
+        audio_codec: str = "aac",
+        audio_bitrate: str = "192k",
+        vfr: bool = False,
+    ):
+        """
+        Args:
+            output_path (str): 输出视频文件路径。
+            width (int): 视频宽度（像素）。
+            height (int): 视频高度（像素）。
+            fps (float): 帧率。
+            audio_path (str, optional): 需要封装进视频的音频文件，为 None 时输出无声视频。
+            ffmpeg_path (str, optional): ffmpeg 可执行文件路径。默认为 "ffmpeg"。
+            codec (str, optional): 视频编码器。默认为 "libx264"。
+            preset (str, optional): 编码器预设，越快文件越大。默认为 "veryfast"。
+            crf (int, optional): 恒定质量参数，越小质量越高。默认为 23。
+            threads (int | None, optional): 编码线程数，None 表示由 ffmpeg 自动决定。
+            pix_fmt (str, optional): 输出像素格式。默认为 "yuv420p"（兼容大多数播放器）。
+            audio_codec (str, optional): 音频编码器，"copy" 表示直接复制输入音频。默认为 "aac"。
+            audio_bitrate (str, optional): 音频码率（audio_codec 为 "copy" 时不使用）。默认为 "192k"。
+            vfr (bool, optional): 是否输出可变帧率视频，允许用 hold 延长上一帧。默认为 False。
+        """
+        self.output_path = output_path
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.audio_path = audio_path
+        self.ffmpeg_path = ffmpeg_path
+        self.codec = codec
+        self.preset = preset
+        self.crf = crf
+        self.threads = threads
+        self.pix_fmt = pix_fmt
+        self.audio_codec = audio_codec
+        self.audio_bitrate = audio_bitrate
+        self.vfr = vfr
+        self.frames_written = 0  # 时间线上的帧数（含 hold 延长的帧）
+        self.frames_encoded = 0  # 实际写入 ffmpeg 的帧数
+        self.process = None
+        self._stderr_file = None
+
+    def build_command(self) -> list[str]:
+        """构建 ffmpeg 命令行：第 0 路输入为 stdin 原始帧，第 1 路输入为音频。"""
+        cmd = [self.ffmpeg_path, '-hide_banner', '-loglevel', 'error', '-y']
+        if self.vfr:
+            cmd += ['-f', 'matroska', '-i', '-']
+        else:
+            cmd += [
+                '-f', 'rawvideo', '-pix_fmt', 'bgr24',
+                '-s', f'{self.width}x{self.height}', '-r', str(self.fps),
+                '-i', '-',
+            ]
+        if self.audio_path:
+            cmd += ['-i', self.audio_path]
+        cmd += ['-map', '0:v:0']
+        if self.audio_path:
+            cmd += ['-map', '1:a:0']
+        cmd += ['-c:v', self.codec, '-pix_fmt', self.pix_fmt]
+        if self.codec in ('libx264', 'libx265'):
+            cmd += ['-preset', self.preset, '-crf', str(self.crf)]
+        if self.threads:
+            cmd += ['-threads', str(self.threads)]
+        if self.vfr:
+            # 保留输入时间戳，编码时间基为一帧；关闭 B 帧，否则 mp4 中 VFR 帧的 dts 和总时长会出错
+            time_base = 1 / Fraction(self.fps).limit_denominator(1001)
+            cmd += ['-fps_mode', 'vfr', '-enc_time_base', f'{time_base.numerator}/{time_base.denominator}', '-bf', '0']
+        if self.audio_path:
+            cmd += audio_codec_args(self.audio_codec, self.audio_bitrate) + ['-shortest']
+        cmd += ['-movflags', '+faststart', self.output_path]
+        return cmd
+
+    def open(self) -> None:
+        if not shutil.which(self.ffmpeg_path):
+            raise FileNotFoundError(f"ffmpeg 未找到: {self.ffmpeg_path}")
+        # stderr 写入临时文件而不是管道，避免 ffmpeg 输出过多时阻塞
+        self._stderr_file = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            self.build_command(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=self._stderr_file,
+        )
+        if self.vfr:
+            self._write_bytes(matroska_raw_header(self.width, self.height, self.fps))
+
+    def write(self, frame: np.ndarray) -> None:
+        """写入一帧 (height, width, 3) 的 uint8 BGR 图像。"""
+        data = memoryview(np.ascontiguousarray(frame)).cast('B')
+        if self.vfr:
+            self._write_bytes(matroska_frame_prefix(self.frames_written, len(data)))
+        self._write_bytes(data)
+        self.frames_written += 1
+        self.frames_encoded += 1
+
+    def write_batch(self, frames: np.ndarray) -> None:
+        """写入 (n, height, width, 3) 的连续帧。恒定帧率模式下整批只需一次管道写入。"""
+        if self.vfr:
+            for frame in frames:
+                self.write(frame)
+            return
+        self._write_bytes(memoryview(np.ascontiguousarray(frames)).cast('B'))
+        self.frames_written += len(frames)
+        self.frames_encoded += len(frames)
+
+    def hold(self, count: int = 1) -> None:
+        """把上一帧的显示时间延长 count 帧（仅 vfr 模式），不写入任何数据。"""
+        if not self.vfr:
+            raise RuntimeError("只有 vfr 模式支持延长上一帧")
+        self.frames_written += count
+
+    def _write_bytes(self, data) -> None:
+        try:
+            self.process.stdin.write(data)
+        except (BrokenPipeError, OSError) as e:
+            raise RuntimeError(f"ffmpeg 编码进程异常退出: {self._read_stderr()}") from e
+
+    def close(self) -> None:
+        """结束输入并等待 ffmpeg 完成编码和封装，失败时抛出 RuntimeError。"""
+        if self.process is None:
+            return
+        try:
+            if self.process.stdin and not self.process.stdin.closed:
+                self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self.process.wait()
+        self.process = None
+        stderr = self._read_stderr()
+        self._stderr_file.close()
+        if returncode != 0:
+            print("--- ffmpeg 编码时 标准错误 ---")
+            print(stderr)
+            raise RuntimeError(f"ffmpeg 编码失败，返回码: {returncode}")
+
+    def abort(self) -> None:
+        """出错时强制结束 ffmpeg 进程。"""
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+        if self._stderr_file is not None:
+            self._stderr_file.close()
+
+    def _read_stderr(self) -> str:
+        if self._stderr_file is None or self._stderr_file.closed:
+            return ""
+        self._stderr_file.seek(0)
+        return self._stderr_file.read().decode('utf-8', errors='replace')
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class OpenCVEncoder:
+    """
+    备用编码器：先用 cv2.VideoWriter (mp4v) 写临时无声视频，再用 ffmpeg 复制视频流并合并音频。
+    在 ffmpeg 不支持所需编码器时使用。只支持恒定帧率，每一帧都需要写入。
+    """
+
+    supports_vfr = False
+
+    def __init__(
+        self,
+        output_path: str,
+        width: int,
+        height: int,
+        fps: float,
+        audio_path: str = None,
+        ffmpeg_path: str = "ffmpeg",
+        audio_codec: str = "aac",
+        audio_bitrate: str = "192k",
+        **kwargs,
+    ):
+        self.output_path = output_path
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.audio_path = audio_path
+        self.ffmpeg_path = ffmpeg_path
+        self.audio_codec = audio_codec
+        self.audio_bitrate = audio_bitrate
+        self.frames_written = 0
+        self.temp_video_file = None
+        self.video_writer = None
+
+    def open(self) -> None:
+        with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as tmp_f:
+            self.temp_video_file = tmp_f.name
+        print(f"创建临时无声视频文件: {self.temp_video_file}")
+
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        self.video_writer = cv2.VideoWriter(self.temp_video_file, fourcc, float(self.fps), (self.width, self.height))
+        if not self.video_writer.isOpened():
+            raise RuntimeError("无法打开视频写入器。")
+
+    def write(self, frame: np.ndarray) -> None:
+        self.video_writer.write(frame)
+        self.frames_written += 1
+
+    def write_batch(self, frames: np.ndarray) -> None:
+        for frame in frames:
+            self.write(frame)
+
+    def close(self) -> None:
+        if self.video_writer is not None and self.video_writer.isOpened():
+            self.video_writer.release()
+            print("无声视频写入器已释放。")
+        self.video_writer = None
+
+        if not self.audio_path:
+            shutil.move(self.temp_video_file, self.output_path)
+            return
+
+        # 使用 ffmpeg 合并音频和无声视频
+        print(f"正在使用 ffmpeg 将音频合并到视频中...")
+        start_merge_time = time.time()
+        cmd = [
+            self.ffmpeg_path, '-i', self.temp_video_file, '-i', self.audio_path,
+            '-map', '0:v:0', '-map', '1:a:0', '-c:v', 'copy',
+            *audio_codec_args(self.audio_codec, self.audio_bitrate), '-shortest', '-y',
+            self.output_path
+        ]
+        process = run_ffmpeg(cmd, label="mux_audio", check=False)
+
+        if process.returncode != 0:
+            print("--- ffmpeg 合并时 标准错误 ---")
+            print(process.stderr)
+            print("--- ffmpeg 合并时 标准输出 ---")
+            print(process.stdout)
+            print(f"警告: ffmpeg 合并失败。临时无声视频文件保留在: {self.temp_video_file}")
+            raise RuntimeError(f"ffmpeg 合并失败，返回码: {process.returncode}")
+
+        print(f"音频视频合并成功！合并耗时: {time.time() - start_merge_time:.2f}s")
+        # 清理临时文件
+        try:
+            os.remove(self.temp_video_file)
+            print(f"已清理临时无声视频文件: {self.temp_video_file}")
+        except OSError as e:
+            print(f"警告: 无法删除临时文件 {self.temp_video_file}: {e}")
+
+    def abort(self) -> None:
+        if self.video_writer is not None and self.video_writer.isOpened():
+            self.video_writer.release()
+        self.video_writer = None
+        if self.temp_video_file and os.path.exists(self.temp_video_file):
+            os.remove(self.temp_video_file)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+ENCODER_BACKENDS = {
+    "ffmpeg": FFmpegPipeEncoder,
+    "opencv": OpenCVEncoder,
+}
+
+def create_video_encoder(backend: str = "ffmpeg", **kwargs):
+    """
+    按名称创建视频编码器。
+
+    Args:
+        backend (str, optional): "ffmpeg"（管道直写，单次编码）或 "opencv"（VideoWriter + ffmpeg 合并）。
+        **kwargs: 传给编码器构造函数的参数，见 FFmpegPipeEncoder。
+    """
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"未知的编码器后端: {backend}，可选: {', '.join(ENCODER_BACKENDS)}")
+    return ENCODER_BACKENDS[backend](**kwargs)
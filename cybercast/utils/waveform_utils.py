@@ -1,126 +1,916 @@
-import librosa
 import numpy as np
 import cv2
-import subprocess
 import os
 import math
-import tempfile
+import sys
 import shutil
 import time
 import multiprocessing # 导入并行处理模块
+import queue
+import threading
+import bisect
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from cybercast.utils.audio_decoder import decode_audio, iter_audio_chunks, count_audio_samples
+from cybercast.utils.pcm_store import load_pcm, PCM_STORE_ENABLED
+from cybercast.utils.video_encoder import create_video_encoder, ENCODER_BACKENDS
+from cybercast.utils.frame_ring import SharedFrameRing
+from cybercast.utils.frame_scheduler import OrderedFrameScheduler
 
 # --- 全局变量，用于工作进程初始化，避免重复传递大数据 ---
-worker_audio_data = None
+# 进程池在整个渲染服务生命周期内常驻，这里只保存与片段无关的参数；
+# 片段相关的数据（振幅包络、头像、颜色）随每个任务下发。
 worker_params = {}
+worker_frame_cache = None
+worker_frame_ring = None
+worker_static_layers = OrderedDict()  # 片段样式 -> StaticLayer，只保留最近使用的几个
 
-def init_worker(audio_data_global, params_global):
+MAX_WORKER_STATIC_LAYERS = 4
+
+# 渲染器版本：绘制或编码逻辑改变、导致同样输入得到不同画面时递增，使片段渲染缓存失效
+RENDERER_VERSION = 2
+
+def init_worker(params_global):
     """
     多进程池的初始化函数。
-    将大的、只读的数据加载到每个工作进程的内存中一次。
+    将与片段无关的只读绘制参数（分辨率、相位表等）加载到每个工作进程的内存中一次。
     """
-    global worker_audio_data, worker_params
-    worker_audio_data = audio_data_global
+    global worker_params, worker_frame_cache, worker_frame_ring
     worker_params = params_global
+    cache_bytes = params_global.get('frame_cache_bytes', 0)
+    worker_frame_cache = FrameCache(cache_bytes) if cache_bytes > 0 else None
+    # 挂载主进程创建的共享内存帧槽，帧直接渲染进槽位
+    ring_name = params_global.get('frame_ring_name')
+    if ring_name:
+        worker_frame_ring = SharedFrameRing.attach(ring_name, params_global['frame_ring_slots'],
+                                                   (params_global['height'], params_global['width'], 3))
     # print(f"工作进程 {os.getpid()} 初始化完毕。") # 用于调试
 
-def process_frame(frame_n):
+# --- 振幅包络 ---
+def compute_amplitude_envelope(
+    y: np.ndarray,
+    total_frames: int,
+    fps: int,
+    mode: str = "rms",
+    gain: float = 4.0,
+    smoothing_frames: int = 1,
+    attack_ms: float = 30.0,
+    release_ms: float = 120.0,
+) -> np.ndarray:
+    """
+    为每个视频帧计算一个振幅值（向量化），渲染阶段只需要这个长度为 total_frames 的数组。
+
+    每帧对应音频中连续的一段采样，取该段的 RMS 或峰值，乘以增益后限制在 [0, 1]，
+    再依次做滑动平均平滑和 attack/release 包络跟随，避免单采样取值导致的闪烁。
+
+    Args:
+        y (np.ndarray): 单声道音频采样。
+        total_frames (int): 视频总帧数。
+        fps (int): 帧率，用于把 attack/release 时间换算为帧数。
+        mode (str, optional): "rms" 或 "peak"。默认为 "rms"。
+        gain (float, optional): 振幅放大倍数，使波形更加明显。默认为 4.0。
+        smoothing_frames (int, optional): 滑动平均窗口（帧数），1 表示不平滑。默认为 1。
+        attack_ms (float, optional): 振幅上升的时间常数（毫秒），0 表示立即跟随。默认为 30。
+        release_ms (float, optional): 振幅回落的时间常数（毫秒），0 表示立即跟随。默认为 120。
+
+    Returns:
+        np.ndarray: 形状为 (total_frames,) 的 float32 数组，取值范围 [0, 1]。
+    """
+    if total_frames <= 0:
+        return np.zeros(0, dtype=np.float32)
+    if len(y) == 0:
+        return np.zeros(total_frames, dtype=np.float32)
+
+    # 整段音频一次推入增量计算器，与流式模式逐块推入的结果完全一致
+    stream = AmplitudeEnvelopeStream(len(y), total_frames, fps, mode=mode, gain=gain,
+                                     smoothing_frames=smoothing_frames, attack_ms=attack_ms, release_ms=release_ms)
+    return np.concatenate([stream.push(y), stream.finish()])
+
+class AmplitudeEnvelopeStream:
+    """
+    逐块推入音频采样、增量产出逐帧振幅包络，内存占用只与块大小有关。
+
+    第 n 帧对应采样区间 [n * 总采样数 // 总帧数, (n + 1) * 总采样数 // 总帧数)，因此需要预先知道总采样数。
+    跨块的不完整帧保留原始采样，等区间完整后再整体归约；平滑窗口和 attack/release 状态在块之间延续。
+    所以无论如何分块，结果都与一次推入整段音频相同。
+    """
+
+    def __init__(
+        self,
+        total_samples: int,
+        total_frames: int,
+        fps: int,
+        mode: str = "rms",
+        gain: float = 4.0,
+        smoothing_frames: int = 1,
+        attack_ms: float = 30.0,
+        release_ms: float = 120.0,
+    ):
+        """
+        Args:
+            total_samples (int): 音频总采样数（单声道）。
+            total_frames (int): 视频总帧数。
+            其余参数同 compute_amplitude_envelope。
+        """
+        if mode not in ("rms", "peak"):
+            raise ValueError(f"未知的包络模式: {mode}")
+        if total_samples <= 0 or total_frames <= 0:
+            raise ValueError(f"总采样数和总帧数必须大于 0: {total_samples}, {total_frames}")
+        self.total_samples = total_samples
+        self.total_frames = total_frames
+        self.fps = fps
+        self.mode = mode
+        self.gain = gain
+        self.smoothing_frames = max(1, smoothing_frames)
+        self.attack_ms = attack_ms
+        self.release_ms = release_ms
+
+        self.frames_emitted = 0
+        self._next_frame = 0                              # 下一个尚未归约的帧
+        self._tail = np.zeros(0, dtype=np.float32)        # 从 _next_frame 起点开始、尚未归约的采样
+        self._samples_received = 0
+        # 平滑窗口 [i - k//2, i + (k-1)//2]，开头补 k//2 个 0，与 np.convolve(mode="same") 的边界一致
+        self._smooth_history = np.zeros(self.smoothing_frames // 2, dtype=np.float32)
+        self._level = 0.0                                 # attack/release 跟随器的当前值
+
+    def _frame_start(self, frame_n: int) -> int:
+        return frame_n * self.total_samples // self.total_frames
+
+    def push(self, samples: np.ndarray) -> np.ndarray:
+        """
+        推入下一块单声道采样，返回新完成的帧的包络值（可能为空）。
+
+        超出 total_samples 的采样会被忽略。
+        """
+        remaining = self.total_samples - self._samples_received
+        samples = samples[:max(0, remaining)]
+        self._samples_received += len(samples)
+        buf = np.concatenate([self._tail, samples]) if len(self._tail) else samples
+        buf_start = self._frame_start(self._next_frame)
+        available = buf_start + len(buf)
+
+        # 起点已到达的最后一帧；它之前的帧区间都已完整（其后一个采样也已到达，保证空区间帧也能取值）。
+        # 最后一帧的区间延伸到音频末尾，总是留给 finish 处理
+        last = min(self.total_frames - 1, (available * self.total_frames - 1) // self.total_samples)
+        if last <= self._next_frame:
+            self._tail = buf.copy() if buf is samples else buf
+            return self._finish_frames(np.zeros(0, dtype=np.float32), final=False)
+
+        values = self._reduce(buf, buf_start, self._next_frame, last)
+        consumed = self._frame_start(last) - buf_start
+        self._tail = buf[consumed:].copy()
+        self._next_frame = last
+        return self._finish_frames(values, final=False)
+
+    def finish(self) -> np.ndarray:
+        """所有采样推入完毕后调用，返回剩余帧的包络值。采样不足 total_samples 时按静音补齐。"""
+        if self._samples_received < self.total_samples:
+            self.push(np.zeros(self.total_samples - self._samples_received, dtype=np.float32))
+        values = self._reduce(self._tail, self._frame_start(self._next_frame), self._next_frame, self.total_frames)
+        self._tail = np.zeros(0, dtype=np.float32)
+        self._next_frame = self.total_frames
+        return self._finish_frames(values, final=True)
+
+    def _reduce(self, buf: np.ndarray, buf_start: int, first: int, stop: int) -> np.ndarray:
+        """计算帧 [first, stop) 的原始 RMS / 峰值。buf 从 first 帧的起点开始。"""
+        frames = np.arange(first, stop + 1, dtype=np.int64)
+        bounds = (frames * self.total_samples) // self.total_frames - buf_start
+        bounds[-1] = min(bounds[-1], len(buf))
+        starts = bounds[:-1]
+        # stop 帧的起点作为额外的归约起点，使最后一个完整帧的区间在这里截止；该段结果丢弃
+        indices = bounds if bounds[-1] < len(buf) else starts
+        if self.mode == "rms":
+            sums = np.add.reduceat(np.square(buf, dtype=np.float32), indices)[:len(starts)]
+            counts = np.diff(bounds)
+            return np.sqrt(sums / np.maximum(counts, 1)).astype(np.float32)
+        return np.maximum.reduceat(np.abs(buf), indices)[:len(starts)].astype(np.float32)
+
+    def _finish_frames(self, values: np.ndarray, final: bool) -> np.ndarray:
+        """对新归约出的帧依次做增益限幅、滑动平均和 attack/release。"""
+        np.clip(values * self.gain, 0.0, 1.0, out=values)
+
+        k = self.smoothing_frames
+        if k > 1:
+            history = np.concatenate([self._smooth_history, values])
+            if final:
+                history = np.concatenate([history, np.zeros((k - 1) // 2, dtype=np.float32)])
+            if len(history) >= k:
+                windows = np.lib.stride_tricks.sliding_window_view(history, k)
+                values = (windows.sum(axis=1) / k).astype(np.float32)
+                self._smooth_history = history[len(values):]
+            else:
+                values = np.zeros(0, dtype=np.float32)
+                self._smooth_history = history
+
+        if len(values) and (self.attack_ms > 0 or self.release_ms > 0):
+            values, self._level = apply_attack_release(values, self.fps, self.attack_ms, self.release_ms,
+                                                       initial=self._level, return_level=True)
+
+        self.frames_emitted += len(values)
+        return values
+
+class StreamingEnvelope:
+    """
+    按帧序号顺序读取包络切片。需要更多帧时从音频块迭代器取下一块推入 AmplitudeEnvelopeStream，
+    已读出的帧立即丢弃，因此只保留约一块音频对应的包络值。
+    """
+
+    def __init__(self, chunks, envelope_stream: AmplitudeEnvelopeStream):
+        """
+        Args:
+            chunks (Iterator[np.ndarray]): 单声道采样块的迭代器。
+            envelope_stream (AmplitudeEnvelopeStream): 增量包络计算器。
+        """
+        self.chunks = chunks
+        self.stream = envelope_stream
+        self.base = 0                                  # values[0] 对应的帧序号
+        self.values = np.zeros(0, dtype=np.float32)
+        self._finished = False
+
+    def slice(self, start: int, end: int) -> np.ndarray:
+        """返回帧 [start, end) 的包络值。start 不能小于上一次调用的 end。"""
+        if start < self.base:
+            raise ValueError(f"流式包络只能按顺序读取: 请求第 {start} 帧，已读到第 {self.base} 帧")
+        while self.base + len(self.values) < end:
+            if self._finished:
+                raise ValueError(f"请求的帧超出音频长度: {end} > {self.base + len(self.values)}")
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                new_values = self.stream.finish()
+                self._finished = True
+            else:
+                new_values = self.stream.push(chunk)
+            self.values = np.concatenate([self.values, new_values])
+        result = self.values[start - self.base:end - self.base]
+        self.values = self.values[end - self.base:]
+        self.base = end
+        return result
+
+def apply_attack_release(values: np.ndarray, fps: int, attack_ms: float, release_ms: float,
+                         initial: float = 0.0, return_level: bool = False):
+    """
+    对逐帧振幅做一阶 attack/release 包络跟随：上升时按 attack 时间常数逼近，回落时按 release 时间常数逼近。
+
+    循环次数等于帧数（每小时约 10 万次），开销可以忽略。
+    return_level 为 True 时同时返回跟随器最终的（未舍入为 float32 的）值，供分块处理时作为下一块的 initial。
+    """
+    attack_coef = math.exp(-1000.0 / (attack_ms * fps)) if attack_ms > 0 else 0.0
+    release_coef = math.exp(-1000.0 / (release_ms * fps)) if release_ms > 0 else 0.0
+    out = np.empty(len(values), dtype=np.float32)
+    level = initial
+    for i, target in enumerate(values.tolist()):
+        coef = attack_coef if target > level else release_coef
+        level = target + coef * (level - target)
+        out[i] = level
+    if return_level:
+        return out, level
+    return out
+
+# --- 正弦波绘制辅助函数 ---
+def build_phase_table(width: int, cycles: float = 4.0) -> np.ndarray:
+    """
+    预先计算正弦波在每个 x 坐标处的 sin(phase) 值，整段视频只需计算一次。
+
+    Args:
+        width (int): 视频宽度（像素），即波形采样点数。
+        cycles (float, optional): 画面宽度内的正弦周期数。默认为 4。
+
+    Returns:
+        np.ndarray: 形状为 (width,) 的 float64 数组。
+    """
+    phase = np.arange(width, dtype=np.float64) / width * (2 * cycles) * np.pi
+    return np.sin(phase)
+
+def build_wave_points(width: int) -> np.ndarray:
+    """
+    创建波形折线的点缓冲区，x 坐标固定为 0..width-1，y 坐标在每帧中原地更新。
+
+    Returns:
+        np.ndarray: 形状为 (width, 2) 的 int32 数组，可直接传给 cv2.polylines。
+    """
+    points = np.zeros((width, 2), dtype=np.int32)
+    points[:, 0] = np.arange(width, dtype=np.int32)
+    return points
+
+def compute_sine_wave_points(points: np.ndarray, phase_table: np.ndarray, amplitude: float,
+                             center_y: int, height: int) -> np.ndarray:
+    """
+    用一次向量化运算计算当前帧所有波形点的 y 坐标（原地写入 points[:, 1]）。
+
+    与逐点计算 `int(amplitude * np.sin(phase))` 的结果一致（向零取整），并裁剪到画面范围内。
+    """
+    y_offsets = (amplitude * phase_table).astype(np.int32)
+    np.clip(center_y + y_offsets, 0, height - 1, out=points[:, 1])
+    return points
+
+# --- 可视化器 ---
+class SineWaveVisualizer:
+    """
+    正弦波可视化器：每帧一个振幅值（逐帧 RMS/峰值包络），画面为 x 轴固定、振幅随音频变化的正弦曲线。
+
+    可视化器接口：
+        analyze(y, sr, total_frames, fps, width, envelope_options) -> 逐帧特征（第一维为帧）
+        quantize(features, height) -> 逐帧整数绘制参数，取值相同的帧画面完全相同（用于帧缓存和可变帧率）
+        prepare(width, height) -> 工作进程内只计算一次的绘制查找表
+        draw(frame, level, color_bgr, tables) -> 在帧图像上原地绘制
+        draw_batch(frames, levels, color_bgr, tables) -> 在 (n, H, W, 3) 的连续帧上原地绘制，结果与逐帧 draw 相同
+    """
+
+    name = "sine"
+    supports_streaming = True  # 包络可以用 AmplitudeEnvelopeStream 逐块增量计算
+
+    def __init__(self, cycles: float = 4.0, line_width: int = 2):
+        """
+        Args:
+            cycles (float, optional): 画面宽度内的正弦周期数。默认为 4。
+            line_width (int, optional): 曲线线宽（像素）。默认为 2。
+        """
+        self.cycles = cycles
+        self.line_width = line_width
+
+    def signature(self) -> dict:
+        return {'name': self.name, 'cycles': self.cycles, 'line_width': self.line_width}
+
+    def analyze(self, y: np.ndarray, sr: int, total_frames: int, fps: int, width: int,
+                envelope_options: dict) -> np.ndarray:
+        return compute_amplitude_envelope(y, total_frames, fps, **envelope_options)
+
+    def quantize(self, features: np.ndarray, height: int) -> np.ndarray:
+        return quantize_envelope(features, height)
+
+    def prepare(self, width: int, height: int) -> dict:
+        return {
+            'phase_table': build_phase_table(width, self.cycles),  # 相位表整个运行期间只计算一次
+            'wave_points': build_wave_points(width),
+        }
+
+    def draw(self, frame: np.ndarray, level, color_bgr: tuple[int, int, int], tables: dict) -> None:
+        # 根据预先计算的相位表一次性得到所有点的 y 坐标，并用一次 polylines 绘制
+        height = frame.shape[0]
+        wave_points = compute_sine_wave_points(tables['wave_points'], tables['phase_table'], int(level), height // 2, height)
+        cv2.polylines(frame, [wave_points], False, color_bgr, self.line_width)
+
+    def draw_batch(self, frames: np.ndarray, levels: np.ndarray, color_bgr: tuple[int, int, int], tables: dict) -> None:
+        # 整批帧的波形点坐标用一次广播运算得到（与 compute_sine_wave_points 逐帧结果相同），折线仍由 cv2 逐帧绘制
+        height = frames.shape[1]
+        points = np.empty((len(levels), len(tables['phase_table']), 2), dtype=np.int32)
+        points[:, :, 0] = tables['wave_points'][:, 0]
+        y_offsets = (levels.astype(np.int64)[:, None] * tables['phase_table']).astype(np.int32)
+        np.clip(height // 2 + y_offsets, 0, height - 1, out=points[:, :, 1])
+        for frame, frame_points in zip(frames, points):
+            cv2.polylines(frame, [frame_points], False, color_bgr, self.line_width)
+
+class SpectrumBarVisualizer:
+    """
+    频谱柱状图可视化器：以画面中线为轴上下对称的竖条，每条对应一个对数间隔的频带。
+
+    整段音频只做一次批量 STFT：每个视频帧以其采样区间的中点为窗口中心取一个窗口，
+    按批堆叠后一次 rfft，再用预先计算的频点->柱子索引表（np.maximum.reduceat）归约为每帧每柱的幅度。
+    绘制时用预先计算的“列 -> 柱子”索引表得到每列的高度，一次比较得到掩码，再用一次 cv2.copyTo 写入纯色，
+    只处理本帧最高柱子覆盖的行。
+    """
+
+    name = "bars"
+    supports_streaming = False  # 需要完整的音频做 STFT
+
+    def __init__(
+        self,
+        bar_width: int = 4,
+        gap_width: int = 1,
+        window_sec: float = 0.05,
+        min_freq: float = 60.0,
+        max_freq: float = 16000.0,
+        dynamic_range_db: float = 60.0,
+        batch_frames: int = 512,
+    ):
+        """
+        Args:
+            bar_width (int, optional): 柱子宽度（像素）。默认为 4。
+            gap_width (int, optional): 柱子间隔（像素）。默认为 1。
+            window_sec (float, optional): STFT 窗口时长（秒），实际窗口取不小于它的 2 的幂，限制在 [256, 4096] 个采样。
+                                          默认为 0.05。
+            min_freq (float, optional): 最低频带的下限（Hz）。默认为 60。
+            max_freq (float, optional): 最高频带的上限（Hz），超过奈奎斯特频率时取奈奎斯特频率。默认为 16000。
+            dynamic_range_db (float, optional): 显示的动态范围（dB），满幅正弦为柱子满高，低于满幅该值时高度为 0。默认为 60。
+            batch_frames (int, optional): 每批做 rfft 的帧数，限制窗口矩阵的内存占用。默认为 512。
+        """
+        if bar_width < 1 or gap_width < 0:
+            raise ValueError(f"无效的柱子宽度或间隔: {bar_width}, {gap_width}")
+        self.bar_width = bar_width
+        self.gap_width = gap_width
+        self.window_sec = window_sec
+        self.min_freq = min_freq
+        self.max_freq = max_freq
+        self.dynamic_range_db = dynamic_range_db
+        self.batch_frames = max(1, batch_frames)
+
+    def signature(self) -> dict:
+        return {
+            'name': self.name, 'bar_width': self.bar_width, 'gap_width': self.gap_width,
+            'window_sec': self.window_sec, 'min_freq': self.min_freq, 'max_freq': self.max_freq,
+            'dynamic_range_db': self.dynamic_range_db,
+        }
+
+    def num_bars(self, width: int) -> int:
+        return max(1, (width + self.gap_width) // (self.bar_width + self.gap_width))
+
+    def fft_size(self, sr: int) -> int:
+        window = max(1, int(self.window_sec * sr))
+        return int(min(4096, max(256, 1 << (window - 1).bit_length())))
+
+    def bar_bin_table(self, sr: int, n_fft: int, num_bars: int) -> tuple[np.ndarray, int]:
+        """
+        频点 -> 柱子的索引表：返回每个柱子的起始频点和所用频点的上界（不含）。
+
+        频带边界按对数间隔；低频处多个柱子可能落在同一个频点上，此时它们都取该频点的幅度。
+        """
+        freqs = np.arange(n_fft // 2 + 1) * sr / n_fft
+        max_freq = min(self.max_freq, sr / 2)
+        min_freq = min(self.min_freq, max_freq / 2)
+        edges = np.geomspace(min_freq, max_freq, num_bars + 1)
+        end_bin = int(min(len(freqs), max(2, np.searchsorted(freqs, max_freq, side='right'))))
+        start_bins = np.clip(np.searchsorted(freqs, edges[:-1]), 0, end_bin - 1)
+        return start_bins, end_bin
+
+    def analyze(self, y: np.ndarray, sr: int, total_frames: int, fps: int, width: int,
+                envelope_options: dict) -> np.ndarray:
+        num_bars = self.num_bars(width)
+        if total_frames <= 0:
+            return np.zeros((0, num_bars), dtype=np.float32)
+        if len(y) == 0:
+            return np.zeros((total_frames, num_bars), dtype=np.float32)
+
+        n_fft = self.fft_size(sr)
+        start_bins, end_bin = self.bar_bin_table(sr, n_fft, num_bars)
+        window = np.hanning(n_fft).astype(np.float32)
+        # 第 n 帧窗口的中心为其采样区间 [n * N // F, (n + 1) * N // F) 的中点；两端各补半个窗口的 0
+        centers = ((2 * np.arange(total_frames, dtype=np.int64) + 1) * len(y)) // (2 * total_frames)
+        padded = np.pad(y.astype(np.float32, copy=False), (n_fft // 2, n_fft // 2))
+        windows = np.lib.stride_tricks.sliding_window_view(padded, n_fft)
+
+        bars = np.empty((total_frames, num_bars), dtype=np.float32)
+        for batch_start in range(0, total_frames, self.batch_frames):
+            batch = centers[batch_start:batch_start + self.batch_frames]
+            spectrum = np.abs(np.fft.rfft(windows[batch] * window, axis=1))[:, :end_bin]
+            bars[batch_start:batch_start + len(batch)] = np.maximum.reduceat(spectrum, start_bins, axis=1)
+
+        # 幅度换算为 dB：满幅正弦在加汉宁窗后的峰值约为 n_fft / 4，对应柱子满高
+        db = 20.0 * np.log10(np.maximum(bars / (n_fft / 4), 1e-10))
+        values = np.clip((db + self.dynamic_range_db) / self.dynamic_range_db, 0.0, 1.0).astype(np.float32)
+        return self._attack_release(values, fps, envelope_options.get('attack_ms', 0.0),
+                                    envelope_options.get('release_ms', 0.0))
+
+    @staticmethod
+    def _attack_release(values: np.ndarray, fps: int, attack_ms: float, release_ms: float) -> np.ndarray:
+        """对每个柱子做与 apply_attack_release 相同的包络跟随，所有柱子在每帧内向量化计算。"""
+        if attack_ms <= 0 and release_ms <= 0:
+            return values
+        attack_coef = math.exp(-1000.0 / (attack_ms * fps)) if attack_ms > 0 else 0.0
+        release_coef = math.exp(-1000.0 / (release_ms * fps)) if release_ms > 0 else 0.0
+        out = np.empty_like(values)
+        level = np.zeros(values.shape[1], dtype=np.float32)
+        for i, target in enumerate(values):
+            coef = np.where(target > level, attack_coef, release_coef).astype(np.float32)
+            level = target + coef * (level - target)
+            out[i] = level
+        return out
+
+    def quantize(self, features: np.ndarray, height: int) -> np.ndarray:
+        # 柱子半高最大为画面高度的 40%，与正弦波振幅范围一致
+        return (features.astype(np.float64) * (height * 0.4)).astype(np.int16)
+
+    def prepare(self, width: int, height: int) -> dict:
+        num_bars = self.num_bars(width)
+        step = self.bar_width + self.gap_width
+        span = num_bars * step - self.gap_width
+        x0 = max(0, (width - span) // 2)
+        x1 = min(width, x0 + span)
+        # 列 -> 柱子序号；间隔列指向末尾追加的高度 0
+        columns = np.arange(x1 - x0)
+        column_bars = np.where(columns % step < self.bar_width, columns // step, num_bars)
+        return {
+            'bar_columns': (x0, x1),
+            'column_bars': column_bars.astype(np.intp),
+            # 与中线的距离，int16 与量化后的柱高同类型，比较时不做类型提升
+            'row_distance': np.arange(height // 2 + 1, dtype=np.int16)[:, None],
+        }
+
+    def draw(self, frame: np.ndarray, level, color_bgr: tuple[int, int, int], tables: dict) -> None:
+        # 查表得到每列的高度，一次比较得到中线以下半边的掩码，上半边为其镜像；
+        # 拼成整块掩码后用一次 cv2.copyTo 把纯色写入柱子覆盖的像素。静音时每个柱子保留 1 像素，画出一条基线
+        height = frame.shape[0]
+        center = height // 2
+        heights = np.append(np.maximum(level, 1), 0).astype(np.int16, copy=False)
+        column_heights = heights[tables['column_bars']]
+        reach = min(int(heights.max()), len(tables['row_distance']))
+        half = (tables['row_distance'][:reach] < column_heights).view(np.uint8)
+        above = min(reach - 1, center)   # 中线以上的行数
+        below = min(reach, height - center)  # 中线及以下的行数
+        mask = np.concatenate([half[above:0:-1], half[:below]])
+        x0, x1 = tables['bar_columns']
+        # 纯色图按颜色缓存在工作进程内，颜色改变（切换片段）时才重新填充
+        fill = tables.get('fill')
+        if fill is None or tables.get('fill_color') != color_bgr:
+            fill = np.empty((height, x1 - x0, 3), dtype=np.uint8)
+            fill[:] = color_bgr
+            tables['fill'], tables['fill_color'] = fill, color_bgr
+        cv2.copyTo(fill[:len(mask)], mask, frame[center - above:center + below, x0:x1])
+
+    def draw_batch(self, frames: np.ndarray, levels: np.ndarray, color_bgr: tuple[int, int, int], tables: dict) -> None:
+        # 每帧一次掩码写入，批量模式只省去逐帧的任务调度
+        for frame, level in zip(frames, levels):
+            self.draw(frame, level, color_bgr, tables)
+
+VISUALIZERS = {
+    "sine": SineWaveVisualizer,
+    "bars": SpectrumBarVisualizer,
+}
+
+def create_visualizer(name: str = "sine", **kwargs):
     """
-    由每个工作进程执行的函数，用于生成单帧图像。
-    
-    这个版本创建的是固定 x 位置的正弦波曲线，y 值随音频变化。
-    并在中心位置显示带圆形蒙版的头像。
+    按名称创建可视化器。
 
     Args:
-        frame_n (int): 需要处理的帧序号。
+        name (str, optional): "sine"（正弦波）或 "bars"（频谱柱状图）。
+        **kwargs: 传给可视化器构造函数的参数。
+    """
+    if name not in VISUALIZERS:
+        raise ValueError(f"未知的可视化器: {name}，可选: {', '.join(VISUALIZERS)}")
+    return VISUALIZERS[name](**kwargs)
+
+def load_avatar_image(avatar_path: str) -> np.ndarray | None:
+    """
+    加载头像并转换为 3 通道 BGR 图像，文件不存在或无法读取时返回 None。
+    """
+    if not avatar_path or not os.path.exists(avatar_path):
+        return None
+    try:
+        avatar_img = cv2.imread(avatar_path)
+        if avatar_img is None:
+            print(f"警告: 无法加载头像 {avatar_path}")
+            return None
+        # 转换为 BGR 格式（如果需要）
+        if len(avatar_img.shape) == 2:  # 灰度图
+            avatar_img = cv2.cvtColor(avatar_img, cv2.COLOR_GRAY2BGR)
+        elif avatar_img.shape[2] == 4:  # 带 alpha 通道
+            # 如果图像有 alpha 通道，提取 RGB 部分
+            avatar_img = avatar_img[:, :, :3]
+        return avatar_img
+    except Exception as e:
+        print(f"警告: 加载头像时出错: {e}")
+        return None
+
+class StaticLayer:
+    """
+    与帧序号无关的静态图层：背景填充 + 带圆形蒙版的头像。
+
+    整段视频只构建一次，每帧只需复制底图、绘制波形，再把头像区域覆盖回去。
+    """
+
+    def __init__(self, width: int, height: int, background_bgr: tuple[int, int, int], avatar_img: np.ndarray = None):
+        """
+        Args:
+            width (int): 视频宽度（像素）。
+            height (int): 视频高度（像素）。
+            background_bgr (tuple[int, int, int]): 背景颜色 (BGR)。
+            avatar_img (np.ndarray, optional): BGR 头像图像，为 None 时不绘制头像。
+        """
+        self.width = width
+        self.height = height
+        self.base = np.full((height, width, 3), background_bgr, dtype=np.uint8)
+
+        # 头像区域覆盖层: 位置、缩放后的头像和圆形蒙版
+        self.avatar_region = None
+        self.avatar_patch = None
+        self.avatar_mask = None
+
+        if avatar_img is not None:
+            # 限制头像大小为视频尺寸的1/3，位于画面中心
+            avatar_size = min(height // 3, width // 3)
+            avatar_resized = cv2.resize(avatar_img, (avatar_size, avatar_size), interpolation=cv2.INTER_AREA)
+
+            # 创建圆形蒙版
+            mask = np.zeros((avatar_size, avatar_size), dtype=np.uint8)
+            cv2.circle(mask, (avatar_size // 2, avatar_size // 2), avatar_size // 2, 255, -1)
+
+            x_offset = (width - avatar_size) // 2
+            y_offset = (height - avatar_size) // 2
+            self.avatar_region = (slice(y_offset, y_offset + avatar_size), slice(x_offset, x_offset + avatar_size))
+            self.avatar_patch = avatar_resized
+            self.avatar_mask = mask
+
+            self.apply_overlay(self.base)
+
+    def new_frame(self, out: np.ndarray = None) -> np.ndarray:
+        """返回静态底图的一份拷贝，用于绘制新的一帧；提供 out 时直接复制到 out 中。"""
+        if out is None:
+            return self.base.copy()
+        np.copyto(out, self.base)
+        return out
+
+    def apply_overlay(self, frame: np.ndarray) -> None:
+        """将带圆形蒙版的头像原地覆盖到帧图像上（没有头像时不做任何事）。"""
+        if self.avatar_patch is None:
+            return
+        cv2.copyTo(self.avatar_patch, self.avatar_mask, frame[self.avatar_region])
+
+    def new_frames(self, count: int, out: np.ndarray = None) -> np.ndarray:
+        """返回 count 份静态底图组成的 (count, H, W, 3) 数组（一次广播拷贝）；提供 out 时直接写入 out。"""
+        if out is None:
+            out = np.empty((count, self.height, self.width, 3), dtype=np.uint8)
+        np.copyto(out, self.base[None])
+        return out
+
+    def apply_overlay_batch(self, frames: np.ndarray) -> None:
+        """把头像一次覆盖到 (n, H, W, 3) 的所有帧上，结果与逐帧 apply_overlay 相同。"""
+        if self.avatar_patch is None:
+            return
+        mask = self.avatar_mask > 0
+        frames[(slice(None), *self.avatar_region)][:, mask] = self.avatar_patch[mask]
+
+# --- 量化振幅帧缓存 ---
+def quantize_amplitude(envelope_value: float, height: int) -> int:
+    """
+    将 [0, 1] 的包络值量化为整数像素振幅（最大为画面高度的40%）。
+
+    波形只由这个整数振幅决定，量化值相同的帧画面完全相同，可以直接复用。
+    """
+    return int(envelope_value * (height * 0.4))
+
+def quantize_envelope(envelope: np.ndarray, height: int) -> np.ndarray:
+    """quantize_amplitude 的向量化版本，结果与逐帧调用完全一致（包络非负，向零取整）。"""
+    return (envelope.astype(np.float64) * (height * 0.4)).astype(np.int64)
+
+def find_held_frames(levels: np.ndarray, previous: np.ndarray | None = None) -> np.ndarray:
+    """
+    标记与前一帧量化绘制参数相同的帧（画面完全相同，可以只延长前一帧的显示时间）。
+
+    Args:
+        levels (np.ndarray): 同一片段样式下连续帧的量化绘制参数，第一维为帧（正弦波为振幅，柱状图为每柱高度）。
+        previous (np.ndarray | None, optional): levels[0] 之前一帧的值，None 表示前一帧样式不同或不存在。
 
     Returns:
-        tuple[int, np.ndarray]: 包含帧序号和生成的图像 NumPy 数组的元组。
-                                返回帧序号是为了在主进程中排序。
-    """
-    # 从全局变量访问数据
-    y = worker_audio_data
-    params = worker_params
-    sr = params['sr']
-    width = params['width']
-    height = params['height']
-    fps = params['fps']
-    background_bgr = params['background_bgr']
-    waveform_bgr = params['waveform_bgr']
-    avatar_img = params.get('avatar_img')
-    total_samples = len(y)
-    
-    # 根据当前帧计算音频位置
-    current_sample = int(frame_n * (total_samples / params['total_frames']))
-    
-    # 创建帧图像
-    frame_image = np.full((height, width, 3), background_bgr, dtype=np.uint8)
-    
-    # 在固定位置创建正弦波曲线
-    points = []
-    
-    # 定义波形需要采样的点数
-    num_points = width
-    
-    # 计算中心线
-    center_y = height // 2
-    
-    # 获取当前时间点的音频振幅
-    if 0 <= current_sample < total_samples:
-        amplitude = abs(y[current_sample]) * 4.0  # 放大振幅以使波形更加明显
-        # 限制最大振幅为画面高度的40%
-        max_amplitude = height * 0.4
-        amplitude = min(amplitude * max_amplitude, max_amplitude)
+        np.ndarray: 形状为 (len(levels),) 的 bool 数组。
+    """
+    held = np.zeros(len(levels), dtype=bool)
+    if len(levels) > 1:
+        held[1:] = (levels[1:] == levels[:-1]).reshape(len(levels) - 1, -1).all(axis=1)
+    if len(levels):
+        held[0] = previous is not None and np.array_equal(levels[0], previous)
+    return held
+
+class FrameCache:
+    """
+    按 (片段样式, 量化振幅) 缓存已渲染帧的 LRU 缓存，总容量按字节限制。
+    """
+
+    def __init__(self, max_bytes: int):
+        """
+        Args:
+            max_bytes (int): 缓存帧占用内存的上限（字节），超出时淘汰最久未使用的帧。
+        """
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._frames = OrderedDict()
+
+    def get(self, key) -> np.ndarray | None:
+        """获取缓存帧，未命中时返回 None。"""
+        frame = self._frames.get(key)
+        if frame is not None:
+            self._frames.move_to_end(key)
+        return frame
+
+    def put(self, key, frame: np.ndarray) -> None:
+        """缓存一帧，并按 LRU 顺序淘汰直到总字节数不超过上限。"""
+        if frame.nbytes > self.max_bytes:
+            return
+        old = self._frames.pop(key, None)
+        if old is not None:
+            self.current_bytes -= old.nbytes
+        self._frames[key] = frame
+        self.current_bytes += frame.nbytes
+        while self.current_bytes > self.max_bytes:
+            _, evicted = self._frames.popitem(last=False)
+            self.current_bytes -= evicted.nbytes
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+class FrameCacheStats:
+    """
+    汇总一个片段的帧缓存命中情况，用于报告命中率和节省的渲染时间。
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.held = 0               # 可变帧率模式下与前一帧相同、未绘制也未编码的帧
+        self.render_seconds = 0.0  # 未命中帧的实际渲染耗时总和
+
+    def record_batch(self, frames: int, render_seconds: float) -> None:
+        """批量渲染不经过帧缓存，整批计为未命中。"""
+        self.misses += frames
+        self.render_seconds += render_seconds
+
+    def record(self, cache_hit: bool, render_seconds: float) -> None:
+        if cache_hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.render_seconds += render_seconds
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @property
+    def saved_seconds(self) -> float:
+        """按未命中帧的平均渲染耗时估算命中帧节省的时间。"""
+        if self.misses == 0:
+            return 0.0
+        return self.hits * (self.render_seconds / self.misses)
+
+    def summary(self) -> str:
+        return (f"帧缓存: 命中 {self.hits}/{self.hits + self.misses} ({self.hit_rate:.1%}), "
+                f"渲染耗时 {self.render_seconds:.2f}s, 估计节省 {self.saved_seconds:.2f}s")
+
+    def held_summary(self, total_frames: int) -> str:
+        rate = self.held / total_frames if total_frames else 0.0
+        return f"可变帧率: {self.held}/{total_frames} 帧 ({rate:.1%}) 与前一帧相同，只延长前一帧的显示时间"
+
+def render_frame(level, static_layer: StaticLayer, waveform_bgr: tuple[int, int, int],
+                 out: np.ndarray = None) -> np.ndarray:
+    """
+    在工作进程中按给定的量化绘制参数渲染一帧：复制静态底图、由可视化器绘制波形、覆盖头像。
+
+    提供 out（例如共享内存槽位）时直接渲染到 out 中，不分配新数组。
+    """
+    # 从预合成的静态图层复制出帧图像（仅一次内存拷贝）
+    frame_image = static_layer.new_frame(out)
+
+    worker_params['visualizer'].draw(frame_image, level, waveform_bgr, worker_params['visualizer_tables'])
+
+    # 头像盖在波形之上，只需把头像区域按蒙版覆盖回去
+    static_layer.apply_overlay(frame_image)
+    return frame_image
+
+def get_static_layer(style: tuple) -> StaticLayer:
+    """
+    按片段样式 (头像路径, 背景色, 波形色) 获取静态图层，工作进程内按 LRU 缓存最近使用的几个。
+    同一片段的所有任务、以及使用同一主播样式的其他片段都可以复用。
+    """
+    layer = worker_static_layers.get(style)
+    if layer is None:
+        avatar_path, background_bgr, _ = style
+        layer = StaticLayer(worker_params['width'], worker_params['height'], background_bgr,
+                            load_avatar_image(avatar_path))
+        worker_static_layers[style] = layer
+        while len(worker_static_layers) > MAX_WORKER_STATIC_LAYERS:
+            worker_static_layers.popitem(last=False)
     else:
-        amplitude = 0
-    
-    # 生成正弦波的点
-    for i in range(num_points):
-        # 使用正弦函数创建波形
-        # 根据x坐标变化正弦的相位
-        phase = i / width * 8 * np.pi  # 控制波形周期数
-        y_offset = int(amplitude * np.sin(phase))
-        point_y = center_y + y_offset
-        
-        # 确保y坐标在图像范围内
-        point_y = max(0, min(height - 1, point_y))
-        points.append((i, point_y))
-    
-    # 绘制正弦波曲线
-    if len(points) > 1:
-        # 使用线条连接所有点
-        for i in range(len(points) - 1):
-            pt1 = points[i]
-            pt2 = points[i + 1]
-            cv2.line(frame_image, pt1, pt2, waveform_bgr, 2)  # 线宽为2
-    
-    # 如果有头像，在中心位置绘制带圆形蒙版的头像
-    if avatar_img is not None:
-        # 获取头像尺寸
-        avatar_h, avatar_w = avatar_img.shape[:2]
-        
-        # 计算头像在视频中的位置（中心）
-        avatar_size = min(height // 3, width // 3)  # 限制头像大小为视频尺寸的1/3
-        avatar_resized = cv2.resize(avatar_img, (avatar_size, avatar_size), interpolation=cv2.INTER_AREA)
-        
-        # 创建圆形蒙版
-        mask = np.zeros((avatar_size, avatar_size), dtype=np.uint8)
-        center = (avatar_size // 2, avatar_size // 2)
-        radius = avatar_size // 2
-        cv2.circle(mask, center, radius, 255, -1)
-        
-        # 计算头像在视频中的位置
-        x_offset = (width - avatar_size) // 2
-        y_offset = (height - avatar_size) // 2
-        
-        # 应用圆形蒙版并合并头像到帧
-        for c in range(0, 3):
-            roi = frame_image[y_offset:y_offset+avatar_size, x_offset:x_offset+avatar_size, c]
-            masked_avatar = cv2.bitwise_and(avatar_resized[:, :, c], avatar_resized[:, :, c], mask=mask)
-            masked_roi = cv2.bitwise_and(roi, roi, mask=cv2.bitwise_not(mask))
-            frame_image[y_offset:y_offset+avatar_size, x_offset:x_offset+avatar_size, c] = masked_roi + masked_avatar
-    
-    # 返回帧序号和图像数据
-    return frame_n, frame_image
+        worker_static_layers.move_to_end(style)
+    return layer
+
+def process_frame_range(task: tuple) -> list[tuple]:
+    """
+    由每个工作进程执行的函数，渲染一段连续帧。
+
+    任务中携带片段样式和这段帧对应的包络切片，因此同一个常驻进程池可以依次（或交错）渲染不同片段。
+    使用共享内存时，第 n 帧渲染进槽位 slot_base + n % 每路槽位数，结果中只返回槽位序号；
+    slot_base 区分同时渲染的不同片段各自使用的槽位。否则返回帧数组本身（经进程池结果管道传输）。
+    held 中标记的帧与前一帧画面相同，不绘制，结果中的帧数据为 None，由写入端延长前一帧。
+
+    Args:
+        task (tuple): (片段样式, 起始帧序号, 量化绘制参数切片, 槽位起点, held)。
+                      片段样式为 (头像路径, 背景色 BGR, 波形色 BGR)，held 为 bool 数组或 None。
+
+    Returns:
+        list[tuple[int, int | np.ndarray | None, bool, float]]: 每帧的 (帧序号, 槽位序号或帧数组, 是否命中帧缓存, 渲染耗时)。
+    """
+    style, start, levels, slot_base, held = task
+    static_layer = get_static_layer(style)
+    waveform_bgr = style[2]
+
+    results = []
+    for offset in range(len(levels)):
+        frame_n = start + offset
+        if held is not None and held[offset]:
+            results.append((frame_n, None, True, 0.0))
+            continue
+        # 量化绘制参数已在主进程中计算：正弦波为整数振幅，柱状图为每柱高度数组
+        level = levels[offset]
+        out = None
+        if worker_frame_ring is not None:
+            slot = slot_base + frame_n % worker_params['frame_ring_lane_slots']
+            out = worker_frame_ring.slot(slot)
+        frame_image, cache_hit, render_seconds = _render_frame_cached(style, level, static_layer, waveform_bgr, out)
+        results.append((frame_n, slot if out is not None else frame_image, cache_hit, render_seconds))
+    return results
+
+def process_timeline_range(parts: list[tuple]) -> list[tuple]:
+    """
+    渲染一段可能跨越多个片段的连续帧：parts 为按帧序号排列的若干 process_frame_range 任务，
+    每个部分使用各自的片段样式。用于整集连续渲染时在片段边界切换静态图层。
+    """
+    results = []
+    for part in parts:
+        results.extend(process_frame_range(part))
+    return results
+
+def render_frame_batch(levels: np.ndarray, static_layer: StaticLayer, waveform_bgr: tuple[int, int, int],
+                       out: np.ndarray = None) -> np.ndarray:
+    """
+    一次渲染 len(levels) 个连续帧，得到 (n, H, W, 3) 数组：广播复制静态底图、批量绘制波形、批量覆盖头像。
+
+    提供 out（例如一段连续的共享内存槽位）时直接渲染到 out 中。
+    """
+    frames = static_layer.new_frames(len(levels), out)
+    worker_params['visualizer'].draw_batch(frames, levels, waveform_bgr, worker_params['visualizer_tables'])
+    static_layer.apply_overlay_batch(frames)
+    return frames
+
+def split_frame_runs(start: int, count: int, held: np.ndarray | None, max_run: int,
+                     lane_slots: int | None = None) -> list[tuple[int, int, bool]]:
+    """
+    把帧 [start, start + count) 切成若干连续的批：held 取值相同的帧为一段，每段不超过 max_run 帧；
+    给出 lane_slots 时还在槽位序号回绕处切开，使每批对应一段连续的槽位。
+
+    Returns:
+        list[tuple[int, int, bool]]: 每批的 (起始帧序号, 帧数, 是否为延长前一帧的帧)。
+    """
+    if held is None:
+        held = np.zeros(count, dtype=bool)
+    cuts = set(np.flatnonzero(held[1:] != held[:-1]) + 1)
+    cuts.update(range(max_run, count, max_run))
+    if lane_slots:
+        first_wrap = (lane_slots - start % lane_slots) % lane_slots
+        cuts.update(range(first_wrap or lane_slots, count, lane_slots))
+    bounds = [0] + sorted(cut for cut in cuts if 0 < cut < count) + [count]
+    return [(start + a, b - a, bool(held[a])) for a, b in zip(bounds[:-1], bounds[1:])]
+
+def process_frame_batch(task: tuple) -> list[tuple]:
+    """
+    由每个工作进程执行的批量渲染函数，任务格式同 process_frame_range。
+
+    连续的待绘制帧作为一批渲染进 (n, H, W, 3) 数组（使用共享内存时为一段连续槽位），
+    每批只产生一个结果，进程池的调度、序列化和 Python 逐帧开销按批而不是按帧支付。
+
+    Returns:
+        list[tuple[int, int, int | np.ndarray | None, float]]: 每批的 (起始帧序号, 帧数, 起始槽位或帧数组, 渲染耗时)。
+            帧数据为 None 时表示这几帧与前一帧相同，由写入端延长前一帧。
+    """
+    style, start, levels, slot_base, held = task
+    static_layer = get_static_layer(style)
+    waveform_bgr = style[2]
+    lane_slots = worker_params['frame_ring_lane_slots'] if worker_frame_ring is not None else None
+
+    results = []
+    for run_start, run_count, run_held in split_frame_runs(start, len(levels), held, worker_params['batch_frames'],
+                                                           lane_slots):
+        if run_held:
+            results.append((run_start, run_count, None, 0.0))
+            continue
+        offset = run_start - start
+        out = None
+        if worker_frame_ring is not None:
+            slot = slot_base + run_start % lane_slots
+            out = worker_frame_ring.frames[slot:slot + run_count]
+        start_time = time.perf_counter()
+        frames = render_frame_batch(levels[offset:offset + run_count], static_layer, waveform_bgr, out)
+        render_seconds = time.perf_counter() - start_time
+        results.append((run_start, run_count, slot if out is not None else frames, render_seconds))
+    return results
+
+def process_timeline_batch(parts: list[tuple]) -> list[tuple]:
+    """process_timeline_range 的批量版本：每个片段部分用 process_frame_batch 渲染。"""
+    results = []
+    for part in parts:
+        results.extend(process_frame_batch(part))
+    return results
+
+def _render_frame_cached(style: tuple, level, static_layer: StaticLayer, waveform_bgr: tuple[int, int, int],
+                         out: np.ndarray = None) -> tuple[np.ndarray, bool, float]:
+    """按量化绘制参数渲染一帧（优先复用帧缓存），返回帧图像、是否命中缓存和渲染耗时。"""
+    # 相同样式、相同量化绘制参数的帧画面完全相同，命中缓存时直接复用
+    cache_key = (style, level.tobytes() if np.ndim(level) else int(level))
+    if worker_frame_cache is not None:
+        cached = worker_frame_cache.get(cache_key)
+        if cached is not None:
+            if out is None:
+                return cached, True, 0.0
+            np.copyto(out, cached)
+            return out, True, 0.0
+
+    start_time = time.perf_counter()
+    frame_image = render_frame(level, static_layer, waveform_bgr, out)
+    render_seconds = time.perf_counter() - start_time
+
+    if worker_frame_cache is not None:
+        # 渲染到共享内存槽位时需要拷贝一份，槽位会被后续帧复用
+        worker_frame_cache.put(cache_key, frame_image if out is None else frame_image.copy())
+
+    return frame_image, False, render_seconds
 
 # --- hex_to_bgr 函数保持不变 ---
 def hex_to_bgr(hex_color: str) -> tuple[int, int, int]:
@@ -136,6 +926,671 @@ def hex_to_bgr(hex_color: str) -> tuple[int, int, int]:
     except ValueError:
         raise ValueError(f"无法将十六进制转换为整数: {hex_color}")
 
+# --- 渲染档位 ---
+# final 为正式输出；draft 用于调整配色、头像和台词时快速预览：
+# 分辨率减半、帧率降为 10fps、最快的编码预设，绘制和编码量约为正式输出的 1/12，时间线完全相同
+RENDER_PROFILES = {
+    "final": {},
+    # 预览版直接复制 MP3 音频，不再按正式版的码率重新编码 AAC（音频编码占了预览渲染的一半以上时间）
+    "draft": {"scale": 0.5, "fps": 10, "encoder_preset": "ultrafast", "encoder_crf": 30, "audio_codec": "copy"},
+}
+
+def apply_render_profile(options: dict, profile: str = "final") -> dict:
+    """
+    按渲染档位调整 WaveformRenderService 的参数，返回新的参数字典（不修改 options）。
+
+    Args:
+        options (dict): WaveformRenderService 的关键字参数，至少包含 width、height、fps。
+        profile (str, optional): RENDER_PROFILES 中的档位名。默认为 "final"。
+    """
+    if profile not in RENDER_PROFILES:
+        raise ValueError(f"未知的渲染档位: {profile}，可选: {', '.join(RENDER_PROFILES)}")
+    overrides = dict(RENDER_PROFILES[profile])
+    options = dict(options)
+    scale = overrides.pop('scale', 1.0)
+    if scale != 1.0:
+        # H.264 + yuv420p 要求宽高为偶数
+        options['width'] = max(2, int(options['width'] * scale) // 2 * 2)
+        options['height'] = max(2, int(options['height'] * scale) // 2 * 2)
+    options.update(overrides)
+    return options
+
+def plan_cpu_budget(cpu_budget: int, concurrent_fragments: int, draw_share: float = 0.3) -> tuple[int, int]:
+    """
+    在全局 CPU 核数预算内分配帧绘制进程数和每个编码器的线程数。
+
+    绘制一帧（复用静态图层和帧缓存后）远比 H.264 编码一帧便宜，因此大部分核留给同时运行的编码器，
+    绘制进程按 draw_share 比例分配、由所有片段共享。
+
+    Args:
+        cpu_budget (int): 可用的总核数。
+        concurrent_fragments (int): 同时渲染的片段数（即同时运行的编码器数）。
+        draw_share (float, optional): 分配给绘制进程的核数比例。默认为 0.3。
+
+    Returns:
+        tuple[int, int]: (绘制进程数, 每个编码器的线程数)。
+    """
+    cpu_budget = max(1, cpu_budget)
+    concurrent_fragments = max(1, concurrent_fragments)
+    num_workers = max(1, int(round(cpu_budget * draw_share)))
+    encoder_threads = max(1, (cpu_budget - num_workers) // concurrent_fragments)
+    return num_workers, encoder_threads
+
+class WaveformRenderService:
+    """
+    持有一个常驻进程池的波形视频渲染服务。
+
+    整个 gen_video 运行期间只启动一次工作进程（以及共享内存帧槽），依次渲染所有片段；
+    每个片段的振幅包络、头像和颜色随任务下发，而不是通过进程池初始化函数传递，
+    因此不需要为每个片段重新创建进程池、在每个工作进程中重新导入 cv2/numpy。
+    """
+
+    def __init__(
+        self,
+        width: int = 1280,
+        height: int = 720,
+        fps: int = 30,
+        num_workers: int | None = None,
+        ffmpeg_path: str = "ffmpeg",
+        envelope_mode: str = "rms",
+        envelope_smoothing: int = 1,
+        attack_ms: float = 30.0,
+        release_ms: float = 120.0,
+        frame_cache_mb: int | None = None,
+        encoder: str = "ffmpeg",
+        video_codec: str = "libx264",
+        encoder_preset: str = "veryfast",
+        encoder_crf: int = 23,
+        encoder_threads: int | None = None,
+        audio_codec: str = "aac",
+        audio_bitrate: str = "192k",
+        max_buffered_frames: int = 32,
+        use_shared_memory: bool = True,
+        concurrent_fragments: int = 1,
+        cpu_budget: int | None = None,
+        streaming: bool = False,
+        stream_chunk_seconds: float = 10.0,
+        vfr: bool = True,
+        visualizer: str = "sine",
+        visualizer_options: dict | None = None,
+        batch_frames: int = 1,
+        pcm_store: bool | None = False,
+    ):
+        """
+        Args:
+            width (int, optional): 视频宽度（像素）。默认为 1280。
+            height (int, optional): 视频高度（像素）。默认为 720。
+            fps (int, optional): 帧率。默认为 30。
+            num_workers (int | None, optional): 用于生成帧的工作进程数。
+                                               如果为 None, 会尝试使用 CPU 核心数减 1。
+                                               如果为 1, 则等同于顺序执行。默认为 None。
+            ffmpeg_path (str, optional): ffmpeg 可执行文件路径。默认为 "ffmpeg"。
+            envelope_mode (str, optional): 逐帧振幅的计算方式，"rms" 或 "peak"。默认为 "rms"。
+            envelope_smoothing (int, optional): 振幅滑动平均窗口（帧数），1 表示不平滑。默认为 1。
+            attack_ms (float, optional): 振幅上升时间常数（毫秒）。默认为 30。
+            release_ms (float, optional): 振幅回落时间常数（毫秒）。默认为 120。
+            frame_cache_mb (int | None, optional): 每个工作进程按量化振幅缓存已渲染帧的内存上限（MB），0 表示禁用帧缓存。
+                                                   上限按进程计，总占用为该值乘以工作进程数。None 表示使用共享内存帧槽时
+                                                   禁用、否则为 256：帧直接渲染进槽位时，未命中的帧要额外拷贝一份放入缓存，
+                                                   命中也要拷贝进槽位，省下的只有绘制本身。实测（1280x720，2 个工作进程，
+                                                   单核，约 30% 停顿的 900 帧）共享内存模式下不用缓存 916 帧/秒、
+                                                   用 256MB 缓存 569 帧/秒；不使用共享内存时帧要经过结果管道，
+                                                   缓存可把吞吐量从 45 帧/秒提高到 94 帧/秒。默认为 None。
+            encoder (str, optional): 编码器后端。"ffmpeg" 将原始帧通过管道直接写入 ffmpeg，一次完成编码和音频封装；
+                                     "opencv" 为备用路径（cv2.VideoWriter 写临时文件后再用 ffmpeg 合并音频）。默认为 "ffmpeg"。
+            video_codec (str, optional): ffmpeg 后端使用的视频编码器。默认为 "libx264"。
+            encoder_preset (str, optional): ffmpeg 后端的编码预设。默认为 "veryfast"。
+            encoder_crf (int, optional): ffmpeg 后端的 CRF 质量参数。默认为 23。
+            encoder_threads (int | None, optional): ffmpeg 后端的编码线程数，None 表示自动。
+            audio_codec (str, optional): 输出视频的音频编码器，"copy" 表示直接复制输入音频（MP3 可以直接封装进 MP4）。
+                                         默认为 "aac"。
+            audio_bitrate (str, optional): 音频码率，audio_codec 为 "copy" 时不使用。默认为 "192k"。
+            max_buffered_frames (int, optional): 已提交但尚未写出的最大帧数 K。渲染任务按帧区间以滑动窗口提交，
+                                                 窗口满时暂停提交，内存占用与视频长度无关。默认为 32。
+            use_shared_memory (bool, optional): 是否使用 K 个共享内存帧槽传输帧数据。工作进程直接把帧渲染进槽位，
+                                                主进程把槽位交给编码器，帧数据不再经过进程池结果管道。默认为 True。
+            concurrent_fragments (int, optional): render_fragments 同时渲染的片段数。每个片段有自己的编码器和
+                                                  K 个共享内存槽位，绘制进程由所有片段共享。默认为 1。
+            cpu_budget (int | None, optional): 全局 CPU 核数预算。指定该值或同时渲染多个片段时，
+                                               未显式给出的 num_workers / encoder_threads 由 plan_cpu_budget 分配。
+            streaming (bool, optional): 流式渲染。先完整解码一遍只统计采样数，再按块解码、增量计算包络并随渲染推进，
+                                        内存占用只与块大小有关，适合数小时的整集渲染。输出与非流式模式完全相同。默认为 False。
+            stream_chunk_seconds (float, optional): 流式渲染时每块音频的时长（秒）。默认为 10。
+            vfr (bool, optional): 输出可变帧率视频。量化振幅与前一帧相同的帧（静音和停顿）不再绘制、传输和编码，
+                                  只延长前一帧的显示时间。编码器后端不支持时（opencv）自动退回恒定帧率。默认为 True。
+            visualizer (str, optional): 可视化器，"sine"（正弦波）或 "bars"（频谱柱状图，需要完整音频做 STFT，
+                                        不支持流式渲染）。默认为 "sine"。
+            visualizer_options (dict | None, optional): 传给可视化器构造函数的参数，见 VISUALIZERS。
+            batch_frames (int, optional): 每批渲染的连续帧数。大于 1 时工作进程把一段连续帧渲染为一个 (n, H, W, 3) 数组
+                                          （广播静态底图、批量绘制波形），编码器按批写入；批量模式不使用帧缓存，
+                                          批大小不超过 max_buffered_frames。1 表示逐帧渲染。实测（benchmark_batch_rendering，
+                                          1280x720，单核）正弦波各批大小的吞吐量差异在多次运行的波动范围内，
+                                          柱状图批量模式略慢，因此默认为 1。
+            pcm_store (bool | None, optional): 通过 load_pcm 读取音频：解码结果以 .npy 保存在音频旁边并以内存映射方式读取，
+                                               与音频拼接等步骤共用一次解码（流式渲染时也不再需要先解码一遍计数）。
+                                               会占用与解码后音频相同大小的磁盘空间，适合逐句的 TTS 音频。
+                                               None 表示按环境变量 PCM_STORE（默认为 1）。默认为 False。
+        """
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.ffmpeg_path = ffmpeg_path
+        self.envelope_options = {
+            'mode': envelope_mode, 'smoothing_frames': envelope_smoothing,
+            'attack_ms': attack_ms, 'release_ms': release_ms,
+        }
+        if frame_cache_mb is None:
+            frame_cache_mb = 0 if use_shared_memory else 256
+        self.frame_cache_mb = frame_cache_mb
+        self.encoder = encoder
+        self.encoder_options = {
+            'codec': video_codec, 'preset': encoder_preset,
+            'crf': encoder_crf, 'threads': encoder_threads,
+            'audio_codec': audio_codec, 'audio_bitrate': audio_bitrate,
+            'vfr': vfr and ENCODER_BACKENDS.get(encoder) is not None and ENCODER_BACKENDS[encoder].supports_vfr,
+        }
+        self.max_buffered_frames = max(1, max_buffered_frames)
+        self.batch_frames = max(1, min(batch_frames, self.max_buffered_frames))
+        self.use_shared_memory = use_shared_memory
+        self.visualizer = create_visualizer(visualizer, **(visualizer_options or {}))
+        if streaming and not self.visualizer.supports_streaming:
+            print(f"警告: {self.visualizer.name} 可视化器需要完整音频，不支持流式渲染，将一次性解码音频")
+            streaming = False
+        self.streaming = streaming
+        self.stream_chunk_seconds = stream_chunk_seconds
+        self.pcm_store = PCM_STORE_ENABLED if pcm_store is None else pcm_store
+
+        self.concurrent_fragments = max(1, concurrent_fragments)
+
+        # 确定工作进程数和编码线程数
+        if cpu_budget is not None or self.concurrent_fragments > 1:
+            self.cpu_budget = cpu_budget or os.cpu_count() or 1
+            planned_workers, planned_threads = plan_cpu_budget(self.cpu_budget, self.concurrent_fragments)
+            if num_workers is None:
+                num_workers = planned_workers
+            if encoder_threads is None:
+                self.encoder_options['threads'] = planned_threads
+        else:
+            self.cpu_budget = os.cpu_count() or 1
+        if num_workers is None:
+            num_workers = max(1, self.cpu_budget - 1) # 留一个核心给主进程/系统
+        self.num_workers = max(1, num_workers) # 至少一个进程
+
+        self.pool = None
+        self.frame_ring = None
+        # 每个同时渲染的片段占用一路槽位（K 个），用队列分配空闲的槽位路
+        self._free_lanes = queue.Queue()
+        for lane in range(self.concurrent_fragments):
+            self._free_lanes.put(lane)
+        # 某个片段出错且等不到其任务结束时置位。其他片段可能仍在使用进程池和帧槽，
+        # 等所有片段都交还槽位路后才终止进程池（见 _release_lane），下次渲染时重新启动
+        self._pool_broken = False
+        self._active_lanes = 0
+        self._lanes_lock = threading.Lock()
+
+    def render_signature(self) -> dict:
+        """返回所有影响输出视频内容的渲染参数，用作片段渲染缓存指纹的一部分。"""
+        return {
+            'renderer_version': RENDERER_VERSION,
+            'width': self.width, 'height': self.height, 'fps': self.fps,
+            'envelope': self.envelope_options,
+            'visualizer': self.visualizer.signature(),
+            'encoder': self.encoder,
+            'encoder_options': {key: value for key, value in self.encoder_options.items() if key != 'threads'},
+        }
+
+    def start(self) -> None:
+        """启动常驻进程池和共享内存帧槽（重复调用无副作用）。"""
+        if self.pool is not None:
+            return
+        if not shutil.which(self.ffmpeg_path):
+            raise FileNotFoundError(f"ffmpeg 未找到: {self.ffmpeg_path}")
+
+        # --- 准备工作进程所需的、与片段无关的参数 ---
+        params = {
+            'width': self.width, 'height': self.height, 'fps': self.fps,
+            # 可视化器及其绘制查找表（相位表、列->柱子索引等）整个运行期间只计算一次
+            'visualizer': self.visualizer,
+            'visualizer_tables': self.visualizer.prepare(self.width, self.height),
+            'batch_frames': self.batch_frames,
+            'frame_cache_bytes': max(0, self.frame_cache_mb) * 1024 * 1024,
+        }
+
+        # 创建共享内存帧槽，工作进程在初始化时按名字挂载
+        if self.use_shared_memory:
+            total_slots = self.max_buffered_frames * self.concurrent_fragments
+            self.frame_ring = SharedFrameRing(total_slots, (self.height, self.width, 3))
+            params['frame_ring_name'] = self.frame_ring.name
+            params['frame_ring_slots'] = total_slots
+            params['frame_ring_lane_slots'] = self.max_buffered_frames
+            print(f"使用 {total_slots} 个共享内存帧槽 "
+                  f"({total_slots * self.frame_ring.frame_bytes / 1024 / 1024:.1f}MB) 传输帧数据")
+
+        print(f"启动 {self.num_workers} 个常驻工作进程进行帧生成"
+              f"（同时渲染 {self.concurrent_fragments} 个片段，编码线程: {self.encoder_options['threads'] or '自动'}）...")
+        self.pool = multiprocessing.Pool(processes=self.num_workers,
+                                         initializer=init_worker,
+                                         initargs=(params,))
+
+    def close(self, terminate: bool = False) -> None:
+        """关闭进程池并释放共享内存。terminate 为 True 时强制终止仍在运行的任务。"""
+        if self.pool is not None:
+            if terminate:
+                print("正在终止工作进程...")
+                self.pool.terminate() # 强制终止所有工作进程
+            else:
+                self.pool.close()
+            self.pool.join()
+            self.pool = None
+            print("工作进程池已关闭。")
+        if self.frame_ring is not None:
+            self.frame_ring.close()
+            self.frame_ring = None
+
+    def _acquire_lane(self) -> int:
+        """占用一路空闲槽位并确保进程池已启动。进程池已异常、正等待其他片段结束时不再开始新的片段。"""
+        lane = self._free_lanes.get()
+        with self._lanes_lock:
+            if self._pool_broken:
+                self._free_lanes.put(lane)
+                raise RuntimeError("工作进程池异常，等待正在渲染的片段结束后重启，不再开始新的片段")
+            self.start()
+            self._active_lanes += 1
+        return lane
+
+    def _release_lane(self, lane: int) -> None:
+        """交还一路槽位；进程池已异常且没有其他片段在使用时，终止进程池并释放帧槽。"""
+        with self._lanes_lock:
+            self._active_lanes -= 1
+            if self._pool_broken and self._active_lanes == 0:
+                self.close(terminate=True)
+                self._pool_broken = False
+        self._free_lanes.put(lane)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(terminate=exc_type is not None)
+
+    def render_fragments(self, jobs) -> list[str]:
+        """
+        渲染一组片段，全部复用同一个常驻进程池。
+
+        concurrent_fragments 大于 1 时，多个片段在各自的线程中同时渲染：每个片段有自己的编码器和槽位，
+        共享绘制进程，使短片段的编码、音频解码和封装也能并行，所有核保持忙碌。
+        结束后打印每个片段的耗时和整体 CPU 利用率。
+
+        Args:
+            jobs (Iterable[dict]): 每个元素为 render_fragment 的关键字参数。
+
+        Returns:
+            list[str]: 输出视频路径列表，顺序与 jobs 一致。
+        """
+        jobs = list(jobs)
+        if not jobs:
+            return []
+        self.start()
+
+        start_wall = time.time()
+        start_times = os.times()
+        if self.concurrent_fragments > 1 and len(jobs) > 1:
+            with ThreadPoolExecutor(max_workers=self.concurrent_fragments) as executor:
+                # 按提交顺序取结果，任一片段失败时在这里抛出异常
+                futures = [executor.submit(self.render_fragment, **job) for job in jobs]
+                try:
+                    all_stats = [future.result() for future in futures]
+                except BaseException:
+                    # 取消尚未开始的片段；正在渲染的片段各自使用自己的槽位路，退出 with 时等它们结束
+                    for future in futures:
+                        future.cancel()
+                    raise
+        else:
+            all_stats = [self.render_fragment(**job) for job in jobs]
+        wall_seconds = time.time() - start_wall
+        end_times = os.times()
+
+        # CPU 时间 = 主进程 + 已结束的子进程（ffmpeg 编码器）+ 绘制进程的渲染耗时
+        cpu_seconds = sum(end - start for start, end in zip(start_times[:4], end_times[:4]))
+        cpu_seconds += sum(stats['render_seconds'] for stats in all_stats)
+        utilization = cpu_seconds / (wall_seconds * self.cpu_budget) if wall_seconds > 0 else 0.0
+
+        print(f"\n--- 片段渲染统计 ({len(jobs)} 个片段，同时渲染 {self.concurrent_fragments} 个) ---")
+        for stats in all_stats:
+            print(f"  {os.path.basename(stats['output_video_path'])}: {stats['frames']} 帧, "
+                  f"耗时 {stats['wall_seconds']:.2f}s")
+        print(f"总耗时: {wall_seconds:.2f}s, CPU 利用率约 {utilization:.0%} (预算 {self.cpu_budget} 核)")
+        return [job['output_video_path'] for job in jobs]
+
+    def render_fragment(
+        self,
+        mp3_path: str,
+        output_video_path: str,
+        avatar_path: str = None,
+        color_hex: str = "#00FF00",
+        background_color_hex: str = "#000000",
+    ) -> dict:
+        """
+        从 MP3 文件生成一个带有波形图（正弦波或频谱柱状图）的视频片段，可以在中心位置显示带圆形蒙版的头像。
+
+        Args:
+            mp3_path (str): 输入 MP3 文件路径。
+            output_video_path (str): 输出视频文件路径。
+            avatar_path (str, optional): 主播头像路径，如果提供则在视频中心显示带圆形蒙版的头像。
+            color_hex (str, optional): 波形颜色的十六进制代码。默认为 "#00FF00"（绿色）。
+            background_color_hex (str, optional): 背景颜色的十六进制代码。默认为 "#000000"（黑色）。
+
+        Returns:
+            dict: 渲染统计，见 render_timeline。
+        """
+        return self.render_timeline(
+            mp3_path, output_video_path,
+            segments=[{'start': 0.0, 'avatar_path': avatar_path, 'color_hex': color_hex}],
+            background_color_hex=background_color_hex,
+        )
+
+    def render_timeline(
+        self,
+        mp3_path: str,
+        output_video_path: str,
+        segments: list[dict],
+        background_color_hex: str = "#000000",
+    ) -> dict:
+        """
+        按时间线把整段音频渲染为一个连续的视频流，在片段边界切换头像和波形颜色。
+
+        整集渲染时只需一个编码器、一次音频封装，不再需要逐片段输出再合并；
+        画面切换点直接由时间线换算为帧序号，与章节时间保持同步。
+
+        Args:
+            mp3_path (str): 输入音频文件路径（整集时为已拼接好的 podcast.mp3）。
+            output_video_path (str): 输出视频文件路径。
+            segments (list[dict]): 按时间排序的片段列表，每项包含 'start'（秒）、'avatar_path'、'color_hex'。
+            background_color_hex (str, optional): 背景颜色的十六进制代码。默认为 "#000000"（黑色）。
+
+        Returns:
+            dict: 渲染统计，包含 output_video_path、frames、wall_seconds（含音频加载）、render_seconds（绘制耗时）。
+        """
+        # --- 0. 检查依赖 ---
+        start_wall = time.time()
+        if not os.path.exists(mp3_path):
+            raise FileNotFoundError(f"MP3 文件未找到: {mp3_path}")
+        if not segments:
+            raise ValueError("时间线不能为空")
+        self.start()
+
+        # --- 1. 转换颜色和加载音频 ---
+        try:
+            background_bgr = hex_to_bgr(background_color_hex)
+            # 片段样式：工作进程据此构建并缓存静态图层（背景+头像只合成一次）
+            styles = []
+            for segment in segments:
+                avatar_path = segment.get('avatar_path')
+                if avatar_path and not os.path.exists(avatar_path):
+                    print(f"警告: 头像文件不存在: {avatar_path}")
+                    avatar_path = None
+                styles.append((avatar_path, background_bgr, hex_to_bgr(segment.get('color_hex', "#00FF00"))))
+        except ValueError as e:
+            raise ValueError(f"颜色格式错误: {e}")
+
+        print(f"正在加载音频文件: {mp3_path}...")
+        start_load_time = time.time()
+        try:
+            if self.pcm_store:
+                # 映射已保存的解码结果（没有时解码一次并保存），流式模式下也直接得到精确的总采样数
+                y, sr = load_pcm(mp3_path, mono=True, ffmpeg_path=self.ffmpeg_path, store=True)
+                total_samples = len(y)
+            elif self.streaming:
+                # 帧与采样的对应关系依赖精确的总采样数，先解码一遍只计数，不保留数据
+                total_samples, sr = count_audio_samples(mp3_path, ffmpeg_path=self.ffmpeg_path)
+            else:
+                # 通过 ffmpeg 管道直接解码为单声道 float32，不依赖 librosa
+                y, sr = decode_audio(mp3_path, mono=True, ffmpeg_path=self.ffmpeg_path)
+                total_samples = len(y)
+        except Exception as e:
+            raise RuntimeError(f"加载音频失败: {e}")
+
+        duration = total_samples / sr if total_samples else 0.0
+        print(f"音频{'计数' if self.streaming else '加载'}完成: 时长={duration:.2f}s, 采样率={sr}Hz "
+              f"(耗时 {time.time() - start_load_time:.2f}s)")
+
+        if duration <= 0: raise ValueError("音频时长必须大于 0")
+
+        fps = self.fps
+        total_frames = int(duration * fps)
+
+        audio_chunks = None
+        if self.streaming:
+            # 包络随渲染推进按块计算，已提交的帧对应的包络即时丢弃
+            if self.pcm_store:
+                # 直接按块切片映射的解码结果，不启动解码进程
+                chunk = max(1, int(sr * self.stream_chunk_seconds))
+                sample_chunks = (y[start:start + chunk] for start in range(0, total_samples, chunk))
+            else:
+                audio_chunks = iter_audio_chunks(mp3_path, chunk_seconds=self.stream_chunk_seconds,
+                                                 mono=True, ffmpeg_path=self.ffmpeg_path)
+                sample_chunks = (samples for samples, _ in audio_chunks)
+            envelope = StreamingEnvelope(sample_chunks,
+                                         AmplitudeEnvelopeStream(total_samples, total_frames, fps,
+                                                                 **self.envelope_options))
+            get_envelope = envelope.slice
+            print(f"流式渲染: 每块 {self.stream_chunk_seconds:g}s 音频 "
+                  f"({int(sr * self.stream_chunk_seconds) * 4 / 1024 / 1024:.1f}MB)")
+        else:
+            # 逐帧特征（振幅包络或频谱）只计算一次，之后只把对应的切片随任务交给工作进程
+            start_envelope_time = time.time()
+            envelope = self.visualizer.analyze(y, sr, total_frames, fps, self.width, self.envelope_options)
+            print(f"{self.visualizer.name} 逐帧特征计算完成: {total_frames} 帧, {envelope.nbytes / 1024:.1f}KB "
+                  f"(原始音频 {y.nbytes / 1024 / 1024:.1f}MB, 耗时 {time.time() - start_envelope_time:.2f}s)")
+            del y # 原始音频不再需要
+            get_envelope = lambda start, end: envelope[start:end]
+
+        # 片段起始时间换算为起始帧；第一个片段总是从第 0 帧开始
+        boundaries = [0] + [min(total_frames, max(0, int(round(segment['start'] * fps)))) for segment in segments[1:]]
+        if len(segments) > 1:
+            print(f"时间线包含 {len(segments)} 个片段，将在片段边界切换静态图层")
+
+        # 占用一路空闲槽位，同时渲染的片段互不覆盖彼此的共享内存槽位
+        try:
+            lane = self._acquire_lane()
+        except BaseException:
+            if audio_chunks is not None:
+                audio_chunks.close()
+            raise
+        slot_base = lane * self.max_buffered_frames
+        vfr = self.encoder_options['vfr']
+        previous = {'style': None, 'level': None}  # 上一个已提交帧的样式和量化绘制参数（任务按帧序号顺序构造）
+
+        def make_task(start, end):
+            # 把帧区间按片段边界切开，每部分带上各自的样式和包络切片
+            parts = []
+            first = bisect.bisect_right(boundaries, start) - 1
+            for i in range(first, len(boundaries)):
+                part_start = max(start, boundaries[i])
+                part_end = min(end, boundaries[i + 1] if i + 1 < len(boundaries) else end)
+                if part_start >= end:
+                    break
+                if part_end > part_start:
+                    levels = self.visualizer.quantize(get_envelope(part_start, part_end), self.height)
+                    held = None
+                    if vfr:
+                        # 样式和量化绘制参数都与前一帧相同的帧画面相同，交给编码器延长前一帧
+                        held = find_held_frames(levels, previous['level'] if previous['style'] == styles[i] else None)
+                        if part_end == total_frames:
+                            held[-1] = False  # 最后一帧总是写出，视频时长才能覆盖到音频结尾
+                        previous['style'], previous['level'] = styles[i], levels[-1].copy()
+                    parts.append((styles[i], part_start, levels, slot_base, held))
+            return parts
+
+        try:
+            render_seconds = self._encode_frames(mp3_path, output_video_path, total_frames, make_task, slot_base)
+        finally:
+            self._release_lane(lane)
+            if audio_chunks is not None:
+                audio_chunks.close()  # 结束（或中途出错时终止）解码进程
+
+        return {
+            'output_video_path': output_video_path,
+            'frames': total_frames,
+            'wall_seconds': time.time() - start_wall,
+            'render_seconds': render_seconds,
+        }
+
+    def _encode_frames(self, mp3_path: str, output_video_path: str, total_frames: int, make_task,
+                       slot_base: int = 0) -> float:
+        """
+        用常驻进程池按滑动窗口渲染所有帧，按顺序写入编码器，并与音频一起封装输出。
+        batch_frames 大于 1 时工作进程按批渲染，编码器按批写入。
+
+        Returns:
+            float: 工作进程绘制帧的总耗时（秒）。
+        """
+        # --- 2. 初始化视频编码器 (同时封装音频) ---
+        video_encoder = create_video_encoder(
+            self.encoder,
+            output_path=output_video_path, width=self.width, height=self.height, fps=self.fps,
+            audio_path=mp3_path, ffmpeg_path=self.ffmpeg_path, **self.encoder_options,
+        )
+        frame_ring = self.frame_ring
+        max_buffered_frames = self.max_buffered_frames
+        scheduler = None
+
+        try:
+            video_encoder.open()
+            print(f"使用 {self.encoder} 编码器输出视频: {output_video_path}")
+
+            # --- 3. 并行生成帧并顺序写入 ---
+            frames_written = 0          # 已写入的帧数
+            cache_stats = FrameCacheStats()
+            start_frame_gen_time = time.time()
+            last_print_time = time.time()
+
+            print(f"开始并行生成 {total_frames} 帧 (最多缓冲 {max_buffered_frames} 帧)...")
+
+            # 按帧区间滑动窗口提交任务，每个任务携带片段样式和对应的量化绘制参数
+            batched = self.batch_frames > 1
+            if batched:
+                task_fn, range_size = process_timeline_batch, self.batch_frames
+            else:
+                task_fn, range_size = process_timeline_range, max(1, max_buffered_frames // (self.num_workers * 2))
+            scheduler = OrderedFrameScheduler(self.pool, task_fn, total_frames,
+                                              max_buffered_frames=max_buffered_frames,
+                                              range_size=range_size, make_task=make_task)
+
+            # 调度器按帧序号顺序产出结果（批量模式下每项为一批连续帧），frame_data 为帧数组，
+            # 或使用共享内存时为（起始）槽位序号；为 None 时表示与前一帧相同（可变帧率），只延长前一帧
+            for item in scheduler:
+                if batched:
+                    frame_n, count, frame_data, render_seconds = item
+                    cache_hit = False
+                else:
+                    frame_n, frame_data, cache_hit, render_seconds = item
+                    count = 1
+                if frame_data is None:
+                    video_encoder.hold(count)
+                    cache_stats.held += count
+                elif batched:
+                    cache_stats.record_batch(count, render_seconds)
+                    video_encoder.write_batch(frame_ring.slots(frame_data, count) if frame_ring is not None else frame_data)
+                else:
+                    cache_stats.record(cache_hit, render_seconds)
+                    # 使用共享内存时直接把槽位交给编码器，槽位在调度器提交下一个区间时才会被复用
+                    video_encoder.write(frame_ring.slot(frame_data) if frame_ring is not None else frame_data)
+                frames_written += count
+
+                # 更新进度显示
+                current_time = time.time()
+                if current_time - last_print_time >= 1.0 or frames_written == total_frames:
+                    elapsed = current_time - start_frame_gen_time
+                    progress = frames_written / total_frames
+                    eta = (elapsed / progress) * (1 - progress) if progress > 0 else 0
+                    print(f"  写入帧: {frames_written}/{total_frames} ({progress:.1%}), "
+                          f"已耗时: {elapsed:.1f}s, 预计剩余: {eta:.1f}s", end='\r')
+                    last_print_time = current_time
+
+            # 结束进度显示
+            print()
+
+            if frames_written != total_frames:
+                # 如果发生这种情况，说明逻辑可能有问题
+                raise RuntimeError(f"处理完成，但只写入了 {frames_written}/{total_frames} 帧！")
+
+            print(f"帧生成和写入完成。总耗时: {time.time() - start_frame_gen_time:.2f}s, "
+                  f"缓冲帧峰值: {scheduler.peak_buffered_frames}/{max_buffered_frames}")
+            if self.frame_cache_mb > 0 and not batched:
+                print(cache_stats.summary())
+            if self.encoder_options['vfr']:
+                print(cache_stats.held_summary(total_frames))
+
+        except BaseException as e:
+            print(f"\n并行处理过程中发生错误: {e}")
+            # 等待本片段已提交的任务结束，之后这一路槽位才能交给其他片段；
+            # 等不到时说明工作进程异常。其他片段可能仍在使用进程池和帧槽，这里只做标记，
+            # 由最后一个交还槽位路的片段终止进程池（见 _release_lane）
+            if scheduler is not None and not scheduler.drain():
+                with self._lanes_lock:
+                    self._pool_broken = True
+            video_encoder.abort()
+            raise e # 重新抛出异常
+
+        # --- 4. 结束编码 (ffmpeg 后端在此完成封装，opencv 后端在此合并音频) ---
+        start_close_time = time.time()
+        video_encoder.close()
+        print(f"视频编码完成: {output_video_path} (收尾耗时 {time.time() - start_close_time:.2f}s)")
+        return cache_stats.render_seconds
+
+def benchmark_batch_rendering(
+    width: int = 1280,
+    height: int = 720,
+    total_frames: int = 600,
+    batch_sizes: tuple[int, ...] = (1, 4, 8, 16, 32),
+    visualizer: str = "sine",
+    num_workers: int | None = None,
+    max_buffered_frames: int = 32,
+) -> dict[int, float]:
+    """
+    对比逐帧渲染（process_frame_range）与不同批大小的批量渲染（process_frame_batch）的吞吐量。
+
+    使用与 WaveformRenderService 相同的常驻进程池、共享内存帧槽和滑动窗口调度，
+    以随机振幅渲染 total_frames 帧（不编码、不使用帧缓存），只测量绘制和调度开销。
+
+    Returns:
+        dict[int, float]: 批大小 -> 每秒渲染帧数。批大小 1 为逐帧渲染。
+    """
+    service = WaveformRenderService(width=width, height=height, num_workers=num_workers, visualizer=visualizer,
+                                    max_buffered_frames=max_buffered_frames, frame_cache_mb=0)
+    rng = np.random.default_rng(0)
+    num_values = service.visualizer.num_bars(width) if hasattr(service.visualizer, 'num_bars') else None
+    features = rng.random((total_frames, num_values) if num_values else total_frames).astype(np.float32)
+    levels = service.visualizer.quantize(features, height)
+    style = (None, (51, 51, 51), (255, 255, 0))
+
+    results = {}
+    for batch_size in batch_sizes:
+        service.batch_frames = max(1, min(batch_size, service.max_buffered_frames))
+        service.start()
+        try:
+            task_fn = process_timeline_batch if service.batch_frames > 1 else process_timeline_range
+            range_size = service.batch_frames if service.batch_frames > 1 else \
+                max(1, service.max_buffered_frames // (service.num_workers * 2))
+            scheduler = OrderedFrameScheduler(
+                service.pool, task_fn, total_frames, max_buffered_frames=service.max_buffered_frames,
+                range_size=range_size, make_task=lambda start, end: [(style, start, levels[start:end], 0, None)])
+            # 预热：让每个工作进程构建静态图层
+            for _ in OrderedFrameScheduler(service.pool, task_fn, min(total_frames, service.max_buffered_frames),
+                                           max_buffered_frames=service.max_buffered_frames, range_size=range_size,
+                                           make_task=scheduler.make_task):
+                pass
+            start_time = time.perf_counter()
+            for _ in scheduler:
+                pass
+            results[batch_size] = total_frames / (time.perf_counter() - start_time)
+        finally:
+            service.close()
+        print(f"批大小 {batch_size:>3}: {results[batch_size]:.1f} 帧/秒")
+    return results
+
 def create_animated_waveform_video_parallel(
     mp3_path: str,
     output_video_path: str,
@@ -145,16 +1600,22 @@ def create_animated_waveform_video_parallel(
     width: int = 1280,
     height: int = 720,
     fps: int = 30,
-    bar_width: int = 4,  # 保留参数但不再使用
-    gap_width: int = 1,  # 保留参数但不再使用
-    waveform_window_sec: float = 0.5,  # 保留参数但不再使用
+    bar_width: int = 4,  # 仅用于 visualizer="bars"
+    gap_width: int = 1,  # 仅用于 visualizer="bars"
+    waveform_window_sec: float = 0.05,  # 仅用于 visualizer="bars"：STFT 窗口时长
     ffmpeg_path: str = "ffmpeg",
-    num_workers: int | None = None # 新增：允许指定工作进程数
+    num_workers: int | None = None, # 新增：允许指定工作进程数
+    profile: str = "final",
+    visualizer: str = "sine",
+    **service_options,
 ) -> None:
     """
     (并行版本) 从 MP3 文件生成带有正弦波曲线波形图的视频，x 轴固定，y 值随音频变化。
     可以在视频中心位置显示带圆形蒙版的头像。
 
+    单个片段的便捷入口：创建一个临时的 WaveformRenderService，渲染完成后关闭。
+    需要连续渲染多个片段时，请直接使用 WaveformRenderService 以复用进程池。
+
     Args:
         mp3_path (str): 输入 MP3 文件路径。
         output_video_path (str): 输出视频文件路径。
@@ -164,10 +1625,17 @@ def create_animated_waveform_video_parallel(
         width (int, optional): 视频宽度（像素）。默认为 1280。
         height (int, optional): 视频高度（像素）。默认为 720。
         fps (int, optional): 帧率。默认为 30。
+        bar_width (int, optional): 频谱柱宽度（像素）。默认为 4。
+        gap_width (int, optional): 频谱柱间隔（像素）。默认为 1。
+        waveform_window_sec (float, optional): 频谱 STFT 的窗口时长（秒）。默认为 0.05。
         ffmpeg_path (str, optional): ffmpeg 可执行文件路径。默认为 "ffmpeg"。
         num_workers (int | None, optional): 用于生成帧的工作进程数。
                                            如果为 None, 会尝试使用 CPU 核心数减 1。
                                            如果为 1, 则等同于顺序执行。默认为 None。
+        visualizer (str, optional): "sine"（正弦波）或 "bars"（频谱柱状图）。默认为 "sine"。
+        profile (str, optional): 渲染档位，"final" 为正式输出，"draft" 以较低分辨率、帧率和最快编码预设快速预览。
+                                 默认为 "final"。
+        **service_options: 其余渲染选项（包络、帧缓存、编码器、缓冲帧数等），见 WaveformRenderService。
     """
     # --- 0. 检查依赖 ---
     if not shutil.which(ffmpeg_path):
@@ -175,190 +1643,20 @@ def create_animated_waveform_video_parallel(
     if not os.path.exists(mp3_path):
         raise FileNotFoundError(f"MP3 文件未找到: {mp3_path}")
 
-    # --- 1. 转换颜色和加载音频 ---
-    try:
-        waveform_bgr = hex_to_bgr(color_hex)
-        background_bgr = hex_to_bgr(background_color_hex)
-    except ValueError as e:
-        raise ValueError(f"颜色格式错误: {e}")
-
-    print(f"正在加载音频文件: {mp3_path}...")
-    start_load_time = time.time()
-    try:
-        y, sr = librosa.load(mp3_path, sr=None, mono=True)
-    except Exception as e:
-        raise RuntimeError(f"使用 librosa 加载音频失败: {e}")
-
-    duration = librosa.get_duration(y=y, sr=sr)
-    print(f"音频加载完成: 时长={duration:.2f}s, 采样率={sr}Hz (耗时 {time.time() - start_load_time:.2f}s)")
-
-    if duration <= 0: raise ValueError("音频时长必须大于 0")
-
-    total_samples = len(y)
-    total_frames = int(duration * fps)
-
-    # 加载头像（如果提供）
-    avatar_img = None
-    if avatar_path and os.path.exists(avatar_path):
-        try:
-            print(f"正在加载头像: {avatar_path}")
-            avatar_img = cv2.imread(avatar_path)
-            if avatar_img is None:
-                print(f"警告: 无法加载头像 {avatar_path}")
-            else:
-                # 转换为 BGR 格式（如果需要）
-                if len(avatar_img.shape) == 2:  # 灰度图
-                    avatar_img = cv2.cvtColor(avatar_img, cv2.COLOR_GRAY2BGR)
-                elif avatar_img.shape[2] == 4:  # 带 alpha 通道
-                    # 如果图像有 alpha 通道，提取 RGB 部分
-                    avatar_img = avatar_img[:, :, :3]
-        except Exception as e:
-            print(f"警告: 加载头像时出错: {e}")
-            avatar_img = None
-
-    # --- 准备工作进程所需参数 ---
-    params = {
-        'sr': sr, 'width': width, 'height': height, 'fps': fps,
-        'background_bgr': background_bgr, 'waveform_bgr': waveform_bgr,
-        'total_frames': total_frames,
-        'avatar_img': avatar_img
-    }
-
-    # --- 2. 初始化视频写入器 (无声) 和进程池 ---
-    temp_video_file = None
-    video_writer = None
-    pool = None # 初始化 pool 变量
-
-    try:
-        with tempfile.NamedTemporaryFile(suffix=".mp4", delete=False) as tmp_f:
-            temp_video_file = tmp_f.name
-        print(f"创建临时无声视频文件: {temp_video_file}")
-
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        video_writer = cv2.VideoWriter(temp_video_file, fourcc, float(fps), (width, height))
-        if not video_writer.isOpened():
-             raise RuntimeError("无法打开视频写入器。")
-
-        # 确定工作进程数
-        if num_workers is None:
-            cpu_count = os.cpu_count() or 1
-            num_workers = max(1, cpu_count - 1) # 留一个核心给主进程/系统
-        num_workers = max(1, num_workers) # 至少一个进程
-
-        print(f"使用 {num_workers} 个工作进程进行帧生成...")
-
-        # 创建进程池，使用 initializer 传递共享数据
-        pool = multiprocessing.Pool(processes=num_workers,
-                                    initializer=init_worker,
-                                    initargs=(y, params)) # y 是大的音频数据
-
-        # --- 3. 并行生成帧并顺序写入 ---
-        frame_buffer = {}           # 存储已生成但未写入的帧 {frame_n: frame_data}
-        next_frame_to_write = 0     # 下一个需要写入的帧序号
-        frames_written = 0          # 已写入的帧数
-        start_frame_gen_time = time.time()
-        last_print_time = time.time()
-
-        print(f"开始并行生成 {total_frames} 帧...")
-
-        # 使用 imap_unordered 获取结果，提高效率
-        results_iterator = pool.imap_unordered(process_frame, range(total_frames), chunksize=max(1, total_frames // (num_workers * 4)))
-
-        while frames_written < total_frames:
-            try:
-                # 从迭代器获取下一个结果
-                try:
-                    # 在 Python 3 中使用 next() 而不是 .next()
-                    frame_n, frame_data = next(results_iterator)
-                    frame_buffer[frame_n] = frame_data # 存入缓冲区
-                except StopIteration:
-                    # 所有任务都已提交且处理完成
-                    print("\n所有工作进程任务都已完成。")
-                    break
-            except Exception as e:
-                print(f"\n处理帧结果时出错: {e}")
-                raise e
-
-            # 检查缓冲区，写入所有按顺序准备好的帧
-            while next_frame_to_write in frame_buffer:
-                frame_to_write = frame_buffer.pop(next_frame_to_write)
-                video_writer.write(frame_to_write)
-                frames_written += 1
-                next_frame_to_write += 1
-
-                # 更新进度显示
-                current_time = time.time()
-                if current_time - last_print_time >= 1.0 or frames_written == total_frames:
-                    elapsed = current_time - start_frame_gen_time
-                    progress = frames_written / total_frames
-                    eta = (elapsed / progress) * (1 - progress) if progress > 0 else 0
-                    print(f"  写入帧: {frames_written}/{total_frames} ({progress:.1%}), "
-                          f"已耗时: {elapsed:.1f}s, 预计剩余: {eta:.1f}s", end='\r')
-                    last_print_time = current_time
-        
-        # 处理缓冲区中剩余的帧
-        if frames_written < total_frames and frame_buffer:
-            print("\n处理剩余帧缓冲区...")
-            # 尝试按顺序处理尽可能多的帧
-            while next_frame_to_write in frame_buffer and frames_written < total_frames:
-                frame_to_write = frame_buffer.pop(next_frame_to_write)
-                video_writer.write(frame_to_write)
-                frames_written += 1
-                next_frame_to_write += 1
-
-        # 结束进度显示
-        print()
-
-        if frames_written != total_frames:
-            # 如果发生这种情况，说明逻辑可能有问题
-            raise RuntimeError(f"处理完成，但只写入了 {frames_written}/{total_frames} 帧！")
-
-        print(f"帧生成和写入完成。总耗时: {time.time() - start_frame_gen_time:.2f}s")
-
-    except Exception as e:
-        print(f"\n并行处理过程中发生错误: {e}")
-        if pool:
-            print("正在终止工作进程...")
-            pool.terminate() # 强制终止所有工作进程
-            pool.join()
-        raise e # 重新抛出异常
-    finally:
-        # 确保资源被释放
-        if pool:
-            pool.close()
-            pool.join()
-            print("工作进程池已关闭。")
-        if video_writer is not None and video_writer.isOpened():
-            video_writer.release()
-            print("无声视频写入器已释放。")
-
-    # --- 4. 使用 ffmpeg 合并音频和无声视频 (与之前相同) ---
-    print(f"正在使用 ffmpeg 将音频合并到视频中...")
-    start_merge_time = time.time()
-    cmd = [
-        ffmpeg_path, '-i', temp_video_file, '-i', mp3_path,
-        '-map', '0:v:0', '-map', '1:a:0', '-c:v', 'copy',
-        '-c:a', 'aac', '-b:a', '192k', '-shortest', '-y',
-        output_video_path
-    ]
-    process = subprocess.run(cmd, capture_output=True, text=True, check=False, encoding='utf-8')
-
-    if process.returncode != 0:
-        print("--- ffmpeg 合并时 标准错误 ---")
-        print(process.stderr)
-        print("--- ffmpeg 合并时 标准输出 ---")
-        print(process.stdout)
-        print(f"警告: ffmpeg 合并失败。临时无声视频文件保留在: {temp_video_file}")
-        raise RuntimeError(f"ffmpeg 合并失败，返回码: {process.returncode}")
-    else:
-        print(f"音频视频合并成功！合并耗时: {time.time() - start_merge_time:.2f}s")
-        # --- 5. 清理临时文件 ---
-        if temp_video_file and os.path.exists(temp_video_file):
-            try:
-                os.remove(temp_video_file)
-                print(f"已清理临时无声视频文件: {temp_video_file}")
-            except OSError as e:
-                print(f"警告: 无法删除临时文件 {temp_video_file}: {e}")
+    if visualizer == "bars":
+        service_options.setdefault('visualizer_options', {
+            'bar_width': bar_width, 'gap_width': gap_width, 'window_sec': waveform_window_sec,
+        })
+    service_options = apply_render_profile({'width': width, 'height': height, 'fps': fps,
+                                            'visualizer': visualizer, **service_options}, profile)
+    with WaveformRenderService(num_workers=num_workers, ffmpeg_path=ffmpeg_path, **service_options) as service:
+        service.render_fragment(
+            mp3_path=mp3_path,
+            output_video_path=output_video_path,
+            avatar_path=avatar_path,
+            color_hex=color_hex,
+            background_color_hex=background_color_hex,
+        )
 
 # --- 示例用法 ---
 if __name__ == "__main__":
@@ -366,6 +1664,11 @@ if __name__ == "__main__":
     multiprocessing.freeze_support() # 对 Windows 打包成 exe 可能需要
 
 
+    if "--bench-batch" in sys.argv:
+        # 对比逐帧渲染与批量渲染的吞吐量: python -m cybercast.utils.waveform_utils --bench-batch
+        benchmark_batch_rendering()
+        sys.exit(0)
+
     mp3_file = "output/podcast.mp3"
     output_file = "output/podcast.mp4"
     # 可选头像文件
@@ -385,7 +1688,7 @@ if __name__ == "__main__":
             fps=30,
             bar_width=4,
             gap_width=1,
-            waveform_window_sec=0.4,
+            waveform_window_sec=0.05,
             num_workers=None # 自动检测 CPU 核心数
             # num_workers=1 # 设置为 1 可以对比顺序执行的速度
         )
@@ -2,9 +2,12 @@ import os
 import json
 import argparse
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from cybercast.tts import SambertTTS, CosyVoiceTTS
 from cybercast.utils.common_utils import *
 from cybercast.utils.audio_utils import *
+from cybercast.utils.ffmpeg_runner import timing_stats
+from cybercast.utils.pcm_assembly import assemble_episode
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-n", "--name", type=str, required=True, help="podcast name")
@@ -12,6 +15,64 @@ parser.add_argument("--transcript", type=str, default=None)
 parser.add_argument("--mc", type=str, default=None)
 parser.add_argument("--output", type=str, default=None)
 parser.add_argument("--play", type=bool, default=False)
+parser.add_argument("--tts-jobs", type=int, default=int(os.getenv("TTS_JOBS", "4")),
+                    help="同时进行的 TTS 请求数（默认读取环境变量 TTS_JOBS，未设置时为 4），1 表示逐句合成")
+parser.add_argument("--assembly", type=str, default="pcm", choices=["pcm", "concat"],
+                    help="pcm: 解码后在内存中按采样拼接再一次编码（时间线精确）；concat: 用 ffmpeg concat 拼接")
+parser.add_argument("--gap", type=float, default=0.0, help="同一说话人相邻台词之间的静音（秒），仅 pcm 模式")
+parser.add_argument("--speaker-gap", type=float, default=None, help="换人时的静音（秒），默认与 --gap 相同，仅 pcm 模式")
+parser.add_argument("--crossfade", type=float, default=0.0, help="无静音间隔时相邻台词的交叉淡化时长（秒），仅 pcm 模式")
+
+def synthesize_transcript(transcript: list[dict], mcs: dict, max_jobs: int = 4) -> list[tuple]:
+    """
+    并发合成所有台词的语音，结果按台词顺序写入每行的 audio_path 和 avatar。
+
+    TTS 请求主要在等待网络，用线程池同时发出最多 max_jobs 个请求；缓存命中的台词直接返回。
+    请求按 TTS 缓存路径（由文本、模型和音色决定）去重：缓存路径相同的台词（包括使用相同模型和音色的不同主播）
+    只请求一次，也不会有两个线程同时写同一个缓存文件。某一行失败不影响其他行，全部结束后统一返回失败列表。
+
+    Args:
+        transcript (list[dict]): 台词列表，每行包含 mc 和 line。
+        mcs (dict): 主播配置，每个主播包含 avatar、tts_model 和 tts_params。
+        max_jobs (int, optional): 同时进行的 TTS 请求数。默认为 4。
+
+    Returns:
+        list[tuple]: 失败的台词 (序号, 主播, 台词, 错误信息)，按序号排列；全部成功时为空列表。
+    """
+    failures = []
+    requests = {}  # TTS 缓存路径 -> (主播, 台词, 使用该语音的台词序号)
+    for index, item in enumerate(transcript):
+        mc = item["mc"]
+        if mc not in mcs:
+            failures.append((index, mc, item["line"], "unknown MC"))
+            continue
+        item["avatar"] = mcs[mc]["avatar"]
+        tts_params = mcs[mc]["tts_params"]
+        try:
+            cache_path = mcs[mc]["tts_model"].get_audio_path(item["line"], tts_params.get("model"), tts_params.get("voice"))
+        except AssertionError as e:
+            failures.append((index, mc, item["line"], str(e)))
+            continue
+        requests.setdefault(cache_path, (mc, item["line"], []))[2].append(index)
+
+    def synthesize(mc, line):
+        audio_path = mcs[mc]["tts_model"].generate_from_text(line, **mcs[mc]["tts_params"])
+        if audio_path is None:
+            raise RuntimeError("TTS returned no audio")
+        return audio_path
+
+    with ThreadPoolExecutor(max_workers=max(1, max_jobs), thread_name_prefix="tts") as executor:
+        futures = {executor.submit(synthesize, mc, line): indices for mc, line, indices in requests.values()}
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            indices = futures[future]
+            try:
+                audio_path = future.result()
+            except Exception as e:
+                failures.extend((index, transcript[index]["mc"], transcript[index]["line"], str(e)) for index in indices)
+                continue
+            for index in indices:
+                transcript[index]["audio_path"] = audio_path
+    return sorted(failures)
 
 def main():
     args = parser.parse_args()
@@ -59,50 +120,58 @@ def main():
             raise ValueError(f"Unknown TTS: {tts}")
         mcs[name]["tts_model"] = tts_model
         mcs[name]["tts_params"] = params
-    ts = 0
-    audio_file_list = []
-    for item in tqdm(transcript):
-        mc = item["mc"]
-        line = item["line"]
-        item["avatar"] = mcs[mc]["avatar"]
-
-        if mc not in mcs:
-            print(f"Skipping unknown MC: {mc}")
-            continue
+    failures = synthesize_transcript(transcript, mcs, args.tts_jobs)
+    if failures:
+        print(f"Failed to generate audio for {len(failures)}/{len(transcript)} lines:")
+        for index, mc, line, error in failures:
+            print(f"  Line {index + 1} [{mc}] {line}")
+            print(f"    {error}")
+        print("Lines that succeeded are cached; re-run to retry the failed ones.")
+        return
+    audio_file_list = [item["audio_path"] for item in transcript]
 
-        audio_path = mcs[mc]["tts_model"].generate_from_text(line, **mcs[mc]["tts_params"])
-        if audio_path is None:
-            print(f"Failed to generate audio for {mc}: {line}")
-            break
+    # 时长在进程内解析帧头得到，并记在 TTS 缓存目录中，重复运行时不再读取文件
+    ts = 0
+    for item, audio_path in zip(transcript, audio_file_list):
         item["ts"] = ts
-        item["audio_path"] = audio_path
         ts += get_mp3_duration(audio_path)
-        audio_file_list.append(audio_path)
     
-    if len(audio_file_list) != len(transcript):
-        print(f"Failed to generate audio for some lines. Please check the transcript_with_audio.txt file.")
-        return
+    with open(podcast_meta_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(transcript, indent=2, ensure_ascii=False))
+
+    if args.assembly == "pcm":
+        segments = assemble_episode(
+            audio_file_list, output_path,
+            speakers=[item["mc"] for item in transcript],
+            gap_seconds=args.gap,
+            speaker_gap_seconds=args.speaker_gap,
+            crossfade_seconds=args.crossfade,
+        )
+        if segments is not None:
+            # 片段与台词一一对应，直接按采样偏移写回时间戳（同一句台词出现多次时也不会混淆）
+            for item, segment in zip(transcript, segments):
+                item["ts"] = segment["start_time"]
+            with open(podcast_meta_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps(transcript, indent=2, ensure_ascii=False))
     else:
-        with open(podcast_meta_path, "w", encoding="utf-8") as f:
-            f.write(json.dumps(transcript, indent=2, ensure_ascii=False))
-
         concat_file = os.path.join(task_dir, "audio_file_list.txt")
         write_concat_file(audio_file_list, concat_file)
         concat_audios(concat_file, output_path)
 
-        if os.path.exists(output_path):
-            print(f"Podcast saved to {output_path}")
-            
-            # 更新podcast.json中的时间戳
-            segments_json = os.path.splitext(output_path)[0] + "_segments.json"
-            if os.path.exists(segments_json):
-                print("Updating timestamps in podcast.json...")
-                update_podcast_timestamps(podcast_meta_path, segments_json)
-            
-            if args.play:
-                os.system(f"ffplay -autoexit -nodisp {output_path}")
-        else:
-            print("Failed to save podcast")
+    if os.path.exists(output_path):
+        print(f"Podcast saved to {output_path}")
+        
+        # 更新podcast.json中的时间戳
+        segments_json = os.path.splitext(output_path)[0] + "_segments.json"
+        if args.assembly == "concat" and os.path.exists(segments_json):
+            print("Updating timestamps in podcast.json...")
+            update_podcast_timestamps(podcast_meta_path, segments_json)
+        
+        if args.play:
+            os.system(f"ffplay -autoexit -nodisp {output_path}")
+    else:
+        print("Failed to save podcast")
+    print(timing_stats.summary())
 
 
 if __name__ == "__main__":
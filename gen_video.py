@@ -1,12 +1,58 @@
 import os
+import time
+import shutil
 import tempfile
 import argparse
-import subprocess
+import dotenv
+# 在导入 cybercast 模块之前加载 .env，PCM_STORE、VIDEO_CACHE_DIR、FFMPEG_JOBS 等设置对视频阶段同样生效
+dotenv.load_dotenv()
 from cybercast.utils.common_utils import load_json
-from cybercast.utils.waveform_utils import create_animated_waveform_video_parallel
+from cybercast.utils.waveform_utils import WaveformRenderService, RENDER_PROFILES, VISUALIZERS, apply_render_profile
+from cybercast.utils.video_encoder import ENCODER_BACKENDS
+from cybercast.utils.render_cache import FragmentRenderCache, fragment_fingerprint
+from cybercast.utils.episode_merge import IncrementalEpisodeMerger, probe_media, concat_copy
+from cybercast.utils.ffmpeg_runner import run_ffmpeg, get_job_queue, timing_stats, FFmpegError
 
 parser = argparse.ArgumentParser()
 parser.add_argument("-n", "--name", type=str, default="earthquake")
+parser.add_argument("--continuous", action="store_true",
+                    help="按 podcast.json 时间线把整集渲染为一个连续视频（使用已拼接的 podcast.mp3），不再逐片段渲染后合并")
+parser.add_argument("-j", "--jobs", type=int, default=None,
+                    help="同时渲染的片段数，默认按 CPU 核数自动决定；所有片段共享同一个 CPU 预算")
+parser.add_argument("--no-render-cache", dest="render_cache", action="store_false",
+                    help="不使用片段渲染缓存（VIDEO_CACHE_DIR），重新渲染所有片段")
+parser.add_argument("--profile", choices=list(RENDER_PROFILES), default="final",
+                    help="渲染档位：final 为正式输出；draft 以较低分辨率、帧率和最快编码预设快速预览，输出 <name>.draft.mp4")
+parser.add_argument("--draft", dest="profile", action="store_const", const="draft", help="等同于 --profile draft")
+parser.add_argument("--batch-frames", type=int, default=1,
+                    help="每批渲染的连续帧数，大于 1 时按 (n, H, W, 3) 批量绘制和写入（默认逐帧，实测批量没有稳定收益）；"
+                         "可用 python -m cybercast.utils.waveform_utils --bench-batch 对比不同批大小")
+parser.add_argument("--full-merge", dest="incremental_merge", action="store_false",
+                    help="不复用上次合并的结果，重新拼接所有片段")
+parser.add_argument("--no-pcm-store", dest="pcm_store", action="store_false", default=None,
+                    help="不保存和复用逐句音频的解码结果（TTS 缓存目录下的 pcm/*.npy），每次重新解码；默认按环境变量 PCM_STORE")
+parser.add_argument("--visualizer", choices=list(VISUALIZERS), default=None,
+                    help="波形样式：sine 为正弦波，bars 为频谱柱状图；默认取 config.json 中的 visualizer，否则为 sine")
+parser.add_argument("--encoder", choices=list(ENCODER_BACKENDS), default="ffmpeg",
+                    help="视频编码器后端：ffmpeg 通过管道直接编码；opencv 用 cv2.VideoWriter 写临时视频再由 ffmpeg 合并音频，"
+                         "在 ffmpeg 缺少 libx264 时使用（只支持恒定帧率）")
+
+DEFAULT_COLORS = ["#FF6B6B", "#4ECDC4", "#FF6B6B", "#4ECDC4"]
+BACKGROUND_COLOR = "#333333"
+
+def get_segment_style(i: int, transcript: dict, mc_data: dict, task_dir: str) -> tuple[str | None, str]:
+    """返回第 i 行台词对应的 (头像路径, 波形颜色)。"""
+    mc_name = transcript["mc"]
+    color = mc_data[mc_name].get("wave_color", DEFAULT_COLORS[i % len(DEFAULT_COLORS)])
+
+    # 获取主播头像路径
+    avatar_path = None
+    if mc_name in mc_data:
+        avatar_path = os.path.join(task_dir, mc_data[mc_name].get("avatar"))
+        if avatar_path and not os.path.exists(avatar_path):
+            print(f"警告: 头像文件不存在: {avatar_path}")
+            avatar_path = None
+    return avatar_path, color
 
 
 def gen_video():
@@ -19,71 +65,185 @@ def gen_video():
 
     podcast_scripts = load_json(os.path.join(task_dir, "podcast.json"))
 
-    temp_video_dir = os.path.join(task_dir, "videos")
+    service_options = apply_render_profile({
+        "width": config.get("video_width", 1280),
+        "height": config.get("video_height", 960),
+        "fps": 30,
+        "num_workers": None, # 自动检测 CPU 核心数
+        "visualizer": args.visualizer or config.get("visualizer", "sine"),
+        "batch_frames": args.batch_frames,
+        "pcm_store": args.pcm_store,
+        "encoder": args.encoder,
+    }, args.profile)
+    # 预览版输出到单独的文件和片段目录，不覆盖正式版本
+    output_name = args.name if args.profile == "final" else f"{args.name}.{args.profile}"
+
+    if args.continuous:
+        return gen_continuous_video(output_name, task_dir, podcast_scripts, mc_data, service_options)
+
+    temp_video_dir = os.path.join(task_dir, "videos" if args.profile == "final" else f"videos_{args.profile}")
     os.makedirs(temp_video_dir, exist_ok=True)
 
+    # 片段按内容指纹（音频、头像、颜色、分辨率、帧率、渲染器版本）缓存在共享目录中：
+    # 台词修改后指纹改变，一定会重新渲染；其他任务中相同的片段直接复用
+    render_cache = FragmentRenderCache() if args.render_cache else None
+    render_signature = WaveformRenderService(**service_options).render_signature()
+
     video_mp4s = []
-    default_colors = ["#FF6B6B", "#4ECDC4", "#FF6B6B", "#4ECDC4"]
+    fragment_keys = []  # 每个片段的内容指纹，用于增量合并时判断哪些片段没有变化
+    render_jobs = []
+    render_keys = []
+    duplicates = []  # 与本次另一个待渲染片段指纹相同的片段，渲染完成后从该片段的输出复制
     for i, transcript in enumerate(podcast_scripts):
         mp3_path = transcript["audio_path"]
-        mc_name = transcript["mc"]
-        color = mc_data[mc_name].get("wave_color", default_colors[i % len(default_colors)])
-        
-        # 获取主播头像路径
-        avatar_path = None
-        if mc_name in mc_data:
-            avatar_path = os.path.join(task_dir, mc_data[mc_name].get("avatar"))
-            if avatar_path and not os.path.exists(avatar_path):
-                print(f"警告: 头像文件不存在: {avatar_path}")
-                avatar_path = None
+        avatar_path, color = get_segment_style(i, transcript, mc_data, task_dir)
 
         mp4_path = os.path.join(temp_video_dir, f"fragment_{i}.mp4")
-        if os.path.exists(mp4_path):
-            video_mp4s.append(mp4_path)
-            continue
-
-        create_animated_waveform_video_parallel(
-            mp3_path=mp3_path,
-            output_video_path=mp4_path,
-            avatar_path=avatar_path,  # 添加头像路径
-            color_hex=color,
-            background_color_hex="#333333",
-            width=config.get("video_width", 1280),
-            height=config.get("video_height", 960),
-            fps=30,
-            bar_width=4,
-            gap_width=1,
-            waveform_window_sec=0.4,
-            num_workers=None # 自动检测 CPU 核心数
-        )
-
-        if os.path.exists(mp4_path):
-            print(f"视频生成成功: {mp4_path}")
-            video_mp4s.append(mp4_path)
+        video_mp4s.append(mp4_path)
+        if render_cache is not None:
+            key = fragment_fingerprint(mp3_path, avatar_path, {
+                **render_signature, "color": color, "background_color": BACKGROUND_COLOR,
+            })
+            fragment_keys.append(key)
+            if key in render_keys:
+                duplicates.append((key, render_jobs[render_keys.index(key)]["output_video_path"], mp4_path))
+                continue
+            if render_cache.get(key, mp4_path):
+                continue
+            render_keys.append(key)
+
+        render_jobs.append({
+            "mp3_path": mp3_path,
+            "output_video_path": mp4_path,
+            "avatar_path": avatar_path,  # 添加头像路径
+            "color_hex": color,
+            "background_color_hex": BACKGROUND_COLOR,
+        })
+
+    # 所有片段共用一个常驻进程池，避免每个片段重复启动工作进程；
+    # 多个片段同时渲染，短片段的编码和封装也能填满所有核
+    if render_jobs:
+        concurrent_fragments = args.jobs or max(1, (os.cpu_count() or 1) // 4)
+        service_options["concurrent_fragments"] = max(1, min(concurrent_fragments, len(render_jobs)))
+        with WaveformRenderService(**service_options) as service:
+            service.render_fragments(render_jobs)
+
+    for i, job in enumerate(render_jobs):
+        if os.path.exists(job["output_video_path"]):
+            print(f"视频生成成功: {job['output_video_path']}")
+            if render_cache is not None:
+                render_cache.put(render_keys[i], job["output_video_path"])
         else:
-            print(f"视频生成失败: {mp4_path}")
+            print(f"视频生成失败: {job['output_video_path']}")
+    for key, source_path, mp4_path in duplicates:
+        # 直接复制本次渲染的输出；缓存条目可能已被 put 的 LRU 淘汰（例如 VIDEO_CACHE_MB 小于本次输出），只作后备
+        if os.path.exists(source_path):
+            shutil.copyfile(source_path, mp4_path)
+        else:
+            render_cache.get(key, mp4_path)
+    if render_cache is not None:
+        print(render_cache.summary())
+
+    video_mp4s = [mp4_path for mp4_path in video_mp4s if os.path.exists(mp4_path)]
 
     if len(video_mp4s) != len(podcast_scripts):
         raise Exception(f"视频生成失败: {len(video_mp4s)} != {len(podcast_scripts)}")
 
     # merge all video_mp4s into one file
-    merge_video_mp4s(video_mp4s, os.path.join(task_dir, f"{args.name}.mp4"))
+    merge_video_mp4s(video_mp4s, os.path.join(task_dir, f"{output_name}.mp4"),
+                     fingerprints=fragment_keys if render_cache is not None else None,
+                     incremental=args.incremental_merge)
+    print(timing_stats.summary())
     return video_mp4s
 
-def merge_video_mp4s(video_mp4s, output_video_path):
+def gen_continuous_video(name: str, task_dir: str, podcast_scripts: list[dict], mc_data: dict, service_options: dict):
+    """
+    整集连续渲染：以 podcast.json 中每行的 ts 为切换点，把已拼接的 podcast.mp3 渲染为一个视频流。
+
+    只启动一次编码器、只封装一次音频，不产生逐片段的临时视频，也不需要 merge_video_mp4s；
+    画面切换点与章节时间线一致，保证音画同步。
+    """
+    audio_path = os.path.join(task_dir, "podcast.mp3")
+    if not os.path.exists(audio_path):
+        raise FileNotFoundError(f"整集音频不存在，请先生成 podcast.mp3: {audio_path}")
+
+    segments = []
+    for i, transcript in enumerate(podcast_scripts):
+        avatar_path, color = get_segment_style(i, transcript, mc_data, task_dir)
+        segments.append({
+            "start": float(transcript.get("ts", 0.0)),
+            "avatar_path": avatar_path,
+            "color_hex": color,
+        })
+
+    output_video_path = os.path.join(task_dir, f"{name}.mp4")
+    # 整集音频可能长达数小时，流式按块解码和计算包络，内存占用与时长无关；
+    # 解码结果过大，不保存到磁盘
+    with WaveformRenderService(**{**service_options, "pcm_store": False}, streaming=True) as service:
+        service.render_timeline(audio_path, output_video_path, segments, background_color_hex=BACKGROUND_COLOR)
+
+    print(f"整集视频生成成功: {output_video_path}")
+    return [output_video_path]
+
+def merge_video_mp4s(video_mp4s, output_video_path, fingerprints=None, incremental=True):
     """
     使用ffmpeg合并多个MP4视频文件为一个视频文件
+
+    所有片段的编码参数相同时（同一渲染配置输出的片段总是如此），音视频都直接复制、不重新编码，
+    耗时只与文件大小有关；参数不同时才退回逐片段提取音频、重新编码 AAC 的合并方式。
+    incremental 为 True 时使用 IncrementalEpisodeMerger：复用上次合并中指纹未变的最长片段前缀，只追加其后的片段。
     
     Args:
         video_mp4s (list): 要合并的视频文件路径列表
         output_video_path (str): 输出视频的文件路径
+        fingerprints (list, optional): 每个片段的内容指纹，为 None 时按文件大小和修改时间判断片段是否变化
+        incremental (bool, optional): 是否增量合并。默认为 True
     
     Returns:
         bool: 合并是否成功
     """
     if not video_mp4s:
         raise ValueError("视频列表不能为空")
-    
+    for video_file in video_mp4s:
+        if not os.path.exists(video_file):
+            raise FileNotFoundError(f"找不到视频文件: {video_file}")
+
+    start_time = time.time()
+    merger = IncrementalEpisodeMerger(output_video_path)
+    if incremental:
+        try:
+            if merger.merge(video_mp4s, fingerprints):
+                print(f"视频合并成功（直接复制流，耗时 {time.time() - start_time:.2f}s）: {output_video_path}")
+                return True
+            print("片段编码参数不一致或合并结果未通过同步检查，改为重新编码音频合并")
+        except FFmpegError as e:
+            print(f"增量合并失败，改为重新编码音频合并: {e}")
+        merger.clear()
+        return merge_video_mp4s_reencode(video_mp4s, output_video_path)
+
+    merger.clear()  # 完整合并后，上次的增量合并结果不再对应输出
+    # 逐片段探测编码参数，并发运行
+    stream_params = [info['streams'] for info in get_job_queue().map(probe_media, video_mp4s)]
+    if stream_params[0] is not None and all(params == stream_params[0] for params in stream_params):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            concat_copy(video_mp4s, output_video_path, os.path.join(temp_dir, "video_list.txt"))
+            print(f"视频合并成功（直接复制流，耗时 {time.time() - start_time:.2f}s）: {output_video_path}")
+            return True
+        except FFmpegError as e:
+            print(f"直接复制流合并失败，改为重新编码音频合并: {e}")
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    else:
+        mismatched = [video_mp4s[i] for i, params in enumerate(stream_params) if params != stream_params[0]]
+        print(f"片段编码参数不一致，改为重新编码音频合并: {mismatched[:3] or video_mp4s[:1]}")
+    return merge_video_mp4s_reencode(video_mp4s, output_video_path)
+
+def merge_video_mp4s_reencode(video_mp4s, output_video_path):
+    """
+    逐片段提取无声视频和 WAV 音频，拼接视频流、用 filter_complex 拼接音频并重新编码为 AAC。
+    用于编码参数不一致、无法直接复制流的片段。
+    """
     # 创建临时目录
     temp_dir = tempfile.mkdtemp()
     video_list_file = os.path.join(temp_dir, "video_list.txt")
@@ -104,16 +264,15 @@ def merge_video_mp4s(video_mp4s, output_video_path):
             # 提取音频为WAV格式
             audio_file = os.path.join(temp_dir, f"audio_{i}.wav")
             audio_files.append(audio_file)
-            
-            # 提取没有音频的视频
-            subprocess.run([
-                "ffmpeg", "-i", video_file, "-c:v", "copy", "-an", "-y", silent_video
-            ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            
-            # 提取音频为WAV格式
-            subprocess.run([
-                "ffmpeg", "-i", video_file, "-vn", "-acodec", "pcm_s16le", "-y", audio_file
-            ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        # 逐片段的提取互不依赖，交给共享的 ffmpeg 任务队列并发运行
+        extract_cmds = []
+        extract_labels = []
+        for video_file, silent_video, audio_file in zip(video_mp4s, silent_videos, audio_files):
+            extract_cmds.append(["ffmpeg", "-i", video_file, "-c:v", "copy", "-an", "-y", silent_video])
+            extract_cmds.append(["ffmpeg", "-i", video_file, "-vn", "-acodec", "pcm_s16le", "-y", audio_file])
+            extract_labels += [f"extract_video: {video_file}", f"extract_audio: {video_file}"]
+        get_job_queue().run_all(extract_cmds, extract_labels)
         
         # 创建静音视频列表文件
         with open(video_list_file, "w") as f:
@@ -122,10 +281,10 @@ def merge_video_mp4s(video_mp4s, output_video_path):
         
         # 合并没有音频的视频
         temp_video = os.path.join(temp_dir, "temp_video.mp4")
-        subprocess.run([
+        run_ffmpeg([
             "ffmpeg", "-f", "concat", "-safe", "0", "-i", video_list_file, 
             "-c", "copy", "-y", temp_video
-        ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        ], label="concat_video")
         
         # 合并音频文件
         temp_audio = os.path.join(temp_dir, "temp_audio.wav")
@@ -139,27 +298,26 @@ def merge_video_mp4s(video_mp4s, output_video_path):
             filter_complex += f"[{i}:0]"
         filter_complex += f"concat=n={len(audio_files)}:v=0:a=1[outa]"
         
-        subprocess.run([
+        run_ffmpeg([
             "ffmpeg", *audio_inputs, "-filter_complex", filter_complex, 
             "-map", "[outa]", "-y", temp_audio
-        ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        ], label="concat_audio")
         
         # 最后，将合并的视频和音频组合在一起
-        subprocess.run([
+        run_ffmpeg([
             "ffmpeg", "-i", temp_video, "-i", temp_audio, "-c:v", "copy", 
             "-c:a", "aac", "-b:a", "192k", "-shortest", "-y", output_video_path
-        ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        ], label="mux_episode")
         
         print(f"视频合并成功: {output_video_path}")
         return True
         
-    except subprocess.CalledProcessError as e:
+    except FFmpegError as e:
         print(f"视频合并失败，错误代码: {e.returncode}")
         print(f"错误输出: {e.stderr}")
         return False
     finally:
         # 清理临时文件
-        import shutil
         if os.path.exists(temp_dir):
             shutil.rmtree(temp_dir)
 